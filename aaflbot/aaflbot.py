@@ -1,24 +1,211 @@
 import asyncio
+import io
+import itertools
+import os
+import signal
+import tempfile
+import time
+import types
+import typing
 import discord
+from discord import app_commands
 from discord.ext import commands, menus, tasks
 
-
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='/', intents=intents)
-
-teams = {}
-players = {}
-rostercap = 10
-TEAM_CAPTAIN_ROLE = "Franchise Owner"
-
-@bot.event
-async def on_ready():
-    print(f'Logged in as {bot.user.name}')
-    print('------')
-
-# Assuming you have these dictionaries defined somewhere
-# players = {}
-# teams = {}
+import bulk
+from api import LeagueAPI
+from bus import Bus
+from draft import DEFAULT_PICK_SECONDS, Draft, DraftError
+from events import describe, parse_time
+from guilds import GuildLeague, Leagues, guild_path
+from league import TeamTotals
+from members import MemberCache, bot_options
+from metrics import Metrics, get_logger, setup_logging
+from outbox import Outbox
+from pages import CachedPageSource, PageCache, ReplyMenuPages, page_bounds
+from pending import PendingActions
+from rankings import ALL, Rankings
+from resync import Resync
+from rolesync import RoleSync
+from storage import SQLiteStorage
+from timers import TimerHeap
+from trades import TradeError
+from votes import VoteEngine
+
+
+# AAFLBOT_LEAN=1 connects with only the intents the commands need and
+# without chunking members; they are looked up on demand via member_cache
+LEAN_MODE = os.environ.get('AAFLBOT_LEAN', '') not in ('', '0')
+
+# launcher.py runs several worker processes, each connecting the shards in
+# AAFLBOT_SHARD_IDS (of AAFLBOT_SHARD_COUNT) and owning their guilds' leagues.
+# Without them one process runs every shard.
+SHARD_COUNT = int(os.environ.get('AAFLBOT_SHARD_COUNT', '0')) or None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ.get('AAFLBOT_SHARD_IDS', '').split(',') if shard_id] or None
+WORKERS = int(os.environ.get('AAFLBOT_WORKERS', '1'))
+bot = commands.AutoShardedBot(command_prefix='/', shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **bot_options(LEAN_MODE))
+
+log = get_logger()
+
+# Command latency histograms and REST call/rate-limit counters, see /stats
+metrics = Metrics()
+metrics.instrument_http(bot.http)
+
+# Replies, DMs and reactions go out through per-channel queues; short
+# replies that back up in a channel are merged into one message. The
+# global rate limit is per bot, so the workers split it.
+outbox = Outbox(metrics, per_second=max(1, 40 // WORKERS))
+metrics.gauge('outbox_depth', lambda: outbox.depth)
+
+OFFER_TIMEOUT = 86400  # Seconds a sign offer or trade confirmation stays open
+TRADE_VOTE_SECONDS = 20  # Longest a trade approval vote stays open
+TRADE_VOTE_QUORUM = 1  # Votes needed before a trade can be approved
+TRADE_VOTER_ROLES = None  # Role names allowed to vote on trades; None means any team role
+AUDIT_SECONDS = 1800  # How often each league's team roles are audited
+
+# Every guild is a league of its own, stored in its own partition of the
+# database with its own event log file (the guild ID goes before the
+# extension). Roster caps and the captain role name are per league settings.
+DB_PATH = os.environ.get('AAFLBOT_DB', 'aaflbot.db')
+EVENTS_PATH = os.environ.get('AAFLBOT_EVENTS', 'aaflbot.events')
+# The guild that takes over a league stored before leagues were per guild;
+# if unset, the one guild the bot is in (if it is in only one)
+HOME_GUILD_ID = int(os.environ.get('AAFLBOT_HOME_GUILD', '0'))
+
+def owns_guild(guild_id):
+    # Whether this worker's shards include the guild
+    return SHARD_IDS is None or (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+def owns_action(action):
+    # Offers from before leagues were per guild are left to shard 0's worker
+    guild_id = action.get('guild_id')
+    return owns_guild(guild_id) if guild_id else SHARD_IDS is None or 0 in SHARD_IDS
+
+# Notifications to and from the other workers, relayed by launcher.py over
+# a Unix socket; without AAFLBOT_BUS there are no other workers
+bus = Bus(os.environ.get('AAFLBOT_BUS'), name=','.join(map(str, SHARD_IDS)) if SHARD_IDS else None)
+
+# Sign offers and trade confirmations waiting on a reaction, keyed by
+# message; they belong to no league partition
+action_storage = SQLiteStorage(DB_PATH)
+pending = PendingActions(action_storage)
+
+# Trade approval votes tallied live from reaction events
+votes = VoteEngine()
+
+# Rendered /teamlist and /roster pages, invalidated by league.version
+page_cache = PageCache()
+
+def is_pinned(guild_id, user_id):
+    state = leagues.peek(guild_id)
+    return state is not None and (state.league.team_of(user_id) is not None or state.league.is_captain(user_id))
+
+# Members looked up by ID; players rostered in the guild's league and
+# captains are never evicted
+member_cache = MemberCache(pinned=is_pinned)
+
+# Optional read-only JSON API over the leagues (see api.py) for the league
+# website and stream overlays, on AAFLBOT_API_PORT; launcher.py gives each
+# worker its own port, counting up from that one
+API_PORT = int(os.environ.get('AAFLBOT_API_PORT', '0'))
+API_HOST = os.environ.get('AAFLBOT_API_HOST', '127.0.0.1')
+
+def open_league(guild_id):
+    # League state is persisted write-behind: commands only mark what
+    # changed and flush_storage_task writes the batch out in the background.
+    # Every mutation is also appended to the league's history log for
+    # /history and /asof.
+    state = GuildLeague(guild_id, SQLiteStorage(DB_PATH, guild_id), guild_path(EVENTS_PATH, guild_id))
+    state.load()
+    league = state.league
+    league.on_change(roster=member_cache.repin)
+
+    # Team roles are reconciled in the background for players marked dirty
+    state.role_sync = RoleSync(bot, team_of=league.team_of, team_names=lambda: league.teams.keys(), members=member_cache,
+                               guild_id=guild_id)
+    league.on_change(roster=state.role_sync.mark)
+
+    league.on_change(roster=lambda player_id: index_player_name(state, player_id))
+    state.start()
+    # A draft that was running when the bot stopped carries on
+    if state.settings.get('draft'):
+        state.draft = Draft.restore(league, state.settings['draft'])
+        draft_clock.schedule(guild_id, state.draft.deadline)
+    # The first audit of the league's roles is due now, then every
+    # AUDIT_SECONDS (see audit_league)
+    audits.schedule(guild_id, time.time())
+    log.info('league_opened', guild=guild_id, teams=len(league.teams), players=len(league.players))
+    return state
+
+# Guild ID -> that guild's league, opened on first use
+leagues = Leagues(open_league)
+
+def api_league(guild_id):
+    # A league the API may show: one this worker owns and has stored. The
+    # API never creates a league.
+    state = leagues.peek(guild_id)
+    if state is None and owns_guild(guild_id) and bot.get_guild(guild_id) is not None and action_storage.has_league(guild_id):
+        state = leagues.get(guild_id)
+    return state
+
+api = LeagueAPI(api_league, API_HOST, API_PORT, home_guild_id=HOME_GUILD_ID) if API_PORT else None
+
+def adopt_legacy_league(guild_id):
+    # A league stored before leagues were per guild becomes this guild's,
+    # along with its event log
+    if leagues.peek(guild_id) is not None:
+        return
+    storage = SQLiteStorage(DB_PATH, guild_id)
+    try:
+        if not storage.adopt():
+            return
+    finally:
+        storage.close()
+    events_path = guild_path(EVENTS_PATH, guild_id)
+    if events_path != EVENTS_PATH and os.path.exists(EVENTS_PATH) and not os.path.exists(events_path):
+        os.replace(EVENTS_PATH, events_path)
+    log.info('legacy_league_adopted', guild=guild_id)
+
+@bot.check
+def in_guild(ctx):
+    # Every command works on the league of the guild it is used in
+    if ctx.guild is None:
+        raise commands.NoPrivateMessage()
+    return True
+
+def index_player_name(state, player_id):
+    # Named from the guild's cached member; index_player_names fills in the
+    # rest
+    if state.league.team_of(player_id) is None:
+        state.player_names.remove(player_id)
+        return
+    if player_id in state.player_names:
+        return
+    guild = bot.get_guild(state.guild_id)
+    member = member_cache.peek(guild, player_id) if guild is not None else None
+    if member is not None:
+        state.player_names.add(player_id, member.display_name)
+
+async def index_player_names(state, guild):
+    # Fuzzy lookup of rostered players' display names, for "did you mean"
+    # replies
+    unnamed = [player_id for player_id, team_name, _ in state.league.players.rows(bare=False)
+               if team_name and player_id not in state.player_names]
+    if not unnamed:
+        return
+    members = await member_cache.get_many(guild, unnamed)
+    for player_id, member in members.items():
+        if member is not None:
+            state.player_names.add(player_id, member.display_name)
+
+def did_you_mean(index, text):
+    suggestions = [str(index.names[key]) for key in index.match(text, limit=3)]
+    return f" Did you mean {', '.join(suggestions)}?" if suggestions else ''
+
+async def team_autocomplete(interaction, current):
+    if interaction.guild is None:
+        return []
+    team_names = leagues.get(interaction.guild.id).team_names
+    return [app_commands.Choice(name=team_name, value=team_name) for team_name in team_names.match(current, limit=25)]
 
 class TradeMenu(menus.Menu):
     def __init__(self, ctx, group_number, players_list):
@@ -46,163 +233,177 @@ class TradeMenu(menus.Menu):
         if not timed_out:
             await self.ctx.send(f"{', '.join([player.display_name for player in self.selected_players])} added to the {self.group_number} group.")
 
-async def perform_trade(ctx, first_group, second_group):
-    try:
-        print(f"First Group: {first_group}")
-        print(f"Second Group: {second_group}")
-
-        # Print current state of teams and players
-        print("Current state before trade:")
-        print("Teams:", teams)
-        print("Players:", players)
-
-        # Get team names from the first player in each group
-        first_team_name = players[first_group[0].id]['team']
-        second_team_name = players[second_group[0].id]['team']
-
-        # Perform the trade logic
-        for player in first_group:
-            # Remove player from their current team
-            current_team = players[player.id]['team']
-            teams[current_team]['players'].remove(player.id)
-
-            # Assign player to the new team
-            new_team = teams.get(second_team_name)
-            if new_team is None:
-                # If the new team doesn't exist, create it
-                teams[second_team_name] = {'players': [], 'captain': None}
-                new_team = teams[second_team_name]
-
-            print(f"Assigning {player.display_name} to new team {second_team_name} ({new_team})")
-            new_team['players'].append(player.id)
-            players[player.id]['team'] = second_team_name
-
-        for player in second_group:
-            # Remove player from their current team
-            current_team = players[player.id]['team']
-            teams[current_team]['players'].remove(player.id)
-
-            # Assign player to the new team
-            new_team = teams.get(first_team_name)
-            if new_team is None:
-                # If the new team doesn't exist, create it
-                teams[first_team_name] = {'players': [], 'captain': None}
-                new_team = teams[first_team_name]
-
-            print(f"Assigning {player.display_name} to new team {first_team_name} ({new_team})")
-            new_team['players'].append(player.id)
-            players[player.id]['team'] = first_team_name
-
-        # Print updated state of teams and players
-        print("Current state after trade:")
-        print("Teams:", teams)
-        print("Players:", players)
+def trade_moves(league, first_group, second_group):
+    # Group 1 goes to the team of the first player in group 2 and vice versa;
+    # every player leaves the team they are on right now
+    first_team_name = league.team_of(first_group[0])
+    second_team_name = league.team_of(second_group[0])
+    return ([(player_id, league.team_of(player_id), second_team_name) for player_id in first_group] +
+            [(player_id, league.team_of(player_id), first_team_name) for player_id in second_group])
 
-    except Exception as e:
-        print(f"Error during trade: {e}")
-        raise e  # Reraise the exception
+async def perform_trade(state, moves):
+    try:
+        # Validates rosters and caps under the teams' locks, then applies all
+        # moves or none of them
+        await state.trade_engine.execute(moves)
+        log.info('trade_performed', guild=state.guild_id, moves=moves)
+
+    except TradeError:
+        raise
+
+    except Exception:
+        log.exception('trade_failed', moves=moves)
+        raise  # Reraise the exception
 
 async def remove_old_roles(member):
     # Remove old team roles from the member
-    for team_name, team_data in teams.items():
-        if member.id in team_data['players']:
-            role = discord.utils.get(member.guild.roles, name=team_name)
-            if role:
-                await member.remove_roles(role)
+    league = leagues.get(member.guild.id).league
+    team_name = league.team_of(member.id)
+    if league.on_roster(team_name, member.id):
+        role = discord.utils.get(member.guild.roles, name=team_name)
+        if role:
+            await member.remove_roles(role)
 
 def is_team_captain(ctx):
-    author_id = ctx.author.id
-    for team_name, team_data in teams.items():
-        if team_data['captain'] == author_id:
-            return True
-    return False
+    return leagues.get(ctx.guild.id).league.is_captain(ctx.author.id)
+
+def has_captain_role(ctx):
+    # Like commands.has_role, with the role name set per league
+    role_name = leagues.get(ctx.guild.id).captain_role
+    if discord.utils.get(ctx.author.roles, name=role_name) is None:
+        raise commands.MissingRole(role_name)
+    return True
 
 @bot.command(name='teamlist', help='Display a list of teams and their total stars divided by the roster cap')
 async def team_list(ctx):
     try:
-        if not teams:
-            await ctx.send("No teams found.")
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        if not league.teams:
+            outbox.send(ctx, "No teams found.")
             return
 
-        team_list_embed = discord.Embed(title='Team List', color=discord.Color.blue())
+        def render(page_number, max_pages):
+            team_list_embed = discord.Embed(title='Team List', color=discord.Color.blue())
 
-        for team_name, team_data in teams.items():
-            total_stars = sum(players.get(player, {}).get('stars', 0) for player in team_data['players'])
-            roster_cap = team_data.get('rostercap', 10)  # Default to 10 if not set
-            star_percentage = (total_stars / roster_cap) * 100
-            team_list_embed.add_field(name=f'{team_name} (Total Stars: {total_stars}/{roster_cap})', value=f'{star_percentage:.2f}% of Roster Cap', inline=False)
+            start, end = page_bounds(page_number)
+            for team_name in itertools.islice(league.teams, start, end):
+                total_stars = league.totals.total(team_name)
+                roster_cap = league.totals.cap(team_name)  # Default to 10 if not set
+                star_percentage = (total_stars / roster_cap) * 100
+                team_list_embed.add_field(name=f'{team_name} (Total Stars: {total_stars}/{roster_cap})', value=f'{star_percentage:.2f}% of Roster Cap', inline=False)
 
-        await ctx.send(embed=team_list_embed)
+            if max_pages > 1:
+                team_list_embed.set_footer(text=f'Page {page_number + 1}/{max_pages}')
+            return team_list_embed
+
+        # Only the page being shown is rendered, and only if the league
+        # changed since it was last rendered
+        source = CachedPageSource(page_cache, ('teamlist', ctx.guild.id), lambda: league.version, len(league.teams), render)
+        await menus.MenuPages(source, clear_reactions_after=True).start(ctx)
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error during team list: {error_message}')
+        outbox.send(ctx, f'Error during team list: {error_message}')
 
 @bot.command(name='sign', description='Sign a player to your team')
-@commands.has_role(TEAM_CAPTAIN_ROLE)
+@commands.check(has_captain_role)
 async def sign(ctx, player: discord.Member):
     try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
         # Check if the author belongs to a team
-        if ctx.author.id not in players or not players[ctx.author.id]['team']:
-            await ctx.send("You don't belong to a team. Create or join a team first.")
+        team_name = league.team_of(ctx.author.id)
+        if not team_name:
+            outbox.send(ctx, "You don't belong to a team. Create or join a team first.")
             return
 
-        team_name = players[ctx.author.id]['team']
-
         # Check if the team exists
-        if team_name not in teams:
-            await ctx.send(f"Team {team_name} does not exist. Create the team first!")
+        if not league.has_team(team_name):
+            outbox.send(ctx, f"Team {team_name} does not exist. Create the team first!")
             return
 
         # Check if the player is already in the team
-        if player.id in teams[team_name]['players']:
-            await ctx.send(f'{player.display_name} is already in {team_name}.')
+        if league.on_roster(team_name, player.id):
+            outbox.send(ctx, f'{player.display_name} is already in {team_name}.')
+            return
+
+        # Check the cap before asking; it is checked again when the player accepts
+        check = league.check_caps([(player.id, league.team_of(player.id), team_name)])
+        if not check.ok:
+            outbox.send(ctx, f'Signing {player.display_name} would put {check.describe()}.')
             return
 
         # Send a direct message to the player asking for confirmation
-        confirmation_message = await player.send(
-            f'{ctx.author.display_name} is trying to sign you to their team ({team_name}). Do you accept? (yes/no)'
-        )
+        confirmation_message = await outbox.send(
+            player, f'{ctx.author.display_name} is trying to sign you to their team ({team_name}). Do you accept? (yes/no)',
+            coalesce=False)
 
-        # Add reactions to the confirmation message
-        await confirmation_message.add_reaction('✅')  # thumbs up
-        await confirmation_message.add_reaction('❌')  # thumbs down
+        # Add reactions to the confirmation message (in the background)
+        outbox.react(confirmation_message, '✅', '❌')
 
-        def check(reaction, user):
-            return user == player and reaction.message == confirmation_message and str(reaction.emoji) in ['✅', '❌']
+        # The player's answer is picked up by on_raw_reaction_add
+        pending.add(confirmation_message.id, 'sign', target=player.id, choices=['✅', '❌'], timeout=OFFER_TIMEOUT,
+                    guild_id=ctx.guild.id, channel_id=ctx.channel.id, team=team_name, player_name=player.display_name)
 
-        # Wait for the player's response
-        reaction, _ = await bot.wait_for('reaction_add', check=check, timeout=86400)
+    except Exception:
+        log.exception('sign_failed', player=player.id)
+        outbox.send(ctx, "An error occurred during the signing.")
 
-        if str(reaction.emoji) == '✅':
-            # Add the player to the team
-            teams[team_name]['players'].append(player.id)
-            players[player.id] = {'team': team_name, 'stars': 0}
 
-            # Get the team role
-            team_role = discord.utils.get(ctx.guild.roles, name=team_name)
+def action_league(action, channel):
+    # Offers made before leagues were per guild don't record the guild
+    return leagues.get(action.get('guild_id') or channel.guild.id)
 
-            # Assign the team role to the player
-            await player.add_roles(team_role)
 
-            await ctx.send(f'{player.display_name} has been signed to {team_name}!')
+async def resolve_sign_offer(action, emoji):
+    channel = await get_channel(action['channel_id'])
+    state = action_league(action, channel)
+    league = state.league
+    team_name = action['team']
+    player_name = action['player_name']
+
+    if emoji == '✅':
+        # The team may have gone away while the offer was open
+        if not league.has_team(team_name):
+            outbox.send(channel, f"Team {team_name} does not exist anymore.")
+            return
+
+        # Add the player to the team (and off any previous one); their
+        # team role is assigned by the role sync. Holding both teams' locks
+        # keeps the signing from landing in the middle of a trade.
+        async with state.trade_engine.locked([team_name, league.team_of(action['target'])]):
+            # Stars or rosters may have changed while the offer was open
+            check = league.check_caps([(action['target'], league.team_of(action['target']), team_name)])
+            if check.ok:
+                league.assign(action['target'], team_name, source='sign')
+
+        if check.ok:
+            outbox.send(channel, f'{player_name} has been signed to {team_name}!')
         else:
-            await ctx.send(f'{player.display_name} declined the signing.')
+            outbox.send(channel, f'{player_name} could not be signed: it would put {check.describe()}.')
+    else:
+        outbox.send(channel, f'{player_name} declined the signing.')
 
-    except Exception as e:
-        print(f"Error during signing: {e}")
-        await ctx.send("An error occurred during the signing.")
+
+async def expire_sign_offer(action):
+    channel = await get_channel(action['channel_id'])
+    outbox.send(channel, f"The signing offer to {action['player_name']} ({action['team']}) expired.")
+
+pending.handler('sign', resolve_sign_offer, expire_sign_offer)
 
 
 
 @bot.command(name='player', description='Display player information')
 async def player_info(ctx, player_mention: discord.Member):
     try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
         # Check if the player exists in the players dictionary
-        if player_mention.id in players:
+        if player_mention.id in league.players:
             player_name = player_mention.display_name
-            team_name = players[player_mention.id]['team']
-            stars = players[player_mention.id]['stars']
+            team_name = league.team_of(player_mention.id)
+            stars = league.stars_of(player_mention.id)
 
             # Create an embed
             embed = discord.Embed(
@@ -214,20 +415,22 @@ async def player_info(ctx, player_mention: discord.Member):
             # Set thumbnail as player's avatar if available
             embed.set_thumbnail(url=player_mention.avatar.url)
 
-            await ctx.send(embed=embed)
+            outbox.send(ctx, embed=embed)
         else:
-            await ctx.send(f'Player {player_mention.display_name} not found.')
+            outbox.send(ctx, f'Player {player_mention.display_name} not found.')
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
 
 
 @bot.command(name='trade')
 @commands.check(lambda ctx: is_team_captain(ctx))
 async def trade(ctx):
     try:
-        await ctx.send("Please mention the players for the first group:")
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        outbox.send(ctx, "Please mention the players for the first group:")
 
         def check(message):
             return message.author == ctx.author and message.channel == ctx.channel
@@ -240,167 +443,389 @@ async def trade(ctx):
         # Check if the author is the captain of the team to which the first group of players belongs
         author_is_captain = is_team_captain(ctx)
         if not author_is_captain:
-            await ctx.send("You must be the captain of the team to trade those players.")
+            outbox.send(ctx, "You must be the captain of the team to trade those players.")
             return
 
-        await ctx.send("Please mention the players for the second group:")
+        outbox.send(ctx, "Please mention the players for the second group:")
 
         # Wait for the user to mention the players for the second group
         second_group_message = await bot.wait_for('message', check=check, timeout=60)
 
         second_group = second_group_message.mentions
 
-        # Print the first and second groups
-        print(f"First Group: {first_group}")
-        print(f"Second Group: {second_group}")
+        log.debug('trade_groups', first_group=[player.id for player in first_group], second_group=[player.id for player in second_group])
 
         # Send a confirmation message to the team captain (Franchise Owner) of the team of players in group2
-        team_of_group2 = players.get(second_group[0].id, {}).get('team')
-        if team_of_group2:
-            captain_id = teams[team_of_group2].get('captain')
-            captain = ctx.guild.get_member(captain_id)
+        team_of_group2 = league.team_of(second_group[0].id) if second_group else None
+        if team_of_group2 and first_group and league.team_of(first_group[0].id):
+            # Catch rosters and caps that already don't work before asking anyone
+            moves = trade_moves(league, [player.id for player in first_group], [player.id for player in second_group])
+            try:
+                state.trade_engine.validate(moves)
+            except TradeError as e:
+                outbox.send(ctx, f"Trade not possible: {e}")
+                return
+
+            captain_id = league.captain_of(team_of_group2)
+            captain = await member_cache.get(ctx.guild, captain_id) if captain_id else None
             if captain:
                 # Send a direct message to the team captain (Franchise Owner) for confirmation
                 trade_message = f"Trade Proposal:\n\nGroup 1: {', '.join([player.display_name for player in first_group])}\nGroup 2: {', '.join([player.display_name for player in second_group])}\n\nPlease confirm the trade by reacting with 👍 or reject with 👎."
-                confirmation_message = await captain.send(trade_message)
+                confirmation_message = await outbox.send(captain, trade_message, coalesce=False)
 
-                # Add reactions to the confirmation message
-                await confirmation_message.add_reaction('👍')  # thumbs up
-                await confirmation_message.add_reaction('👎')  # thumbs down
+                # Add reactions to the confirmation message (in the background)
+                outbox.react(confirmation_message, '👍', '👎')
 
-                def check_reactions(reaction, user):
-                    return user == captain and reaction.message == confirmation_message and str(reaction.emoji) in ['👍', '👎']
+                # The captain's answer is picked up by on_raw_reaction_add
+                pending.add(confirmation_message.id, 'trade', target=captain.id, choices=['👍', '👎'], timeout=OFFER_TIMEOUT,
+                            guild_id=ctx.guild.id, channel_id=ctx.channel.id, proposer=ctx.author.id,
+                            first_group=[player.id for player in first_group],
+                            second_group=[player.id for player in second_group], moves=moves)
 
-                # Wait for the captain's response
-                reaction, _ = await bot.wait_for('reaction_add', check=check_reactions, timeout=86400)
+        else:
+            outbox.send(ctx, "Could not determine the teams of the players in the trade.")
 
-                if str(reaction.emoji) == '👎':
-                    await ctx.send("Trade canceled. The team captain (Franchise Owner) did not confirm.")
-                    return
-                elif str(reaction.emoji) == '👍':
-                    # Start the voting logic for approval
-                    trade_confirmation = await ctx.send("Vote to approve or reject the trade. React with 👍 to approve, 👎 to reject.")
-                    await trade_confirmation.add_reaction('👍')
-                    await trade_confirmation.add_reaction('👎')
-
-                    # Wait for reactions for a specific duration (20 seconds)
-                    await asyncio.sleep(20)
-
-                    # Get updated message
-                    trade_confirmation = await ctx.channel.fetch_message(trade_confirmation.id)
-
-                    # Fetch the reactions
-                    thumbs_up = 0
-                    thumbs_down = 0
-                    for reaction in trade_confirmation.reactions:
-                        if str(reaction.emoji) == '👍':
-                            thumbs_up += reaction.count - 1  # Subtract 1 to exclude the bot's own reaction
-                        elif str(reaction.emoji) == '👎':
-                            thumbs_down += reaction.count - 1  # Subtract 1 to exclude the bot's own reaction
-
-                    if thumbs_up > thumbs_down:
-                        # Trade approved, proceed with the trade logic
-                        await perform_trade(ctx, first_group, second_group)
-                        await ctx.send("Trade completed.")
-                    else:
-                        await ctx.send("Trade rejected. Not enough approval votes.")
+    except asyncio.TimeoutError:
+        outbox.send(ctx, "Trade timed out. Please run the command again.")
+
+    except Exception:
+        log.exception('trade_failed')
+        outbox.send(ctx, "An error occurred during the trade.")
 
+
+async def resolve_trade_offer(action, emoji):
+    channel = await get_channel(action['channel_id'])
+    state = action_league(action, channel)
+    league = state.league
+
+    if emoji == '👎':
+        outbox.send(channel, "Trade canceled. The team captain (Franchise Owner) did not confirm.")
+        return
+
+    try:
+        # Start the voting logic for approval
+        trade_confirmation = await outbox.send(channel, "Vote to approve or reject the trade. React with 👍 to approve, 👎 to reject.",
+                                               coalesce=False)
+
+        # The proposer and the captains involved don't get a vote
+        trade_teams = {league.team_of(action['first_group'][0]), league.team_of(action['second_group'][0])}
+        excluded = {action['proposer']} | {league.captain_of(team_name) for team_name in trade_teams if league.has_team(team_name)}
+        eligible, electorate = trade_voters(league, channel.guild, excluded)
+
+        # Tallied from raw reaction events; ends after TRADE_VOTE_SECONDS or
+        # as soon as the outcome can no longer change
+        result = votes.open(trade_confirmation.id, TRADE_VOTE_SECONDS, eligible, electorate, TRADE_VOTE_QUORUM)
+        outbox.react(trade_confirmation, '👍', '👎')
+        vote = await result
+
+        if vote.approved():
+            # Trade approved, proceed with the trade logic. Offers made
+            # before trades carried moves only have the two groups.
+            moves = action.get('moves') or trade_moves(league, action['first_group'], action['second_group'])
+            try:
+                await perform_trade(state, moves)
+            except TradeError as e:
+                outbox.send(channel, f"Trade canceled. {e}")
+                return
+            outbox.send(channel, "Trade completed.")
         else:
-            await ctx.send("Could not determine the team of players in the second group.")
+            outbox.send(channel, f"Trade rejected. Not enough approval votes ({len(vote.yes)} 👍, {len(vote.no)} 👎).")
 
-    except asyncio.TimeoutError:
-        await ctx.send("Trade timed out. Please run the command again.")
+    except Exception:
+        log.exception('trade_failed')
+        outbox.send(channel, "An error occurred during the trade.")
 
-    except Exception as e:
-        print(f"Error during trade: {e}")
-        await ctx.send("An error occurred during the trade.")
+
+async def expire_trade_offer(action):
+    channel = await get_channel(action['channel_id'])
+    outbox.send(channel, "Trade timed out. Please run the command again.")
+
+pending.handler('trade', resolve_trade_offer, expire_trade_offer)
+
+
+def trade_voters(league, guild, excluded):
+    # Returns the eligibility check for a trade vote and the number of
+    # eligible voters (None when it can't be counted cheaply)
+    if TRADE_VOTER_ROLES is None:
+        # Team roles follow the rosters, so rostered players vote and are
+        # counted; a role the role sync hasn't caught up with yet counts
+        # for nothing either way
+        electorate = sum(league.totals.counts.values()) - sum(1 for user_id in excluded if league.team_of(user_id))
+
+        def eligible(member):
+            return not member.bot and member.id not in excluded and league.team_of(member.id) is not None
+    else:
+        allowed = set(TRADE_VOTER_ROLES)
+        voters = set()
+        for role in guild.roles:
+            if role.name in allowed:
+                voters.update(member.id for member in role.members if not member.bot)
+        # Without the member list (lean mode) role members can't be counted,
+        # so the vote runs to its deadline
+        electorate = len(voters - excluded) if guild.chunked else None
+
+        def eligible(member):
+            return not member.bot and member.id not in excluded and any(role.name in allowed for role in member.roles)
+
+    return eligible, electorate
+
+
+async def get_channel(channel_id):
+    # Offers can outlive the process, so the channel may not be cached yet
+    return bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+
+
+@bot.event
+async def on_raw_reaction_add(payload):
+    if payload.user_id == bot.user.id:
+        return
+    if not await pending.handle_reaction(payload):
+        if payload.guild_id is None:
+            # Every DM reaction reaches shard 0's worker; the offer may be
+            # another worker's
+            bus.publish('reaction', message_id=payload.message_id, user_id=payload.user_id, emoji=str(payload.emoji))
+        votes.reaction_add(payload)
+
+
+async def on_bus_reaction(fields):
+    await pending.handle_reaction(types.SimpleNamespace(**fields))
+
+bus.on('reaction', on_bus_reaction)
+
+
+async def on_bus_league_changed(fields):
+    # Another worker wrote this league. A copy open here is stale: the
+    # guild is on another worker's shard now, or an old offer opened it.
+    guild_id = fields['guild_id']
+    if leagues.peek(guild_id) is not None and not owns_guild(guild_id):
+        audits.cancel(guild_id)
+        draft_clock.cancel(guild_id)
+        await leagues.drop(guild_id)
+        page_cache.clear()
+        if api is not None:
+            api.clear()
+
+bus.on('league_changed', on_bus_league_changed)
+
+
+@bot.event
+async def on_raw_reaction_remove(payload):
+    votes.reaction_remove(payload)
+
+
+@bot.event
+async def on_raw_member_remove(payload):
+    member_cache.discard(payload.guild_id, payload.user.id)
+    # Departed members leave the league, and their team if they had one
+    state = leagues.peek(payload.guild_id)
+    if state is not None and payload.user.id in state.league.players:
+        state.league.remove_players([payload.user.id])
+
+
+@bot.event
+async def on_member_join(member):
+    # New members are free agents straight away; leagues that aren't open
+    # catch up when they are (see catch_up)
+    state = leagues.peek(member.guild.id)
+    if state is None:
+        return
+    state.league.register_player(member.id)
+    if state.resync is not None:
+        state.resync.saw(member.id)
+
+
+@bot.event
+async def on_member_update(before, after):
+    state = leagues.peek(after.guild.id)
+    if state is not None and after.id in state.player_names and before.display_name != after.display_name:
+        state.player_names.add(after.id, after.display_name)
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    # Suggest rostered players when a member argument doesn't resolve
+    if isinstance(error, commands.MemberNotFound) and ctx.guild is not None:
+        player_names = leagues.get(ctx.guild.id).player_names
+        outbox.send(ctx, f'Member {error.argument} not found.{did_you_mean(player_names, error.argument)}')
+        return
+    await commands.Bot.on_command_error(bot, ctx, error)
 
 
 
 
 
 async def notify_team_captain(guild, team_name, first_group, second_group):
-    # Get the team captain (franchise owner) role
-    captain_role = discord.utils.get(guild.roles, name="franchise owner")  # Adjust the role name as needed
+    state = leagues.get(guild.id)
 
-    if captain_role:
-        # Get the team captain (franchise owner) for the specified team
-        team_captains = [member for member in guild.members if captain_role in member.roles and is_team_captain(member, team_name)]
+    # Get the team captain role; its name is a league setting
+    captain_role = discord.utils.get(guild.roles, name=state.captain_role)
 
-        # Notify each team captain
-        for captain in team_captains:
-            try:
-                # Send a direct message to the team captain with trade details
-                trade_message = f"Trade Proposal:\n\nGroup 1: {', '.join([player.display_name for player in first_group])}\nGroup 2: {', '.join([player.display_name for player in second_group])}\n\nPlease confirm the trade by reacting with 👍 or reject with 👎."
-                await captain.send(trade_message)
-
-            except discord.Forbidden:
-                print(f"Unable to send a direct message to {captain.display_name} (ID: {captain.id}).")
-
-
-async def update_roles(guild, player_id):
-    member = guild.get_member(player_id)
-    if member:
-        # Check if the player is associated with any team
-        if player_id in players:
-            current_team_name = players[player_id]['team']
-            
-            # Remove old team role
-            if current_team_name:
-                old_role = discord.utils.get(guild.roles, name=current_team_name)
-                if old_role:
-                    await member.remove_roles(old_role)
-
-            # Add new team role
-            new_team_name = teams[current_team_name]['players']
-            if new_team_name:
-                new_role = discord.utils.get(guild.roles, name=new_team_name)
-                if new_role:
-                    await member.add_roles(new_role)
-
-# Define your update_roles task
-@tasks.loop(seconds=60)  # Update every 60 seconds, adjust as needed
-async def update_roles_task():
-    for guild in bot.guilds:
-        for player_id in players.keys():
-            await update_roles(guild, player_id)
-
-# Start the task when the bot is ready
+    if captain_role:
+        # Get the team captain for the specified team
+        captain_id = state.league.captain_of(team_name)
+        captain = await member_cache.get(guild, captain_id) if captain_id else None
+        team_captains = [captain] if captain and captain_role in captain.roles else []
+
+        # Notify every team captain at once; the DMs go out side by side
+        trade_message = f"Trade Proposal:\n\nGroup 1: {', '.join([player.display_name for player in first_group])}\nGroup 2: {', '.join([player.display_name for player in second_group])}\n\nPlease confirm the trade by reacting with 👍 or reject with 👎."
+        results = await asyncio.gather(*(outbox.send(captain, trade_message) for captain in team_captains), return_exceptions=True)
+        for captain, result in zip(team_captains, results):
+            if isinstance(result, discord.Forbidden):
+                log.warning('dm_forbidden', member=captain.id)
+
+
+# Low-priority full audit of a league's team roles in case a change was
+# missed (e.g. roles edited by hand). It only marks members; the league's
+# role sync works out and applies the deltas. Rostered players still missing
+# from its player_names are looked up too. Each open league has its own
+# deadline on one timer heap, so the audits are spread out and cost scales
+# with the leagues in use rather than every guild times every player.
+async def audit_league(guild_id):
+    state = leagues.peek(guild_id)
+    if state is None:
+        return
+    audits.schedule(guild_id, time.time() + AUDIT_SECONDS)
+    guild = bot.get_guild(guild_id)
+    # A league without teams has no roles to keep in line
+    if guild is None or not state.league.teams:
+        return
+    await audit_roles(state, guild)
+    await index_player_names(state, guild)
+
+audits = TimerHeap(audit_league)
+
+def draft_line(pick_number, team_name, player_id):
+    return f"{pick_number}. {team_name}: {f'<@{player_id}>' if player_id is not None else '(skipped)'}"
+
+def draft_progress(state):
+    # After picks were made: save the draft, restart the pick clock, post
+    # every round that was completed as one message and say who is up next
+    draft = state.draft
+    channel = bot.get_channel(draft.channel_id)
+    messages = []
+    for round_number in draft.rounds_to_announce():
+        message = f'**Round {round_number} of {draft.rounds}**'
+        for pick in draft.round_picks(round_number):
+            line = draft_line(*pick)
+            # A round of many teams may not fit in one message
+            if len(message) + len(line) >= 2000:
+                messages.append(message)
+                message = line
+            else:
+                message += '\n' + line
+        messages.append(message)
+    if draft.finished:
+        draft_clock.cancel(state.guild_id)
+        state.draft = None
+        state.configure(draft=None)
+        messages.append('The draft is over.')
+    else:
+        draft_clock.schedule(state.guild_id, draft.deadline)
+        state.configure(draft=draft.state())
+        team_name = draft.on_the_clock()
+        captain = state.league.captain_of(team_name) if state.league.has_team(team_name) else None
+        messages.append(f"Pick {len(draft.picks) + 1}: {team_name}{f' (<@{captain}>)' if captain else ''} is on the clock, "
+                        f"pick due <t:{int(draft.deadline)}:R>.")
+    if channel is not None:
+        for message in messages:
+            outbox.send(channel, message)
+
+async def draft_pick_due(guild_id):
+    # The team on the clock ran out of time
+    state = leagues.peek(guild_id)
+    if state is None or state.draft is None:
+        return
+    # Holding the teams' locks keeps the picks from landing in the middle of a trade
+    async with state.trade_engine.locked(state.draft.order):
+        state.draft.expire()
+    draft_progress(state)
+
+# One clock for every league's draft, keyed by guild
+draft_clock = TimerHeap(draft_pick_due)
+
+async def audit_roles(state, guild):
+    league = state.league
+    managed = set(league.teams)
+    state.role_sync.mark_many(player_id for player_id, team_name, _ in league.players.rows(bare=False) if team_name)
+    # Only members discord.py has cached, i.e. nobody extra in lean mode
+    state.role_sync.mark_many(member.id for member in guild.members if any(role.name in managed for role in member.roles))
+    await asyncio.sleep(0)
+
+# Write each league's queued changes to storage in one batch. A failed
+# write (e.g. another worker holding the database lock) stays queued for
+# the next round and doesn't hold up the other leagues.
+@tasks.loop(seconds=5)
+async def flush_storage_task():
+    try:
+        await action_storage.flush()
+    except Exception:
+        log.exception('flush_failed', guild=None, pending=action_storage.pending)
+    for state in leagues:
+        changed = state.storage.pending
+        try:
+            await state.flush()
+        except Exception:
+            log.exception('flush_failed', guild=state.guild_id, pending=state.storage.pending)
+            continue
+        if changed:
+            bus.publish('league_changed', guild_id=state.guild_id)
+
+# Start the tasks when the bot is ready
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user.name}')
-    update_roles_task.start()
+    log.info('logged_in', user=bot.user.name, guilds=len(bot.guilds), lean=LEAN_MODE)
+    home_guild_id = HOME_GUILD_ID or (bot.guilds[0].id if len(bot.guilds) == 1 and SHARD_IDS is None else 0)
+    if home_guild_id:
+        adopt_legacy_league(home_guild_id)
+        if api is not None:
+            api.home_guild_id = home_guild_id
+    # Open the leagues stored for the guilds the bot is in; any other guild
+    # gets its league when it first uses a command
+    for guild_id in set(action_storage.guild_ids()) & {guild.id for guild in bot.guilds}:
+        leagues.get(guild_id)
+        catch_up(guild_id)
+    audits.start()
+    draft_clock.start()
+    if not flush_storage_task.is_running():
+        flush_storage_task.start()
 
         
-@bot.command(name='setcaptain', help='Set a team captain')
+@bot.hybrid_command(name='setcaptain', help='Set a team captain')
 @commands.has_permissions(administrator=True)
+@app_commands.autocomplete(team_name=team_autocomplete)
 async def set_captain(ctx, team_name: str, captain: discord.Member):
     try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
         # Check if the team exists
-        if team_name not in teams:
-            await ctx.send(f'Team {team_name} does not exist.')
+        resolved = state.find_team(team_name)
+        if resolved is None:
+            outbox.send(ctx, f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name)}')
             return
+        team_name = resolved
 
         # Check if the captain is in the team
-        if captain.id not in teams[team_name]['players']:
-            await ctx.send(f'{captain.display_name} is not in {team_name}.')
+        if not league.on_roster(team_name, captain.id):
+            outbox.send(ctx, f'{captain.display_name} is not in {team_name}.')
             return
 
         # Set the captain for the team
-        teams[team_name]['captain'] = captain.id
+        league.set_captain(team_name, captain.id)
 
-        await ctx.send(f'{captain.display_name} is now the captain of {team_name}.')
+        outbox.send(ctx, f'{captain.display_name} is now the captain of {team_name}.')
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
 
 @bot.command(name='createteam', description='Create a team and role')
 @commands.has_permissions(administrator=True)
 async def create_team(ctx, team_name: str):
     try:
-        if team_name not in teams:
-            teams[team_name] = {'players': [], 'captain': None}
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        if not league.has_team(team_name):
+            league.create_team(team_name)
 
             # Create the team role
             team_role = await ctx.guild.create_role(name=team_name)
@@ -408,185 +833,784 @@ async def create_team(ctx, team_name: str):
             # Move the team role below the bot's role
             await team_role.edit(position=ctx.guild.me.top_role.position - 1)
 
-            # Assign the role to the person who created the team (optional)
-            await ctx.author.add_roles(team_role)
+            # Members get the role from the role sync once they are on the
+            # roster; handing it to anyone else would only be taken back
+            # by the next audit
 
-            await ctx.send(f'Team {team_name} created!')
+            outbox.send(ctx, f'Team {team_name} created!')
 
         else:
-            await ctx.send(f'Team {team_name} already exists. Choose a different name.')
+            outbox.send(ctx, f'Team {team_name} already exists. Choose a different name.')
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
 
-@bot.command(name='addplayer')
+@bot.hybrid_command(name='addplayer', help='Add a player to a team')
 @commands.has_permissions(administrator=True)
-async def add_player(ctx, member: discord.Member, team_name):
+@app_commands.autocomplete(team_name=team_autocomplete)
+async def add_player(ctx, member: discord.Member, *, team_name: str):
     try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
         player_name = member.name  # Use member.name as the player_name
         player_id = member.id  # Use member.id as the player_id
 
         # Check if the team exists
-        if team_name not in teams:
-            await ctx.send(f'Team {team_name} does not exist. Create the team first!')
+        resolved = state.find_team(team_name)
+        if resolved is None:
+            outbox.send(ctx, f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name) or " Create the team first!"}')
             return
+        team_name = resolved
 
         # Check if the player is already in the team
-        if player_id in teams[team_name]['players']:
-            await ctx.send(f'{member.display_name} is already in {team_name}')
+        if league.on_roster(team_name, player_id):
+            outbox.send(ctx, f'{member.display_name} is already in {team_name}')
             return
 
-        # Check if adding the player would exceed the roster star cap
-        current_roster_stars = sum(players[player]['stars'] for player in teams[team_name]['players'])
-        new_player_stars = players.get(player_id, {'stars': 0})['stars']
-        if current_roster_stars + new_player_stars > rostercap:
-            await ctx.send(f'Adding {member.display_name} to {team_name} would exceed the roster star cap!')
+        # Check if adding the player would exceed the team's roster star cap
+        check = league.check_caps([(player_id, league.team_of(player_id), team_name)])
+        if not check.ok:
+            outbox.send(ctx, f'Adding {member.display_name} to {team_name} would exceed the roster star cap ({check.describe()})!')
             return
 
-        # Add the player to the team
-        teams[team_name]['players'].append(player_id)
-        players[player_id] = {'team': team_name, 'stars': 0}
+        # Add the player to the team (and off any previous one)
+        league.assign(player_id, team_name, source='addplayer')
 
-        await ctx.send(f'{member.display_name} added to {team_name}')
+        outbox.send(ctx, f'{member.display_name} added to {team_name}')
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
 
-@bot.command(name='roster')
-async def display_roster(ctx, team_name):
+@bot.hybrid_command(name='roster', help="Show a team's roster")
+@app_commands.autocomplete(team_name=team_autocomplete)
+async def display_roster(ctx, *, team_name: str):
     try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
         # Check if the team exists
-        if team_name not in teams:
-            await ctx.send(f'Team {team_name} does not exist.')
+        resolved = state.find_team(team_name)
+        if resolved is None:
+            outbox.send(ctx, f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name)}')
             return
+        team_name = resolved
 
         # Check if the team has players
-        if not teams[team_name]['players']:
-            await ctx.send(f'Team {team_name} has no players.')
+        if not league.totals.count(team_name):
+            outbox.send(ctx, f'Team {team_name} has no players.')
+            return
+
+        # Resolve the roster's members up front so the pages render with
+        # names; a no-op when discord.py already has them cached. In lean
+        # mode that takes gateway queries, which a slash command must not
+        # spend its 3 seconds to answer on.
+        if ctx.interaction is not None:
+            await ctx.defer()
+        await member_cache.get_many(ctx.guild, league.roster(team_name))
+
+        def render(page_number, max_pages):
+            # Create an embed for the roster
+            roster_embed = discord.Embed(title=f'**{team_name} Roster**', color=discord.Color.blue())
+
+            # Iterate over this page's players and add them to the embed
+            start, end = page_bounds(page_number)
+            for player_id in itertools.islice(league.teams[team_name]['players'], start, end):
+                # Get player information
+                member = member_cache.peek(ctx.guild, player_id)
+                player_name = member.display_name if member else f'<@{player_id}>'
+                stars = league.stars_of(player_id)
+
+                # Add player information to the embed
+                roster_embed.add_field(name=f'**{player_name}**', value=f'Stars: {stars}', inline=False)
+
+            # Add the sum of stars for the team divided by roster cap
+            roster_cap = league.totals.cap(team_name)  # Default to 10 if not set
+            total_stars = league.totals.total(team_name)
+            roster_embed.add_field(name='**Star Cap**', value=f'{total_stars}/{roster_cap}', inline=False)
+
+            if max_pages > 1:
+                roster_embed.set_footer(text=f'Page {page_number + 1}/{max_pages}')
+            return roster_embed
+
+        source = CachedPageSource(page_cache, ('roster', ctx.guild.id, team_name), lambda: league.version,
+                                  league.totals.count(team_name), render)
+        await ReplyMenuPages(source, clear_reactions_after=True).start(ctx)
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='leaderboard', help='Top players by stars, for a team or free agents ("fa"), or one player\'s rank')
+async def leaderboard(ctx, player: typing.Optional[discord.Member] = None, *, team_name: str = None):
+    try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        if player is not None:
+            if player.id not in league.players:
+                outbox.send(ctx, f'{player.display_name} is not a registered player.')
+                return
+            stars = league.stars_of(player.id)
+            team_name = league.team_of(player.id)
+            group_name = f'on {team_name}' if team_name else 'among free agents'
+            outbox.send(ctx, f'{player.display_name} ({stars} stars) is #{league.rankings.rank(stars)} of {league.rankings.count()} overall '
+                             f'and #{league.rankings.rank(stars, team_name)} of {league.rankings.count(team_name)} {group_name}.')
+            return
+
+        # Filter by team, or None for free agents
+        group = ALL if team_name is None else state.find_team(team_name)
+        if group is ALL:
+            title = 'Leaderboard'
+        elif group is not None:
+            title = f'{group} Leaderboard'
+        elif team_name.lower() in ('fa', 'free agents'):
+            title = 'Free Agent Leaderboard'
+        else:
+            outbox.send(ctx, f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name)}')
+            return
+
+        if not league.rankings.listed(group):
+            outbox.send(ctx, 'No players with stars yet.')
+            return
+
+        # Resolve the first page's members up front so it renders with names
+        await member_cache.get_many(ctx.guild, [player_id for _, player_id, _ in league.rankings.page(*page_bounds(0), group)])
+
+        def render(page_number, max_pages):
+            leaderboard_embed = discord.Embed(title=title, color=discord.Color.blue())
+
+            # Only this page's players are read from the star buckets
+            start, end = page_bounds(page_number)
+            for rank, player_id, stars in league.rankings.page(start, end, group):
+                member = member_cache.peek(ctx.guild, player_id)
+                player_name = member.display_name if member else f'<@{player_id}>'
+                player_team = league.team_of(player_id) if group is ALL else None
+                leaderboard_embed.add_field(name=f'#{rank} {player_name}',
+                                            value=f'Stars: {stars}' + (f' ({player_team})' if player_team else ''), inline=False)
+
+            footer = []
+            if max_pages > 1:
+                footer.append(f'Page {page_number + 1}/{max_pages}')
+            if (group is ALL or group is None) and league.rankings.unlisted:
+                footer.append(f'{league.rankings.unlisted} free agents with 0 stars not listed')
+            if footer:
+                leaderboard_embed.set_footer(text=' | '.join(footer))
+            return leaderboard_embed
+
+        source = CachedPageSource(page_cache, ('leaderboard', ctx.guild.id, group), lambda: league.version,
+                                  league.rankings.listed(group), render)
+        await menus.MenuPages(source, clear_reactions_after=True).start(ctx)
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='teamrank', help='Rank teams by how much of their roster cap they use, or show one team\'s rank')
+async def team_rank(ctx, *, team_name: str = None):
+    try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        if team_name is not None:
+            resolved = state.find_team(team_name)
+            if resolved is None:
+                outbox.send(ctx, f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name)}')
+                return
+            team_name = resolved
+            total_stars = league.totals.total(team_name)
+            roster_cap = league.totals.cap(team_name)
+            outbox.send(ctx, f'{team_name} is #{league.rankings.team_rank(team_name)} of {len(league.teams)} teams by cap usage '
+                             f'({total_stars}/{roster_cap} stars).')
+            return
+
+        if not league.teams:
+            outbox.send(ctx, "No teams found.")
+            return
+
+        def render(page_number, max_pages):
+            team_rank_embed = discord.Embed(title='Teams by Cap Usage', color=discord.Color.blue())
+
+            start, end = page_bounds(page_number)
+            for rank, ranked_team, usage in league.rankings.team_page(start, end):
+                total_stars = league.totals.total(ranked_team)
+                roster_cap = league.totals.cap(ranked_team)
+                team_rank_embed.add_field(name=f'#{rank} {ranked_team} (Total Stars: {total_stars}/{roster_cap})',
+                                          value=f'{usage * 100:.2f}% of Roster Cap', inline=False)
+
+            if max_pages > 1:
+                team_rank_embed.set_footer(text=f'Page {page_number + 1}/{max_pages}')
+            return team_rank_embed
+
+        source = CachedPageSource(page_cache, ('teamrank', ctx.guild.id), lambda: league.version, len(league.teams), render)
+        await menus.MenuPages(source, clear_reactions_after=True).start(ctx)
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='capreport', help="List every team's cap usage and the teams over their cap")
+async def cap_report(ctx):
+    try:
+        league = leagues.get(ctx.guild.id).league
+        if not league.teams:
+            outbox.send(ctx, "No teams found.")
             return
 
-        # Create an embed for the roster
-        roster_embed = discord.Embed(title=f'**{team_name} Roster**', color=discord.Color.blue())
+        # Straight from the running totals, already ordered by cap usage
+        over = league.totals.over_cap()
+        summary = f'{len(over)} of {len(league.teams)} teams over their roster cap'
+        if over:
+            summary += ': ' + ', '.join(f'{team_name} ({total}/{cap} stars)' for team_name, total, cap in over)
+        lines = [f"#{rank} {team_name}: {league.totals.total(team_name)}/{league.totals.cap(team_name)} stars, "
+                 f"{usage * 100:.1f}%, {league.totals.count(team_name)} players{' - OVER CAP' if usage > 1 else ''}"
+                 for rank, team_name, usage in league.rankings.team_page(0, len(league.teams))]
+
+        report = summary + '\n\n' + '\n'.join(lines)
+        if len(report) <= 2000:
+            outbox.send(ctx, report)
+        else:
+            # One message either way: the full report goes along as a file
+            fp = io.BytesIO(report.encode())
+            outbox.send(ctx, summary[:1900] + ('...' if len(summary) > 1900 else ''), file=discord.File(fp, filename='capreport.txt'))
 
-        # Iterate over players in the team and add them to the embed
-        for player_id in teams[team_name]['players']:
-            # Get player information
-            player_name = ctx.guild.get_member(player_id).display_name
-            stars = players.get(player_id, {}).get('stars', 0)
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
 
-            # Add player information to the embed
-            roster_embed.add_field(name=f'**{player_name}**', value=f'Stars: {stars}', inline=False)
 
-        # Calculate and add the sum of stars for the team divided by roster cap
-        roster_cap = teams[team_name].get('rostercap', 10)  # Default to 10 if not set
-        total_stars = sum(players.get(player, {}).get('stars', 0) for player in teams[team_name]['players'])
-        roster_embed.add_field(name='**Star Cap**', value=f'{total_stars}/{roster_cap}', inline=False)
+@bot.group(name='draft', invoke_without_command=True, help='Show the running draft: who is on the clock and the latest picks')
+async def draft(ctx):
+    try:
+        state = leagues.get(ctx.guild.id)
+        draft = state.draft
+        if draft is None:
+            outbox.send(ctx, 'No draft is running.')
+            return
 
-        await ctx.send(embed=roster_embed)
+        lines = [f"Round {draft.round} of {draft.rounds} ({'snake' if draft.snake else 'linear'}), "
+                 f"pick {len(draft.picks) + 1} of {draft.total_picks}: {draft.on_the_clock()} is on the clock, "
+                 f"pick due <t:{int(draft.deadline)}:R>."]
+        recent = range(max(0, len(draft.picks) - 5), len(draft.picks))
+        lines += [draft_line(pick_number + 1, *draft.picks[pick_number]) for pick_number in recent]
+        team_name = state.league.captain_team(ctx.author.id)
+        if team_name in draft.queues:
+            lines.append(f'{team_name} has {len(draft.queues[team_name])} players queued.')
+        outbox.send(ctx, '\n'.join(lines))
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
+
+@draft.command(name='start', help='Start a draft: rounds, snake or linear, minutes per pick, then the teams in pick order (default: all teams)')
+@commands.has_permissions(administrator=True)
+async def draft_start(ctx, rounds: int, mode: str = 'snake', pick_minutes: float = DEFAULT_PICK_SECONDS / 60, *, order: str = None):
+    try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        if state.draft is not None:
+            outbox.send(ctx, 'A draft is already running.')
+            return
+        if mode not in ('snake', 'linear'):
+            outbox.send(ctx, 'The draft mode is snake or linear.')
+            return
+
+        # Team names separated by commas
+        if order is None:
+            team_names = list(league.teams)
+        else:
+            team_names = []
+            for team_name in (name.strip() for name in order.split(',')):
+                resolved = state.find_team(team_name)
+                if resolved is None:
+                    outbox.send(ctx, f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name)}')
+                    return
+                team_names.append(resolved)
+
+        state.draft = Draft(league, team_names, rounds, snake=mode == 'snake', pick_seconds=pick_minutes * 60, channel_id=ctx.channel.id)
+        outbox.send(ctx, f"The draft is on: {rounds} rounds, {mode}, {pick_minutes:g} min per pick. Order: {', '.join(team_names)}.")
+        draft_progress(state)
+
+    except DraftError as e:
+        outbox.send(ctx, str(e))
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+@draft.command(name='pick', help='Draft a player for the team on the clock')
+async def draft_pick(ctx, player: discord.Member):
+    try:
+        state = leagues.get(ctx.guild.id)
+        draft = state.draft
+        if draft is None:
+            outbox.send(ctx, 'No draft is running.')
+            return
+        # The captain of the team on the clock, or an administrator for them
+        team_name = draft.on_the_clock()
+        if not state.league.is_captain(ctx.author.id, team_name) and not ctx.author.guild_permissions.administrator:
+            outbox.send(ctx, f'Only the captain of {team_name} can pick now.')
+            return
+
+        async with state.trade_engine.locked(draft.order):
+            picks = draft.pick(team_name, player.id)
+        outbox.send(ctx, f'{team_name} drafts {player.display_name}.' +
+                         (f' {len(picks) - 1} queued picks followed.' if len(picks) > 1 else ''))
+        draft_progress(state)
+
+    except DraftError as e:
+        outbox.send(ctx, str(e))
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+@draft.command(name='queue', help="Line up players for your team's next picks, best first; without players, clear the queue")
+async def draft_queue(ctx, players: commands.Greedy[discord.Member]):
+    try:
+        state = leagues.get(ctx.guild.id)
+        draft = state.draft
+        if draft is None:
+            outbox.send(ctx, 'No draft is running.')
+            return
+        team_name = state.league.captain_team(ctx.author.id)
+        if team_name not in draft.order:
+            outbox.send(ctx, "You don't captain a team in the draft.")
+            return
+
+        draft.queue(team_name, [player.id for player in players])
+        outbox.send(ctx, f'{team_name} has {len(draft.queues.get(team_name, ()))} players queued.')
+
+        # A team that is on the clock picks from its queue right away
+        if draft.on_the_clock() == team_name and team_name in draft.queues:
+            async with state.trade_engine.locked(draft.order):
+                picks = draft.run_queued()
+            if picks:
+                draft_progress(state)
+                return
+            outbox.send(ctx, 'None of the queued players can be drafted right now.')
+        state.configure(draft=draft.state())
+
+    except DraftError as e:
+        outbox.send(ctx, str(e))
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+@draft.command(name='skip', help="End the current pick's clock now")
+@commands.has_permissions(administrator=True)
+async def draft_skip(ctx):
+    try:
+        state = leagues.get(ctx.guild.id)
+        if state.draft is None:
+            outbox.send(ctx, 'No draft is running.')
+            return
+        await draft_pick_due(ctx.guild.id)
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+@draft.command(name='stop', help='Stop the draft; picks made so far stay')
+@commands.has_permissions(administrator=True)
+async def draft_stop(ctx):
+    try:
+        state = leagues.get(ctx.guild.id)
+        if state.draft is None:
+            outbox.send(ctx, 'No draft is running.')
+            return
+        draft_clock.cancel(ctx.guild.id)
+        picked = sum(player_id is not None for _, player_id in state.draft.picks)
+        state.draft = None
+        state.configure(draft=None)
+        outbox.send(ctx, f'Draft stopped after {picked} picks.')
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
 
 
 @bot.command(name='editstars')
 @commands.has_permissions(administrator=True)
 async def edit_stars(ctx, member: discord.Member, stars):
     try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
         player_id = member.id  # Use member.id as the player_id
 
         # Check if the player is in the players dictionary
-        if player_id in players:
-            # Edit the stars for the player
-            players[player_id]['stars'] = int(stars)
-
-            # Get the team name of the player
-            team_name = players[player_id]['team']
+        if player_id in league.players:
+            # Teams without a roster cap of their own have the league's
+            # default; a change that would put the player's team over it is
+            # refused rather than made
+            check = league.check_caps(stars={player_id: int(stars)})
+            if not check.ok:
+                outbox.send(ctx, f"Setting {member.display_name} to {stars} stars would put {check.describe()}.")
+                return
 
-            # Check if the team exists and has a roster cap
-            if team_name in teams and 'rostercap' in teams[team_name]:
-                roster_cap = teams[team_name]['rostercap']
-
-                # Calculate the total stars for the team
-                total_stars = sum(players[p]['stars'] for p in teams[team_name]['players'])
-
-                # Check if the team exceeds the roster cap
-                if total_stars > roster_cap:
-                    await ctx.send(f"Warning: Team {team_name} exceeds the roster cap of {roster_cap} stars. They cannot play anymore.")
-                    return
+            # Edit the stars for the player
+            league.set_stars(player_id, int(stars))
 
-            await ctx.send(f'Stars for {member.display_name} updated to {stars}.')
+            outbox.send(ctx, f'Stars for {member.display_name} updated to {stars}.')
         else:
-            await ctx.send(f'{member.display_name} is not a registered player.')
+            outbox.send(ctx, f'{member.display_name} is not a registered player.')
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
 
 
-@bot.command(name='rostercap', help='Set the maximum star cap for a team')
+@bot.hybrid_command(name='rostercap', help='Set the maximum star cap for a team')
 @commands.has_permissions(administrator=True)
+@app_commands.autocomplete(team_name=team_autocomplete)
 async def set_roster_cap(ctx, team_name: str, cap: int):
     try:
-        if team_name not in teams:
-            raise ValueError(f'Team {team_name} does not exist.')
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        resolved = state.find_team(team_name)
+        if resolved is None:
+            raise ValueError(f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name)}')
+        team_name = resolved
 
         # Update the roster cap for the team
-        teams[team_name]['rostercap'] = cap
+        league.set_cap(team_name, cap)
 
-        await ctx.send(f'Roster cap for {team_name} set to {cap} stars.')
+        outbox.send(ctx, f'Roster cap for {team_name} set to {cap} stars.')
 
     except ValueError as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
 
 
-@bot.command(name='removeplayer')
+@bot.command(name='defaultcap', help="Show or set this league's roster cap for teams without a cap of their own")
 @commands.has_permissions(administrator=True)
-async def remove_player(ctx, member: discord.Member, team_name):
+async def set_default_cap(ctx, cap: int = None):
     try:
+        state = leagues.get(ctx.guild.id)
+        if cap is None:
+            outbox.send(ctx, f'The default roster cap is {state.roster_cap} stars.')
+            return
+
+        state.configure(rostercap=cap)
+
+        outbox.send(ctx, f'Default roster cap set to {cap} stars.')
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='captainrole', help='Show or set the name of the role team captains need to sign players')
+@commands.has_permissions(administrator=True)
+async def set_captain_role(ctx, *, role_name: str = None):
+    try:
+        state = leagues.get(ctx.guild.id)
+        if role_name is None:
+            outbox.send(ctx, f'The captain role is {state.captain_role}.')
+            return
+
+        if discord.utils.get(ctx.guild.roles, name=role_name) is None:
+            outbox.send(ctx, f'There is no role called {role_name}.')
+            return
+
+        state.configure(captain_role=role_name)
+
+        outbox.send(ctx, f'Captain role set to {role_name}.')
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.hybrid_command(name='removeplayer', help='Remove a player from a team and the league')
+@commands.has_permissions(administrator=True)
+@app_commands.autocomplete(team_name=team_autocomplete)
+async def remove_player(ctx, member: discord.Member, *, team_name: str):
+    try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
         player_id = member.id  # Use member.id as the player_id
 
         # Check if the team exists
-        if team_name not in teams:
-            await ctx.send(f'Team {team_name} does not exist.')
+        resolved = state.find_team(team_name)
+        if resolved is None:
+            outbox.send(ctx, f'Team {team_name} does not exist.{did_you_mean(state.team_names, team_name)}')
             return
+        team_name = resolved
 
         # Check if the player is in the team
-        if player_id not in teams[team_name]['players']:
-            await ctx.send(f'{member.display_name} is not in {team_name}.')
+        if not league.on_roster(team_name, player_id):
+            outbox.send(ctx, f'{member.display_name} is not in {team_name}.')
             return
 
         # Remove the player from the team
-        teams[team_name]['players'].remove(player_id)
-        players.pop(player_id, None)
+        league.remove_player(player_id)
+
+        outbox.send(ctx, f'{member.display_name} removed from {team_name}')
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='history', help='Show the latest roster, star and captain changes for a player')
+async def player_history(ctx, player: discord.Object):
+    try:
+        state = leagues.get(ctx.guild.id)
+        events, total = await state.event_log.history(player.id)
+        if not events:
+            outbox.send(ctx, f'No history for <@{player.id}>.')
+            return
 
-        await ctx.send(f'{member.display_name} removed from {team_name}')
+        lines = [f"<t:{int(event['ts'])}:f> {describe(event)}" for event in events]
+        if total > len(events):
+            lines.insert(0, f'Latest {len(events)} of {total} events:')
+        outbox.send(ctx, embed=discord.Embed(title='History', description=f'<@{player.id}>\n' + '\n'.join(lines),
+                                             color=discord.Color.blue()))
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
+        outbox.send(ctx, f'Error: {error_message}')
 
 
-@bot.command(name='updateplayers')
+@bot.command(name='asof', help='Show a team roster at a past time, e.g. /asof 2024-03-01T18:00 roster Sharks')
+async def as_of(ctx, timestamp, what, *, team_name):
+    try:
+        state = leagues.get(ctx.guild.id)
+        if what != 'roster':
+            outbox.send(ctx, 'Usage: /asof <timestamp> roster <team>')
+            return
+        try:
+            when = parse_time(timestamp)
+        except ValueError:
+            outbox.send(ctx, f'Invalid timestamp {timestamp!r}. Use Unix seconds or an ISO date like 2024-03-01T18:00 (UTC).')
+            return
+
+        roster = await state.event_log.roster_at(team_name, when)
+        if roster is None:
+            outbox.send(ctx, f'No history recorded before <t:{int(state.event_log.checkpoint_times[0])}:f>.' if state.event_log.checkpoint_times
+                        else 'No history recorded yet.')
+            return
+
+        members = await member_cache.get_many(ctx.guild, roster)
+        names = [members[player_id].display_name if members.get(player_id) else f'<@{player_id}>' for player_id in roster[:50]]
+        if len(roster) > 50:
+            names.append(f'... and {len(roster) - 50} more')
+        outbox.send(ctx, embed=discord.Embed(title=f'**{team_name} Roster** as of <t:{int(when)}:f>',
+                                             description='\n'.join(names) or 'No players.', color=discord.Color.blue()))
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='checktotals', help='Rebuild team star totals and compare them with the running index')
+@commands.has_permissions(administrator=True)
+async def check_totals(ctx):
+    try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        rebuilt = TeamTotals.build(league.teams, league.players, league.default_cap)
+        mismatches = league.totals.diff(rebuilt)
+
+        # The rebuilt totals are authoritative either way, and the team
+        # ranking is derived from them
+        league.totals = rebuilt
+        league.rankings = Rankings.build(league.teams, league.players, rebuilt)
+        league.version += 1
+
+        if not mismatches:
+            outbox.send(ctx, f'Team totals are consistent ({len(league.teams)} teams checked).')
+            return
+
+        lines = [f'{team_name} {field}: index {indexed}, actual {actual}' for team_name, field, indexed, actual in mismatches[:20]]
+        if len(mismatches) > 20:
+            lines.append(f'... and {len(mismatches) - 20} more')
+        outbox.send(ctx, f'Found {len(mismatches)} mismatches, index rebuilt:\n' + '\n'.join(lines))
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='import', help='Import teams, players, stars, caps and captains from a CSV or JSON attachment')
+@commands.has_permissions(administrator=True)
+async def import_league(ctx):
+    try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        if not ctx.message.attachments:
+            outbox.send(ctx, 'Attach a CSV or JSON file with columns: ' + ', '.join(bulk.FIELDS))
+            return
+
+        attachment = ctx.message.attachments[0]
+        if attachment.size > bulk.MAX_IMPORT_BYTES:
+            outbox.send(ctx, f'{attachment.filename} is too large to import.')
+            return
+
+        data = await attachment.read()
+
+        # Validate the whole batch before touching anything
+        try:
+            rows = bulk.parse_rows(attachment.filename, data)
+            plan = bulk.plan_import(league, rows)
+        except bulk.ImportErrors as e:
+            with tempfile.TemporaryFile() as fp:
+                bulk.write_errors(e.errors, fp)
+                # Awaited so the file is still open when it is uploaded
+                await outbox.send(ctx, f'Import rejected, nothing was changed: {len(e.errors)} problem(s), see the attached file.',
+                                  file=discord.File(fp, filename='import_errors.csv'))
+            return
+
+        summary = bulk.apply_import(league, plan)
+
+        # New teams need their roles for the role sync to hand out
+        existing_roles = {role.name for role in ctx.guild.roles}
+        for team_name in plan['create_teams']:
+            if team_name not in existing_roles:
+                await ctx.guild.create_role(name=team_name)
+
+        outbox.send(ctx, f"Imported {len(rows)} rows: {summary['teams_created']} teams created, {summary['players']} players updated, "
+                         f"{summary['caps_set']} roster caps and {summary['captains_set']} captains set.")
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.command(name='export', help='Export the league as a CSV (default) or JSON attachment')
+@commands.has_permissions(administrator=True)
+async def export_league(ctx, fmt: str = 'csv'):
+    try:
+        state = leagues.get(ctx.guild.id)
+        league = state.league
+        fmt = 'json' if fmt.lower() == 'json' else 'csv'
+
+        # Rows are streamed into a temporary file rather than one big string
+        with tempfile.TemporaryFile() as fp:
+            bulk.write_export(league, fp, fmt)
+            await outbox.send(ctx, f'League export ({len(league.teams)} teams).', file=discord.File(fp, filename=f'league.{fmt}'))
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+def resync_status(resync):
+    if resync.error is not None:
+        return f'Updating players failed after {resync.checked} members: {resync.error}'
+    if resync.finished:
+        return (f'Players updated: {resync.checked} members checked, {resync.added} added, '
+                f'{resync.removed} departed players removed ({resync.released} from rosters).')
+    return f'Updating players: {resync.checked}/{resync.total} members checked, {resync.added} added so far.'
+
+
+def catch_up(guild_id):
+    # Joins and leaves while the bot was away are picked up by a resync
+    # without progress messages
+    state = leagues.peek(guild_id)
+    guild = bot.get_guild(guild_id)
+    if state is None or guild is None or (state.resync is not None and state.resync.running()):
+        return
+    state.resync = Resync(state.league, guild)
+    state.resync.start()
+
+
+@bot.command(name='updateplayers', help='Register every member as a player and remove departed ones, in the background')
 @commands.has_permissions(administrator=True)
 async def update_players(ctx):
     try:
-        # Iterate through all members in the server
-        for member in ctx.guild.members:
-            player_id = member.id  # Use member.id as the player_id
+        state = leagues.get(ctx.guild.id)
+        if state.resync is not None and state.resync.running():
+            outbox.send(ctx, f'Already running. {resync_status(state.resync)}')
+            return
+
+        # Members are read and registered in the background, a batch at a
+        # time, with progress shown in this message
+        progress_message = await outbox.send(ctx, 'Updating players from the member list...', coalesce=False)
+
+        async def progress(resync):
+            await progress_message.edit(content=resync_status(resync))
+
+        state.resync = Resync(state.league, ctx.guild, progress=progress)
+        state.resync.start()
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
 
-            # Check if the player is not already in the players dictionary
-            if player_id not in players:
-                # Add the player to the players dictionary with initial stars set to 0
-                players[player_id] = {'team': None, 'stars': 0}
 
-        await ctx.send('Players dictionary updated with all members from the server.')
+@bot.after_invoke
+async def record_command_latency(ctx):
+    started_at = getattr(ctx, 'started_at', None)
+    if started_at is not None:
+        metrics.observe_command(ctx.command.qualified_name, time.perf_counter() - started_at, failed=ctx.command_failed)
+
+
+@bot.command(name='synccommands', help='Register the slash commands with Discord for this server')
+@commands.has_permissions(administrator=True)
+async def sync_commands(ctx):
+    try:
+        # Guild commands show up at once; global ones can take an hour
+        bot.tree.copy_global_to(guild=ctx.guild)
+        synced = await bot.tree.sync(guild=ctx.guild)
+        outbox.send(ctx, f'Synced {len(synced)} slash commands.')
 
     except Exception as e:
         error_message = str(e)
-        await ctx.send(f'Error: {error_message}')
-    
+        outbox.send(ctx, f'Error: {error_message}')
 
+
+@bot.command(name='stats', help='Show command latency and REST call metrics')
+@commands.has_permissions(administrator=True)
+async def stats(ctx, output: str = 'summary'):
+    try:
+        if output == 'prometheus':
+            # Prometheus text exposition format, as an attachment
+            data = io.BytesIO(metrics.prometheus().encode())
+            outbox.send(ctx, file=discord.File(data, filename='metrics.prom'))
+        else:
+            outbox.send(ctx, metrics.summary())
+
+    except Exception as e:
+        error_message = str(e)
+        outbox.send(ctx, f'Error: {error_message}')
+
+
+async def main():
+    setup_logging(os.environ.get('AAFLBOT_LOG_LEVEL', 'INFO'))
+
+    # Leagues are loaded per guild once the bot knows its guilds (on_ready);
+    # open offers are picked up by the worker that owns their guild
+    pending.load(keep=owns_action)
+    pending.start()
+    votes.start()
+    bus.start()
+    # The launcher stops workers with SIGTERM; close the bot so everything
+    # below is flushed
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    if api is not None:
+        await api.start()
+    try:
+        async with bot:
+            await bot.start(os.environ['DISCORD_TOKEN'])
+    finally:
+        if api is not None:
+            await api.stop()
+        bus.stop()
+        audits.stop()
+        draft_clock.stop()
+        await leagues.close()
+        await action_storage.flush()
+        action_storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
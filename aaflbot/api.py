@@ -0,0 +1,189 @@
+import hashlib
+import json
+
+from aiohttp import web
+
+from metrics import get_logger
+from pages import PageCache
+from rankings import ALL
+
+log = get_logger('aaflbot.api')
+
+LEADERBOARD_PAGE_SIZE = 50  # Players per /leaderboard page
+
+
+class LeagueAPI:
+    # Read-only JSON view of the leagues for the league website and stream
+    # overlays, served by aiohttp on the bot's event loop:
+    #
+    #   GET /teams                  every team's stars, cap and rank
+    #   GET /teams/{name}/roster    one team's players
+    #   GET /players/{id}           one player's team, stars and ranks
+    #   GET /leaderboard?page=&team= players by stars, LEADERBOARD_PAGE_SIZE a page
+    #
+    # under /guilds/{guild_id}/..., or without the prefix for the home guild.
+    #
+    # Every response body is serialized once per league version and kept in
+    # a PageCache, together with its ETag, so repeated polls cost a dict
+    # lookup, and a poll sending the ETag back in If-None-Match gets an empty
+    # 304. Rendering reads only in-memory state and never awaits, so it
+    # can't interleave with a mutation. Discord IDs are sent as strings;
+    # JavaScript numbers can't hold them exactly.
+
+    def __init__(self, lookup, host='127.0.0.1', port=8080, home_guild_id=0, cache_size=1024):
+        # lookup(guild_id) -> the guild's GuildLeague, or None if it has none
+        # served here
+        self.lookup = lookup
+        self.host = host
+        self.port = port
+        self.home_guild_id = home_guild_id
+        self.cache = PageCache(cache_size)
+        self.not_modified = 0
+        self._runner = None
+
+        self.app = web.Application()
+        for prefix in ('', '/guilds/{guild_id}'):
+            self.app.router.add_get(prefix + '/teams', self.teams)
+            self.app.router.add_get(prefix + '/teams/{name}/roster', self.roster)
+            self.app.router.add_get(prefix + '/players/{player_id}', self.player)
+            self.app.router.add_get(prefix + '/leaderboard', self.leaderboard)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info('api_listening', host=self.host, port=self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def clear(self):
+        # Forget every response, e.g. after a league was closed and will be
+        # loaded again (its version starts over)
+        self.cache.clear()
+
+    # Helpers
+
+    @staticmethod
+    def _error(status, message):
+        body = json.dumps({'error': message}).encode()
+        return web.Response(body=body, status=status, content_type='application/json')
+
+    def _state(self, request):
+        try:
+            guild_id = int(request.match_info.get('guild_id', self.home_guild_id))
+        except ValueError:
+            guild_id = 0
+        state = self.lookup(guild_id) if guild_id else None
+        if state is None:
+            raise web.HTTPNotFound(body=json.dumps({'error': 'No league here for that guild'}), content_type='application/json')
+        return state
+
+    def _respond(self, request, state, key, render):
+        # render() -> the JSON-able body, called only when the league changed
+        # since this key was last served
+        def serialize():
+            body = json.dumps(render(), separators=(',', ':')).encode()
+            return body, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+        body, etag = self.cache.get((state.guild_id,) + key, state.league.version, serialize)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        tags = {tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')}
+        if '*' in tags or etag in tags or 'W/' + etag in tags:
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, headers=headers, content_type='application/json')
+
+    @staticmethod
+    def _name(state, player_id):
+        # Players are named once they are on a roster (see index_player_name)
+        return state.player_names.names.get(player_id)
+
+    # Endpoints
+
+    async def teams(self, request):
+        state = self._state(request)
+        league = state.league
+
+        def render():
+            return [{'name': team_name,
+                     'stars': league.totals.total(team_name),
+                     'cap': league.totals.cap(team_name),
+                     'players': league.totals.count(team_name),
+                     'captain': str(team_data['captain']) if team_data.get('captain') is not None else None,
+                     'rank': league.rankings.team_rank(team_name)}
+                    for team_name, team_data in league.teams.items()]
+
+        return self._respond(request, state, ('teams',), render)
+
+    async def roster(self, request):
+        state = self._state(request)
+        league = state.league
+        team_name = state.find_team(request.match_info['name'])
+        if team_name is None:
+            return self._error(404, 'No such team')
+
+        def render():
+            captain = league.captain_of(team_name)
+            return {'name': team_name,
+                    'stars': league.totals.total(team_name),
+                    'cap': league.totals.cap(team_name),
+                    'captain': str(captain) if captain is not None else None,
+                    'players': [{'id': str(player_id), 'name': self._name(state, player_id), 'stars': league.stars_of(player_id)}
+                                for player_id in league.roster(team_name)]}
+
+        return self._respond(request, state, ('roster', team_name), render)
+
+    async def player(self, request):
+        state = self._state(request)
+        league = state.league
+        try:
+            player_id = int(request.match_info['player_id'])
+        except ValueError:
+            return self._error(404, 'No such player')
+        if player_id not in league.players:
+            return self._error(404, 'No such player')
+
+        def render():
+            stars = league.stars_of(player_id)
+            team_name = league.team_of(player_id)
+            return {'id': str(player_id),
+                    'name': self._name(state, player_id),
+                    'team': team_name,
+                    'stars': stars,
+                    'captain_of': league.captain_team(player_id),
+                    'rank': league.rankings.rank(stars),
+                    'team_rank': league.rankings.rank(stars, team_name)}
+
+        return self._respond(request, state, ('player', player_id), render)
+
+    async def leaderboard(self, request):
+        state = self._state(request)
+        league = state.league
+        try:
+            page = max(1, int(request.query.get('page', '1')))
+        except ValueError:
+            return self._error(400, 'page must be a number')
+        team = request.query.get('team')
+        if team is None:
+            group = ALL
+        elif team.lower() in ('fa', 'free agents'):
+            group = None
+        else:
+            group = state.find_team(team)
+            if group is None:
+                return self._error(404, 'No such team')
+
+        def render():
+            start = (page - 1) * LEADERBOARD_PAGE_SIZE
+            listed = league.rankings.listed(group)
+            return {'group': 'all' if group is ALL else 'free agents' if group is None else group,
+                    'page': page,
+                    'pages': max(1, -(-listed // LEADERBOARD_PAGE_SIZE)),
+                    'players': [{'rank': rank, 'id': str(player_id), 'name': self._name(state, player_id), 'stars': stars,
+                                 'team': league.team_of(player_id)}
+                                for rank, player_id, stars in league.rankings.page(start, start + LEADERBOARD_PAGE_SIZE, group)]}
+
+        return self._respond(request, state, ('leaderboard', group, page), render)
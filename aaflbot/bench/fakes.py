@@ -0,0 +1,256 @@
+import asyncio
+import itertools
+from collections import Counter
+
+import discord
+
+# In-process stand-ins for the discord.py objects the commands touch. Every
+# method that would hit the REST API goes through RestRecorder, which keeps
+# a virtual clock instead of sleeping so large runs stay fast.
+
+_ids = itertools.count(1_000_000)
+
+
+def next_id():
+    return next(_ids)
+
+
+class RestRecorder:
+    # Counts simulated API calls per route and models Discord's per-route
+    # buckets: `limit` calls per `window` seconds for each (route, major
+    # parameter) pair, each call costing `latency` seconds of virtual time.
+
+    def __init__(self, latency=0.05, limit=5, window=5.0):
+        self.latency = latency
+        self.limit = limit
+        self.window = window
+        self.clock = 0.0
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self._buckets = {}
+
+    def call(self, route, major=None):
+        key = (route, major)
+        reset, remaining = self._buckets.get(key, (self.clock + self.window, self.limit))
+        if self.clock >= reset:
+            reset, remaining = self.clock + self.window, self.limit
+        if remaining == 0:
+            # Would have been a 429; wait out the bucket
+            self.rate_limited[route] += 1
+            self.clock = reset
+            reset, remaining = self.clock + self.window, self.limit
+        self._buckets[key] = (reset, remaining - 1)
+        self.clock += self.latency
+        self.calls[route] += 1
+
+    def reset(self):
+        self.clock = 0.0
+        self.calls.clear()
+        self.rate_limited.clear()
+        self._buckets.clear()
+
+    def snapshot(self):
+        return {
+            'calls': sum(self.calls.values()),
+            'by_route': dict(self.calls),
+            'rate_limited': sum(self.rate_limited.values()),
+            'simulated_seconds': round(self.clock, 3),
+        }
+
+
+class FakeAsset:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeRole:
+    def __init__(self, guild, name, position=1, default=False):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.position = position
+        self._default = default
+
+    def __repr__(self):
+        return f'<FakeRole {self.name}>'
+
+    def is_default(self):
+        return self._default
+
+    async def edit(self, position=None, **kwargs):
+        self.guild.rest.call('PATCH /guilds/{guild_id}/roles', self.guild.id)
+        if position is not None:
+            self.position = position
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None, file=None):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.file = file
+        self.reactions = []
+        self.mentions = []
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        self.channel.rest.call('PATCH /channels/{channel_id}/messages/{message_id}', self.channel.id)
+        self.content = content
+        self.embed = embed
+
+    async def clear_reactions(self):
+        self.channel.rest.call('DELETE /channels/{channel_id}/messages/{message_id}/reactions', self.channel.id)
+        self.reactions.clear()
+
+    async def add_reaction(self, emoji):
+        self.channel.rest.call('PUT /channels/{channel_id}/messages/{message_id}/reactions', self.channel.id)
+        self.reactions.append(emoji)
+
+
+class FakeChannel:
+    def __init__(self, rest, guild=None):
+        self.id = next_id()
+        self.rest = rest
+        self.guild = guild
+        self.messages = {}
+
+    async def send(self, content=None, embed=None, file=None, **kwargs):
+        self.rest.call('POST /channels/{channel_id}/messages', self.id)
+        message = FakeMessage(self, content, embed, file)
+        self.messages[message.id] = message
+        return message
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+    async def fetch_message(self, message_id):
+        self.rest.call('GET /channels/{channel_id}/messages/{message_id}', self.id)
+        return self.messages[message_id]
+
+
+class FakeMember:
+    def __init__(self, guild, name, bot=False):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.roles = [guild.default_role]
+        self.avatar = FakeAsset(f'https://cdn.example/{self.id}.png')
+        self.mention = f'<@{self.id}>'
+        self._dm = None
+
+    def __repr__(self):
+        return f'<FakeMember {self.name}>'
+
+    @property
+    def top_role(self):
+        return max(self.roles, key=lambda role: role.position)
+
+    async def send(self, content=None, **kwargs):
+        if self._dm is None:
+            self.guild.rest.call('POST /users/@me/channels')
+            self._dm = FakeChannel(self.guild.rest)
+        return await self._dm.send(content, **kwargs)
+
+    async def add_roles(self, *roles, **kwargs):
+        for role in roles:
+            self.guild.rest.call('PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}', self.guild.id)
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, **kwargs):
+        for role in roles:
+            self.guild.rest.call('DELETE /guilds/{guild_id}/members/{user_id}/roles/{role_id}', self.guild.id)
+            if role in self.roles:
+                self.roles.remove(role)
+
+    async def edit(self, roles=None, **kwargs):
+        self.guild.rest.call('PATCH /guilds/{guild_id}/members/{user_id}', self.guild.id)
+        if roles is not None:
+            self.roles = [self.guild.default_role] + [role for role in roles if not role.is_default()]
+
+
+class FakeGuild:
+    def __init__(self, rest):
+        self.id = next_id()
+        self.rest = rest
+        self.default_role = FakeRole(self, '@everyone', position=0, default=True)
+        self.roles = [self.default_role]
+        self._members = {}
+        self.chunked = True
+        self.me = self.add_member('aaflbot', bot=True)
+        self.me.roles.append(FakeRole(self, 'aaflbot', position=1000))
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def member_count(self):
+        return len(self._members)
+
+    def add_member(self, name, bot=False):
+        member = FakeMember(self, name, bot=bot)
+        self._members[member.id] = member
+        return member
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_role(self, role_id):
+        for role in self.roles:
+            if role.id == role_id:
+                return role
+        return None
+
+    async def create_role(self, name, **kwargs):
+        self.rest.call('POST /guilds/{guild_id}/roles', self.id)
+        role = FakeRole(self, name)
+        self.roles.append(role)
+        return role
+
+
+class FakeCommand:
+    def __init__(self, name):
+        self.name = name
+        self.qualified_name = name
+
+
+class FakeContext:
+    def __init__(self, guild, channel, author, command=None):
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.bot = FakeBot([guild])
+        self.command = FakeCommand(command) if command else None
+        self.message = FakeMessage(channel)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        message = await self.channel.send(content, **kwargs)
+        self.sent.append(message)
+        return message
+
+
+class FakeBot:
+    # Just enough of commands.Bot for subsystems that look at bot.guilds and
+    # for discord.ext.menus
+    def __init__(self, guilds):
+        self.guilds = guilds
+        self.user = guilds[0].me if guilds else None
+
+    def get_guild(self, guild_id):
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    @property
+    def loop(self):
+        return asyncio.get_running_loop()
+
+    def is_closed(self):
+        return False
+
+    async def wait_for(self, event, check=None, timeout=None):
+        # Nobody reacts in a benchmark
+        await asyncio.sleep(timeout or 0)
+        raise asyncio.TimeoutError
@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from players import PlayerStore  # noqa: E402
+
+# Memory held by the player table after /updateplayers on a large guild:
+# the old dict of dicts versus PlayerStore. Every member is registered,
+# `teams * roster_size` of them are rostered with 0-2 stars and a few free
+# agents have stars.
+#
+#   python -m bench.memory --members 10000,50000
+
+
+def fill(players, members, teams, roster_size, seed=0):
+    rng = random.Random(seed)
+    ids = [rng.getrandbits(60) for _ in range(members)]
+    rostered = teams * roster_size
+    for i, player_id in enumerate(ids):
+        if i < rostered:
+            players[player_id] = {'team': f'Team {i // roster_size}', 'stars': rng.randint(0, 2)}
+        elif i < rostered + members // 100:
+            players[player_id] = {'team': None, 'stars': 1}
+        else:
+            players[player_id] = {'team': None, 'stars': 0}
+    return players
+
+
+def measure(factory, members, teams, roster_size):
+    tracemalloc.start()
+    players = fill(factory(), members, teams, roster_size)
+    if isinstance(players, PlayerStore):
+        players.compact()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'retained_kb': round(current / 1024, 1), 'peak_kb': round(peak / 1024, 1), 'players': len(players)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Player table memory, dict of dicts vs PlayerStore')
+    parser.add_argument('--members', default='10000,50000', help='comma separated guild sizes')
+    parser.add_argument('--teams', type=int, default=50)
+    parser.add_argument('--roster-size', type=int, default=10)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for members in (int(size) for size in args.members.split(',')):
+        old = measure(dict, members, args.teams, args.roster_size)
+        new = measure(PlayerStore, members, args.teams, args.roster_size)
+        results[members] = {'dict': old, 'store': new}
+        print(f'{members:>8} members  dict {old["retained_kb"]:>9.1f}KiB  store {new["retained_kb"]:>8.1f}KiB '
+              f'({old["retained_kb"] / new["retained_kb"]:.1f}x smaller, peak {new["peak_kb"]:.1f}KiB)')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
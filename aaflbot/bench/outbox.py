@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+
+from bench.standin import StandIn  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+# Direct sends versus the outbox against the local stand-in server, using
+# discord.py's real HTTP client and rate-limit handling.
+#
+#   replies:   CHANNELS channels each get REPLIES short replies at once, as
+#              from that many commands finishing together
+#   dms:       one DM to each of DMS users, as notify_team_captain did
+#   reactions: two reactions on each of DMS messages in different DMs
+#
+#   python -m bench.outbox --channels 5 --replies 20 --dms 20
+
+
+def user(client, user_id):
+    data = {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0', 'avatar': None, 'global_name': None}
+    return discord.User(state=client._connection, data=data)
+
+
+async def run_mode(mode, standin, channels, replies, dms):
+    client = discord.Client(intents=discord.Intents.none())
+    await client.login('standin-token')
+    metrics = Metrics()
+    outbox = Outbox(metrics)
+    results = {}
+    try:
+        async def scenario(name, direct, queued):
+            # Let every rate limit window from the last scenario run out
+            await asyncio.sleep(1.0)
+            standin.reset()
+            start = time.perf_counter()
+            outcomes = await (direct() if mode == 'direct' else queued())
+            results[name] = {
+                'seconds': round(time.perf_counter() - start, 3),
+                'failed': sum(isinstance(outcome, Exception) for outcome in outcomes),
+                'requests': sum(standin.requests.values()),
+                'rate_limited': sum(standin.rate_limited.values()),
+                'messages': len(standin.messages),
+            }
+
+        # Learn the bucket of every route first, as a running bot already
+        # has; discord.py holds concurrent requests to a route it hasn't seen
+        warm = await user(client, 1).send('warm up')
+        await warm.add_reaction('✅')
+
+        targets = [client.get_partial_messageable(1000 + i) for i in range(channels)]
+
+        async def replies_direct():
+            return await asyncio.gather(*(channel.send(f'Reply {n} in {channel.id}') for channel in targets for n in range(replies)),
+                                        return_exceptions=True)
+
+        async def replies_queued():
+            return await asyncio.gather(*(outbox.send(channel, f'Reply {n} in {channel.id}') for channel in targets for n in range(replies)),
+                                        return_exceptions=True)
+
+        await scenario('replies', replies_direct, replies_queued)
+
+        users = [user(client, 5000 + i * 10) for i in range(dms)]
+
+        async def dms_direct():
+            outcomes = []
+            for member in users:
+                try:
+                    outcomes.append(await member.send('Trade Proposal: ...'))
+                except discord.HTTPException as e:
+                    outcomes.append(e)
+            return outcomes
+
+        async def dms_queued():
+            return await asyncio.gather(*(outbox.send(member, 'Trade Proposal: ...') for member in users), return_exceptions=True)
+
+        await scenario('dms', dms_direct, dms_queued)
+
+        messages = [client.get_partial_messageable(member.id + 1, type=discord.ChannelType.private).get_partial_message(1)
+                    for member in users]
+
+        async def reactions_direct():
+            async def sign(message):
+                await message.add_reaction('✅')
+                await message.add_reaction('❌')
+            return await asyncio.gather(*(sign(message) for message in messages), return_exceptions=True)
+
+        async def reactions_queued():
+            return await asyncio.gather(*(outbox.react(message, '✅', '❌') for message in messages), return_exceptions=True)
+
+        await scenario('reactions', reactions_direct, reactions_queued)
+
+        if mode == 'outbox':
+            results['outbox'] = {'delivered': metrics.outbox_latency.count, 'sent': outbox.sent, 'coalesced': outbox.coalesced,
+                                 'latency_p50': metrics.outbox_latency.quantile(0.5),
+                                 'latency_p95': metrics.outbox_latency.quantile(0.95)}
+    finally:
+        await client.close()
+    return results
+
+
+async def run(args):
+    standin = StandIn(latency=args.latency)
+    discord.http.Route.BASE = await standin.start()
+    try:
+        return {mode: await run_mode(mode, standin, args.channels, args.replies, args.dms) for mode in ('direct', 'outbox')}
+    finally:
+        await standin.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Direct sends vs the outbox against a local stand-in Discord API')
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--replies', type=int, default=20)
+    parser.add_argument('--dms', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='stand-in response time in seconds')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    for scenario in ('replies', 'dms', 'reactions'):
+        direct, queued = results['direct'][scenario], results['outbox'][scenario]
+        print(f'{scenario:<10} direct {direct["seconds"]:>7.2f}s {direct["requests"]:>4} requests {direct["rate_limited"]:>3} 429s {direct["failed"]:>3} failed'
+              f'   outbox {queued["seconds"]:>7.2f}s {queued["requests"]:>4} requests {queued["rate_limited"]:>3} 429s {queued["failed"]:>3} failed')
+    print('outbox', results['outbox']['outbox'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Keep the benchmark off the real database and event log; must be set before importing the bot
+os.environ.setdefault('AAFLBOT_DB', ':memory:')
+os.environ.setdefault('AAFLBOT_EVENTS', ':memory:')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aaflbot  # noqa: E402
+from bench.fakes import FakeBot, FakeChannel, FakeContext, FakeGuild, FakeRole, RestRecorder  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+# Drives the real command callbacks from aaflbot.py against fake guilds at
+# league scale. Checks and argument conversion are bypassed; everything the
+# callbacks do against the league state and the (fake) API is measured.
+#
+#   python -m bench.run --sizes 50x2000,500x20000 --output bench/baseline.json
+#   python -m bench.run --baseline bench/baseline.json
+
+
+def build_league(teams, members, roster_size, seed=0):
+    rng = random.Random(seed)
+    # Each size runs in its own event loop
+    aaflbot.outbox = Outbox(aaflbot.metrics)
+
+    rest = RestRecorder()
+    guild = FakeGuild(rest)
+    channel = FakeChannel(rest, guild)
+    # A fresh league for the guild; the role audit timers are not run
+    state = aaflbot.leagues.get(guild.id)
+    aaflbot.audits.cancel(guild.id)
+    state.role_sync.stop()
+    league = state.league
+    admin = guild.add_member('admin')
+    people = [guild.add_member(f'member{i}') for i in range(members)]
+
+    for i in range(teams):
+        team_name = f'Team {i}'
+        # Room for a full roster at the maximum stars, so trades pass the cap check
+        league.create_team(team_name, cap=roster_size * 2)
+        guild.roles.append(FakeRole(guild, team_name))
+    rostered = iter(people)
+    for i in range(teams):
+        team_name = f'Team {i}'
+        for _ in range(roster_size):
+            member = next(rostered, None)
+            if member is None:
+                break
+            league.register_player(member.id)
+            league.set_stars(member.id, rng.randint(0, 2))
+            league.assign(member.id, team_name)
+        roster = league.roster(team_name)
+        if roster:
+            league.set_captain(team_name, roster[0])
+
+    state.role_sync.bot = FakeBot([guild])
+    state.role_sync.dirty.clear()
+    return guild, channel, admin
+
+
+async def measure(rest, func, repeat):
+    walls = []
+    peak = 0
+    blocks = 0
+    api = None
+    for _ in range(repeat):
+        rest.reset()
+        tracemalloc.start()
+        start = time.perf_counter()
+        await func()
+        # Let queued replies and follow-up tasks the command spawned (e.g.
+        # menu reactions) run
+        await aaflbot.outbox.join()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        wall = time.perf_counter() - start
+        current, run_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        walls.append(wall)
+        peak = max(peak, run_peak)
+        blocks = max(blocks, current)
+        api = rest.snapshot()
+    return {
+        'wall_first_ms': round(walls[0] * 1000, 3),
+        'wall_min_ms': round(min(walls) * 1000, 3),
+        'wall_median_ms': round(statistics.median(walls) * 1000, 3),
+        'alloc_peak_kb': round(peak / 1024, 1),
+        'alloc_retained_kb': round(blocks / 1024, 1),
+        'api': api,
+    }
+
+
+async def run_size(teams, members, roster_size, repeat):
+    guild, channel, admin = build_league(teams, members, roster_size)
+    rest = guild.rest
+    state = aaflbot.leagues.get(guild.id)
+    league = state.league
+    results = {}
+
+    def ctx(command):
+        return FakeContext(guild, channel, admin, command)
+
+    results['teamlist'] = await measure(rest, lambda: aaflbot.team_list.callback(ctx('teamlist')), repeat)
+    results['roster'] = await measure(rest, lambda: aaflbot.display_roster.callback(ctx('roster'), team_name='Team 0'), repeat)
+    results['leaderboard'] = await measure(rest, lambda: aaflbot.leaderboard.callback(ctx('leaderboard')), repeat)
+    results['teamrank'] = await measure(rest, lambda: aaflbot.team_rank.callback(ctx('teamrank')), repeat)
+
+    async def trade():
+        # Swap the last players of two teams back and forth
+        first = guild.get_member(league.roster('Team 1')[-1])
+        second = guild.get_member(league.roster('Team 2')[-1])
+        await aaflbot.perform_trade(state, aaflbot.trade_moves(league, [first.id], [second.id]))
+    results['trade'] = await measure(rest, trade, repeat)
+
+    async def update_players():
+        # The command only starts the resync; measure it to the end
+        await aaflbot.update_players.callback(ctx('updateplayers'))
+        await state.resync.wait()
+    results['updateplayers'] = await measure(rest, update_players, repeat)
+
+    async def update_roles():
+        await aaflbot.audit_roles(state, guild)
+        await state.role_sync.drain()
+    # The first audit has to hand out every team role; later ones are no-ops
+    results['update_roles_cold'] = await measure(rest, update_roles, 1)
+    results['update_roles_steady'] = await measure(rest, update_roles, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for size, commands in results.items():
+        for command, result in commands.items():
+            old = baseline.get('results', {}).get(size, {}).get(command)
+            if not old:
+                continue
+            ratio = result['wall_min_ms'] / max(old['wall_min_ms'], 1e-6)
+            calls = result['api']['calls'] - old['api']['calls']
+            marker = ' REGRESSION' if ratio > threshold or calls > 0 else ''
+            print(f'{size:>12} {command:<20} {old["wall_min_ms"]:>10.2f}ms -> {result["wall_min_ms"]:>10.2f}ms ({ratio:.2f}x), api calls {calls:+d}{marker}')
+            if marker:
+                regressions.append((size, command))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline league-scale benchmarks for aaflbot commands')
+    parser.add_argument('--sizes', default='50x2000,500x20000', help='comma separated TEAMSxMEMBERS')
+    parser.add_argument('--roster-size', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against a previous JSON result')
+    parser.add_argument('--threshold', type=float, default=1.25, help='wall-time ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes.split(','):
+        teams, members = (int(part) for part in size.lower().split('x'))
+        results[size] = asyncio.run(run_size(teams, members, args.roster_size, args.repeat))
+        for command, result in results[size].items():
+            print(f'{size:>12} {command:<20} {result["wall_min_ms"]:>10.2f}ms  peak {result["alloc_peak_kb"]:>10.1f}KiB  '
+                  f'api {result["api"]["calls"]:>6} ({result["api"]["rate_limited"]} limited, {result["api"]["simulated_seconds"]}s)')
+
+    report = {
+        'meta': {'python': platform.python_version(), 'roster_size': args.roster_size, 'repeat': args.repeat},
+        'results': results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            exit_code = 1
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# A local stand-in for the few Discord REST endpoints the outbox uses, with
+# Discord-style rate limits: every (route, channel) bucket allows `limit`
+# requests per `window` seconds and answers with X-RateLimit-* headers, and
+# all requests share a global limit of `per_second`. Past a limit it returns
+# 429 with retry_after and a Via header (without one discord.py takes a 429
+# for a Cloudflare ban and gives up). Point discord.py at it with
+# `discord.http.Route.BASE = standin.base`.
+
+
+def json_response(body, status=200, headers=None):
+    # discord.py only decodes an exact "application/json" content type, and
+    # aiohttp's own json_response appends a charset
+    return web.Response(body=json.dumps(body).encode(), status=status, headers=headers, content_type='application/json')
+
+
+class StandIn:
+    def __init__(self, latency=0.02, limits=None, per_second=50):
+        # limits: {route: (limit, window)}
+        self.latency = latency
+        self.limits = {'messages': (5, 1.0), 'reactions': (1, 0.25), 'dm': (30, 1.0), 'global': (per_second, 1.0)}
+        self.limits.update(limits or {})
+        self.requests = Counter()
+        self.rate_limited = Counter()
+        self.messages = []
+        self._buckets = {}
+        self._ids = itertools.count(10 ** 17)
+        self._runner = None
+        self.base = None
+
+    def reset(self):
+        self.requests.clear()
+        self.rate_limited.clear()
+        self.messages.clear()
+        self._buckets.clear()
+
+    def _limit(self, route, major):
+        # Returns (headers, retry_after or None)
+        limit, window = self.limits[route]
+        now = time.monotonic()
+        reset, remaining = self._buckets.get((route, major), (now + window, limit))
+        if now >= reset:
+            reset, remaining = now + window, limit
+        if remaining == 0:
+            self.rate_limited[route] += 1
+            return {}, reset - now
+        self._buckets[(route, major)] = (reset, remaining - 1)
+        return {
+            'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(remaining - 1),
+            'X-RateLimit-Reset-After': f'{reset - now:.3f}',
+            'X-RateLimit-Bucket': route,
+        }, None
+
+    async def _respond(self, route, major, body=None, status=200):
+        self.requests[route] += 1
+        _, retry_after = self._limit('global', None)
+        if retry_after is not None:
+            return json_response({'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': True},
+                                 status=429, headers={'Retry-After': f'{retry_after:.3f}', 'X-RateLimit-Global': 'true',
+                                                      'X-RateLimit-Scope': 'global', 'Via': 'standin'})
+        headers, retry_after = self._limit(route, major)
+        if retry_after is not None:
+            return json_response({'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+                                 status=429, headers={'Retry-After': f'{retry_after:.3f}', 'X-RateLimit-Scope': 'user', 'Via': 'standin'})
+        await asyncio.sleep(self.latency)
+        if body is None:
+            return web.Response(status=204, headers=headers)
+        return json_response(body, status=status, headers=headers)
+
+    def _user(self, user_id):
+        return {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0', 'avatar': None, 'global_name': None}
+
+    async def me(self, request):
+        return json_response(self._user(1))
+
+    async def application(self, request):
+        return json_response({'id': '1', 'name': 'aaflbot', 'description': '', 'icon': None, 'bot_public': False,
+                              'bot_require_code_grant': False, 'owner': self._user(2), 'verify_key': '', 'flags': 0})
+
+    async def create_message(self, request):
+        channel_id = request.match_info['channel_id']
+        payload = json.loads(await request.read() or b'{}')
+        message = {
+            'id': str(next(self._ids)), 'channel_id': channel_id, 'author': self._user(1), 'type': 0,
+            'content': payload.get('content') or '', 'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+            'attachments': [], 'embeds': payload.get('embeds') or [], 'pinned': False,
+        }
+        response = await self._respond('messages', channel_id, message)
+        if response.status == 200:
+            self.messages.append((int(channel_id), message['content']))
+        return response
+
+    async def add_reaction(self, request):
+        return await self._respond('reactions', request.match_info['channel_id'])
+
+    async def create_dm(self, request):
+        payload = json.loads(await request.read())
+        recipient = int(payload['recipient_id'])
+        # DM channel IDs are derived from the user so they stay stable
+        return await self._respond('dm', 'dm', {'id': str(recipient + 1), 'type': 1, 'recipients': [self._user(recipient)]})
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.add_routes([
+            web.get('/api/v10/users/@me', self.me),
+            web.get('/api/v10/oauth2/applications/@me', self.application),
+            web.post('/api/v10/users/@me/channels', self.create_dm),
+            web.post('/api/v10/channels/{channel_id}/messages', self.create_message),
+            web.put('/api/v10/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me', self.add_reaction),
+        ])
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base = f'http://{host}:{port}/api/v10'
+        return self.base
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,151 @@
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+from discord.ext import commands  # noqa: E402
+
+from members import MemberCache, bot_options  # noqa: E402
+
+# Startup cost of the all-intents mode versus lean mode (AAFLBOT_LEAN=1) for
+# one large guild, measured on discord.py's real connection state.
+#
+# All intents: the guild arrives, then discord.py chunks every member (with
+# presences) into its cache before on_ready. Lean: the guild arrives with no
+# members; the rostered players end up in MemberCache the first time they
+# are looked up. Each mode runs in its own process so RSS is comparable.
+#
+#   python -m bench.startup --members 10000,50000
+#
+# Network time is not simulated; `chunks` is the number of gateway
+# round trips discord.py waits for before on_ready.
+
+CHUNK_SIZE = 1000
+QUERY_SIZE = 100
+
+
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def guild_payload(guild_id, teams, members):
+    roles = [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+              'hoist': False, 'managed': False, 'mentionable': False}]
+    roles += [{'id': str(guild_id + 1 + i), 'name': f'Team {i}', 'permissions': '0', 'position': i + 1, 'color': 0,
+               'hoist': False, 'managed': False, 'mentionable': False} for i in range(teams)]
+    return {'id': str(guild_id), 'name': 'League', 'owner_id': str(guild_id), 'roles': roles, 'emojis': [],
+            'stickers': [], 'features': [], 'channels': [], 'member_count': members, 'large': True,
+            'unavailable': False}
+
+
+def member_payload(user_id, role_ids):
+    return {
+        'user': {'id': str(user_id), 'username': f'member{user_id}', 'discriminator': '0', 'avatar': None,
+                 'global_name': f'Member {user_id}'},
+        'roles': role_ids,
+        'joined_at': datetime.datetime(2023, 1, 1).isoformat(),
+        'deaf': False,
+        'mute': False,
+        'nick': None,
+        'flags': 0,
+    }
+
+
+def presence_payload(user_id):
+    return {'user': {'id': str(user_id)}, 'status': 'online', 'activities': [], 'client_status': {'desktop': 'online'}}
+
+
+def run_mode(mode, teams, members, roster_size):
+    bot = commands.Bot(command_prefix='/', **bot_options(mode == 'lean'))
+    state = bot._connection
+    guild_id = 10 ** 17
+    first_member = guild_id + 10 ** 6
+    rostered = {first_member + i: str(guild_id + 1 + i // roster_size) for i in range(min(teams * roster_size, members))}
+
+    rss_before = rss_kb()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    guild = discord.Guild(data=guild_payload(guild_id, teams, members), state=state)
+    state._add_guild(guild)
+    chunks = 0
+    member_cache = MemberCache(pinned=lambda user_id: user_id in rostered)
+
+    if mode == 'all':
+        # What discord.py does with each GUILD_MEMBERS_CHUNK before on_ready
+        for offset in range(0, members, CHUNK_SIZE):
+            chunks += 1
+            for user_id in range(first_member + offset, first_member + min(offset + CHUNK_SIZE, members)):
+                team_role = rostered.get(user_id)
+                member = discord.Member(data=member_payload(user_id, [team_role] if team_role else []), guild=guild, state=state)
+                member._presence_update(presence_payload(user_id), {'id': str(user_id)})
+                guild._add_member(member)
+        connected = time.perf_counter() - start
+    else:
+        connected = time.perf_counter() - start
+        # First lookups of the rostered players, QUERY_SIZE per gateway query
+        for user_id, team_role in rostered.items():
+            member = discord.Member(data=member_payload(user_id, [team_role]), guild=guild, state=state)
+            member_cache.put(guild.id, user_id, member)
+
+    warm = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'mode': mode,
+        'members': members,
+        'connect_ms': round(connected * 1000, 1),
+        'warm_ms': round(warm * 1000, 1),
+        'chunks': chunks,
+        'member_queries': -(-len(rostered) // QUERY_SIZE) if mode == 'lean' else 0,
+        'cached_members': len(guild._members) + len(member_cache),
+        'alloc_kb': round(current / 1024, 1),
+        'rss_delta_kb': rss_kb() - rss_before,
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Startup time and memory, all intents vs lean mode')
+    parser.add_argument('--members', default='10000,50000', help='comma separated guild sizes')
+    parser.add_argument('--teams', type=int, default=50)
+    parser.add_argument('--roster-size', type=int, default=10)
+    parser.add_argument('--mode', choices=('all', 'lean'), help='run one mode in this process and print JSON')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.teams, int(args.members), args.roster_size)))
+        return 0
+
+    results = []
+    for members in args.members.split(','):
+        for mode in ('all', 'lean'):
+            out = subprocess.run([sys.executable, '-m', 'bench.startup', '--mode', mode, '--members', members,
+                                  '--teams', str(args.teams), '--roster-size', str(args.roster_size)],
+                                 check=True, capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+            result = json.loads(out)
+            results.append(result)
+            print(f'{result["members"]:>8} {mode:<5} connect {result["connect_ms"]:>9.1f}ms ({result["chunks"]:>3} chunks)  '
+                  f'warm {result["warm_ms"]:>9.1f}ms  cached {result["cached_members"]:>7}  '
+                  f'alloc {result["alloc_kb"]:>10.1f}KiB  rss +{result["rss_delta_kb"]:>7}KiB  maxrss {result["maxrss_kb"]}KiB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'teams': args.teams, 'roster_size': args.roster_size, 'results': results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import csv
+import io
+import json
+import re
+
+# Bulk import/export of league data.
+#
+# Both CSV and JSON use the same flat records, one per player:
+#
+#   team,player,stars,rostercap,captain
+#   Sharks,123456789012345678,3,12,yes
+#   Sharks,234567890123456789,1,,
+#   Jets,,,10,
+#   ,345678901234567890,2,,
+#
+# `player` is a member ID or mention; a row without one only sets team
+# fields. A row without a team makes the player a free agent. `rostercap`
+# may be given on any row of a team and `captain` marks the row's player as
+# that team's captain. Blank stars keep the player's current stars. JSON is a
+# list of objects with the same keys.
+
+FIELDS = ('team', 'player', 'stars', 'rostercap', 'captain')
+MAX_IMPORT_BYTES = 5 * 1024 * 1024
+MAX_VALUE = 2 ** 63 - 1  # IDs, stars and caps are stored as signed 64-bit integers
+
+_mention = re.compile(r'^<@!?(\d+)>$')
+
+
+class ImportErrors(Exception):
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} errors')
+        self.errors = errors
+
+
+def parse_rows(filename, data):
+    # Returns a list of (row_number, record) with every value as a string.
+    # A file that can't be read at all is reported as row 0.
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError as e:
+        raise ImportErrors([(0, f'not UTF-8 text: {e.reason} at byte {e.start}')])
+    if filename.lower().endswith('.json'):
+        try:
+            records = json.loads(text)
+        except ValueError as e:
+            raise ImportErrors([(0, f'invalid JSON: {e}')])
+        if isinstance(records, dict):
+            records = records.get('rows', [])
+        if not isinstance(records, list):
+            raise ImportErrors([(0, 'expected a list of rows')])
+        errors = [(number, 'row is not an object') for number, record in enumerate(records, start=1) if not isinstance(record, dict)]
+        if errors:
+            raise ImportErrors(errors)
+        return [(number, {key: '' if record.get(key) is None else str(record.get(key)) for key in FIELDS})
+                for number, record in enumerate(records, start=1)]
+
+    reader = csv.DictReader(io.StringIO(text))
+    try:
+        missing = set(FIELDS[:2]) - set(reader.fieldnames or ())
+        if missing:
+            raise ImportErrors([(1, f'missing column(s): {", ".join(sorted(missing))}')])
+        # Row 1 is the header
+        return [(number, {key: (record.get(key) or '').strip() for key in FIELDS})
+                for number, record in enumerate(reader, start=2)]
+    except csv.Error as e:
+        raise ImportErrors([(reader.line_num, f'invalid CSV: {e}')])
+
+
+def _parse_player(value):
+    match = _mention.match(value)
+    if match:
+        value = match.group(1)
+    player_id = int(value)
+    if not 0 < player_id <= MAX_VALUE:
+        raise ValueError
+    return player_id
+
+
+def _parse_count(value):
+    # Stars or a roster cap: a whole number from 0 to MAX_VALUE
+    count = int(value)
+    if not 0 <= count <= MAX_VALUE:
+        raise ValueError
+    return count
+
+
+def _parse_flag(value):
+    return value.strip().lower() in ('1', 'y', 'yes', 'true', 'x')
+
+
+def plan_import(league, rows):
+    # Validate the whole batch against the current league and work out what
+    # to change. Raises ImportErrors listing every problem found; nothing has
+    # been touched at that point.
+    errors = []
+    create_teams = []
+    caps = {}
+    moves = {}
+    captains = {}
+
+    for number, record in rows:
+        team_name = record['team'] or None
+        if team_name is not None and not league.has_team(team_name) and team_name not in create_teams:
+            create_teams.append(team_name)
+
+        if record['rostercap']:
+            try:
+                cap = _parse_count(record['rostercap'])
+            except ValueError:
+                errors.append((number, f'invalid rostercap {record["rostercap"]!r}'))
+            else:
+                if team_name is None:
+                    errors.append((number, 'rostercap given without a team'))
+                elif caps.get(team_name, cap) != cap:
+                    errors.append((number, f'conflicting rostercap for {team_name}'))
+                else:
+                    caps[team_name] = cap
+
+        if not record['player']:
+            if record['captain'] and _parse_flag(record['captain']):
+                errors.append((number, 'captain flag without a player'))
+            continue
+
+        try:
+            player_id = _parse_player(record['player'])
+        except ValueError:
+            errors.append((number, f'invalid player {record["player"]!r}'))
+            continue
+        if player_id in moves:
+            errors.append((number, f'player {player_id} appears more than once'))
+            continue
+
+        stars = league.stars_of(player_id)
+        if record['stars']:
+            try:
+                stars = _parse_count(record['stars'])
+            except ValueError:
+                errors.append((number, f'invalid stars {record["stars"]!r}'))
+                continue
+        moves[player_id] = (team_name, stars)
+
+        if record['captain'] and _parse_flag(record['captain']):
+            if team_name is None:
+                errors.append((number, 'captain flag on a free agent'))
+            elif team_name in captains:
+                errors.append((number, f'more than one captain for {team_name}'))
+            else:
+                captains[team_name] = player_id
+
+    # Post-import star totals for every team the batch touches, starting from
+    # the running totals and applying each move's delta
+    totals = {}
+
+    def total(team_name):
+        if team_name not in totals:
+            totals[team_name] = league.totals.total(team_name) if league.has_team(team_name) else 0
+        return totals[team_name]
+
+    for player_id, (team_name, stars) in moves.items():
+        old_team = league.team_of(player_id)
+        if league.on_roster(old_team, player_id):
+            totals[old_team] = total(old_team) - league.stars_of(player_id)
+        if team_name is not None:
+            totals[team_name] = total(team_name) + stars
+
+    for team_name in totals.keys() | caps.keys():
+        cap = caps.get(team_name, league.totals.cap(team_name))
+        if total(team_name) > cap:
+            errors.append((0, f'{team_name} would have {total(team_name)} stars, over its roster cap of {cap}'))
+
+    if errors:
+        raise ImportErrors(errors)
+    return {'create_teams': create_teams, 'caps': caps, 'moves': moves, 'captains': captains}
+
+
+def apply_import(league, plan):
+    # Synchronous on purpose: no await means no other command can observe a
+    # half-applied batch, and all resulting writes land in one storage flush
+    for team_name in plan['create_teams']:
+        league.create_team(team_name)
+    for team_name, cap in plan['caps'].items():
+        league.set_cap(team_name, cap)
+    for player_id, (team_name, stars) in plan['moves'].items():
+        league.register_player(player_id)
+        # Leave the old roster before the stars change so both totals are right
+        if league.team_of(player_id) != team_name:
+            league.assign(player_id, team_name, source='import')
+        if league.stars_of(player_id) != stars:
+            league.set_stars(player_id, stars)
+    for team_name, player_id in plan['captains'].items():
+        league.set_captain(team_name, player_id)
+    return {
+        'teams_created': len(plan['create_teams']),
+        'caps_set': len(plan['caps']),
+        'players': len(plan['moves']),
+        'captains_set': len(plan['captains']),
+    }
+
+
+def export_records(league):
+    # One record per rostered player, then team-only rows for empty teams,
+    # then free agents with stars; captain and cap go on the team's first row
+    for team_name, team_data in league.teams.items():
+        cap = team_data.get('rostercap', '')
+        captain = team_data.get('captain')
+        first = True
+        for player_id in team_data['players']:
+            yield {
+                'team': team_name,
+                'player': player_id,
+                'stars': league.stars_of(player_id),
+                'rostercap': cap if first else '',
+                'captain': 'yes' if player_id == captain else '',
+            }
+            first = False
+        if first:
+            yield {'team': team_name, 'player': '', 'stars': '', 'rostercap': cap, 'captain': ''}
+
+    for player_id, team_name, stars in league.players.rows(bare=False):
+        if team_name is None and stars:
+            yield {'team': '', 'player': player_id, 'stars': stars, 'rostercap': '', 'captain': ''}
+
+
+def write_export(league, fp, fmt='csv'):
+    # Streams records into a binary file object one row at a time
+    out = io.TextIOWrapper(fp, encoding='utf-8', newline='', write_through=True)
+    try:
+        if fmt == 'json':
+            out.write('[')
+            for i, record in enumerate(export_records(league)):
+                out.write((',\n' if i else '\n') + json.dumps(record))
+            out.write('\n]\n')
+        else:
+            writer = csv.DictWriter(out, fieldnames=FIELDS)
+            writer.writeheader()
+            for record in export_records(league):
+                writer.writerow(record)
+        out.flush()
+    finally:
+        # Hand the underlying file back to the caller open
+        out.detach()
+    fp.seek(0)
+
+
+def write_errors(errors, fp):
+    out = io.TextIOWrapper(fp, encoding='utf-8', newline='', write_through=True)
+    try:
+        writer = csv.writer(out)
+        writer.writerow(('row', 'error'))
+        writer.writerows(errors)
+        out.flush()
+    finally:
+        out.detach()
+    fp.seek(0)
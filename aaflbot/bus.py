@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import json
+import os
+
+from metrics import get_logger
+
+log = get_logger('aaflbot.bus')
+
+# A worker this far behind on reading is dropped rather than buffered for
+MAX_BUFFER = 1 << 20
+
+
+class BusServer:
+    # Relays notifications between the worker processes of one deployment
+    # (see launcher.py).
+    #
+    # Every worker keeps one connection to a Unix socket and writes one JSON
+    # object per line; each line is passed on as is to every other worker.
+    # Nothing is queued or replayed: a worker that is down misses what is
+    # sent meanwhile and starts from the shared database anyway.
+
+    def __init__(self, path):
+        self.path = path
+        self.relayed = 0
+        self._writers = set()
+        self._tasks = set()
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def _serve(self, reader, writer):
+        self._writers.add(writer)
+        self._tasks.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for other in list(self._writers):
+                    if other is writer:
+                        continue
+                    if other.transport.get_write_buffer_size() > MAX_BUFFER:
+                        log.warning('bus_client_dropped', buffered=other.transport.get_write_buffer_size())
+                        self._writers.discard(other)
+                        other.close()
+                        continue
+                    other.write(line)
+                self.relayed += 1
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._tasks.discard(asyncio.current_task())
+            writer.close()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            self._writers.clear()
+            # The connections see EOF and their handlers finish
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Bus:
+    # One worker's connection to the BusServer.
+    #
+    # publish(kind, **fields) is fire and forget. Coroutines registered with
+    # on(kind) are run, each as its own task, with the fields of every
+    # notification of that kind from the other workers. Without a path (a
+    # single process) there is nobody to tell and publish() does nothing.
+    # A lost connection is retried every `retry_delay` seconds.
+
+    def __init__(self, path=None, name=None, retry_delay=1.0):
+        self.path = path
+        self.name = name
+        self.retry_delay = retry_delay
+        self.handlers = collections.defaultdict(list)
+        self.sent = 0
+        self.received = 0
+        self._writer = None
+        self._task = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    def on(self, kind, handler):
+        # handler(fields) is a coroutine
+        self.handlers[kind].append(handler)
+
+    def publish(self, kind, **fields):
+        if self._writer is None:
+            return False
+        message = {'kind': kind, 'from': self.name, **fields}
+        self._writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+        self.sent += 1
+        return True
+
+    def start(self):
+        if self.path and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                log.warning('bus_connect_failed', path=self.path, error=str(e))
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            self._writer = writer
+            log.info('bus_connected', path=self.path, name=self.name)
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._dispatch(line)
+            except ConnectionError:
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+            log.warning('bus_disconnected', path=self.path)
+            await asyncio.sleep(self.retry_delay)
+
+    def _dispatch(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            log.warning('bus_bad_message', line=line[:200])
+            return
+        self.received += 1
+        fields = {key: value for key, value in message.items() if key not in ('kind', 'from')}
+        for handler in self.handlers.get(message.get('kind'), ()):
+            # A handler can take a while (e.g. a trade vote), so it must not
+            # hold up the messages behind it
+            asyncio.create_task(self._call(handler, message, fields))
+
+    async def _call(self, handler, message, fields):
+        try:
+            await handler(fields)
+        except Exception:
+            log.exception('bus_handler_failed', kind=message.get('kind'), sender=message.get('from'))
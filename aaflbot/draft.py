@@ -0,0 +1,176 @@
+import time
+
+DEFAULT_PICK_SECONDS = 3600
+MAX_QUEUE = 50  # Most players a team may line up ahead of its turn
+RESUME_GRACE = 300  # A clock that ran out while the bot was down gets this long again
+
+
+class DraftError(Exception):
+    pass
+
+
+class Draft:
+    # A season draft over a league's teams.
+    #
+    # Picks go round by round through `order`, reversed every other round in
+    # a snake draft. The team on the clock has `pick_seconds` to pick; the
+    # caller runs the clock (one TimerHeap for every league's draft, keyed
+    # by guild, with `deadline` as the due time) and calls expire() when it
+    # runs out. Teams can queue a ranked list of players ahead of their
+    # turn: the moment a team with a usable queued player comes on the
+    # clock, the pick is made without waiting, so queued teams cost no
+    # clock time at all. A pick must be a free agent the team's star cap
+    # can take, which is one CapCheck from the running totals. Without a
+    # usable queued player an expired clock skips the team's pick.
+    #
+    # state() is a plain dict the league keeps in its settings, so a draft
+    # survives a restart (see restore()).
+
+    def __init__(self, league, order, rounds, snake=True, pick_seconds=DEFAULT_PICK_SECONDS, channel_id=None):
+        if not order:
+            raise DraftError('A draft needs at least one team.')
+        if len(set(order)) != len(order):
+            raise DraftError('A team is in the draft order more than once.')
+        if rounds < 1:
+            raise DraftError('A draft needs at least one round.')
+        self.league = league
+        self.order = list(order)
+        self.rounds = rounds
+        self.snake = snake
+        self.pick_seconds = pick_seconds
+        self.channel_id = channel_id
+        self.picks = []  # (team_name, player_id or None for a skipped pick), in pick order
+        self.queues = {}
+        self.announced = 0  # Rounds announced so far
+        self.deadline = time.time() + pick_seconds
+
+    @classmethod
+    def restore(cls, league, state):
+        draft = cls(league, state['order'], state['rounds'], state['snake'], state['pick_seconds'], state.get('channel_id'))
+        draft.picks = [tuple(pick) for pick in state['picks']]
+        draft.queues = {team_name: list(player_ids) for team_name, player_ids in state['queues'].items()}
+        draft.announced = state['announced']
+        draft.deadline = state['deadline'] if state['deadline'] > time.time() else time.time() + RESUME_GRACE
+        return draft
+
+    def state(self):
+        return {'order': self.order, 'rounds': self.rounds, 'snake': self.snake, 'pick_seconds': self.pick_seconds,
+                'channel_id': self.channel_id, 'picks': [list(pick) for pick in self.picks], 'queues': self.queues,
+                'announced': self.announced, 'deadline': self.deadline}
+
+    # Order
+
+    @property
+    def total_picks(self):
+        return len(self.order) * self.rounds
+
+    @property
+    def finished(self):
+        return len(self.picks) >= self.total_picks
+
+    def team_at(self, pick_number):
+        # The team making pick pick_number (counted from 0)
+        round_index, slot = divmod(pick_number, len(self.order))
+        if self.snake and round_index % 2:
+            slot = len(self.order) - 1 - slot
+        return self.order[slot]
+
+    def on_the_clock(self):
+        return None if self.finished else self.team_at(len(self.picks))
+
+    @property
+    def round(self):
+        # The round being picked, from 1
+        return min(len(self.picks) // len(self.order), self.rounds - 1) + 1
+
+    def round_picks(self, round_number):
+        start = (round_number - 1) * len(self.order)
+        return [(start + i + 1, team_name, player_id) for i, (team_name, player_id) in enumerate(self.picks[start:start + len(self.order)])]
+
+    def rounds_to_announce(self):
+        # Rounds completed since the last call, each announced once
+        completed = len(self.picks) // len(self.order)
+        rounds = list(range(self.announced + 1, completed + 1))
+        self.announced = completed
+        return rounds
+
+    # Picks
+
+    def problem(self, team_name, player_id):
+        # Why team_name can't draft player_id right now, or None
+        league = self.league
+        if not league.has_team(team_name):
+            return f'Team {team_name} does not exist anymore.'
+        if player_id not in league.players:
+            return f'<@{player_id}> is not a registered player.'
+        if league.team_of(player_id) is not None:
+            return f'<@{player_id}> is already on {league.team_of(player_id)}.'
+        check = league.check_caps([(player_id, None, team_name)])
+        if not check.ok:
+            return f'Drafting <@{player_id}> would put {check.describe()}.'
+        return None
+
+    def _record(self, team_name, player_id):
+        if player_id is not None:
+            self.league.assign(player_id, team_name, source='draft')
+        self.picks.append((team_name, player_id))
+        self.deadline = time.time() + self.pick_seconds
+
+    def pick(self, team_name, player_id):
+        # The team on the clock drafts player_id; then any queued picks that
+        # follow are made. Returns every pick made, as (team, player_id).
+        if self.finished:
+            raise DraftError('The draft is over.')
+        if team_name != self.on_the_clock():
+            raise DraftError(f'{self.on_the_clock()} is on the clock, not {team_name}.')
+        problem = self.problem(team_name, player_id)
+        if problem is not None:
+            raise DraftError(problem)
+        self._record(team_name, player_id)
+        return [(team_name, player_id)] + self.run_queued()
+
+    def expire(self):
+        # The clock ran out: the team's best usable queued player, if any,
+        # else the pick is skipped
+        if self.finished:
+            return []
+        team_name = self.on_the_clock()
+        player_id = self._next_queued(team_name)
+        self._record(team_name, player_id)
+        return [(team_name, player_id)] + self.run_queued()
+
+    def queue(self, team_name, player_ids):
+        # Replace the team's ranked list of players to draft
+        if len(player_ids) > MAX_QUEUE:
+            raise DraftError(f'A queue holds at most {MAX_QUEUE} players.')
+        self.queues[team_name] = list(dict.fromkeys(player_ids))
+        if not self.queues[team_name]:
+            del self.queues[team_name]
+
+    def _next_queued(self, team_name):
+        # Pops queued players until one can be drafted; players taken by
+        # other teams in the meantime are dropped on the way
+        queue = self.queues.get(team_name, [])
+        player_id = None
+        while queue and player_id is None:
+            player_id = queue.pop(0)
+            if self.problem(team_name, player_id) is not None:
+                player_id = None
+        if not queue:
+            self.queues.pop(team_name, None)
+        return player_id
+
+    def run_queued(self):
+        # Make every pick that is already queued, in order, until a team
+        # without a usable queued player is on the clock
+        picks = []
+        while not self.finished:
+            team_name = self.on_the_clock()
+            if not self.queues.get(team_name):
+                break
+            player_id = self._next_queued(team_name)
+            if player_id is None:
+                break
+            self._record(team_name, player_id)
+            picks.append((team_name, player_id))
+        return picks
@@ -0,0 +1,269 @@
+import array
+import asyncio
+import bisect
+import datetime
+import io
+import json
+import os
+import time
+
+from metrics import get_logger
+
+log = get_logger('aaflbot.events')
+
+REPAIR_BLOCK = 65536  # Bytes read at a time when looking for the last line
+
+
+def parse_time(text):
+    # Unix seconds or an ISO 8601 date/time; times without a zone are UTC
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    when = datetime.datetime.fromisoformat(text)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when.timestamp()
+
+
+def describe(event):
+    # One line for /history
+    kind = event['kind']
+    if kind == 'assign':
+        source = f" ({event['source']})" if event.get('source') else ''
+        if event['to_team'] is None:
+            return f"released by {event['from_team']}{source}"
+        if event['from_team'] is None:
+            return f"joined {event['to_team']}{source}"
+        return f"moved from {event['from_team']} to {event['to_team']}{source}"
+    if kind == 'remove_player':
+        return f"removed from the league (was on {event['team']})" if event['team'] else 'removed from the league'
+    if kind == 'set_stars':
+        return f"stars changed from {event['old']} to {event['stars']}"
+    if kind == 'set_captain':
+        return f"made captain of {event['team']}"
+    return kind
+
+
+class EventLog:
+    # Append-only history of league mutations, one JSON object per line:
+    #
+    #   {"seq":12,"ts":1700000000.5,"kind":"assign","player":1,"from_team":null,"to_team":"Sharks","source":"sign"}
+    #
+    # Appends only buffer the line; flush() writes the buffer and fsyncs once
+    # per batch. Every `checkpoint_every` events a "checkpoint" line records
+    # all rosters, so an as-of query starts from the last checkpoint before
+    # its timestamp and replays only that team's events after it.
+    #
+    # In memory the log keeps byte offsets only: per player, per team and
+    # per checkpoint. Queries seek straight to the lines they need. The index
+    # for an existing file is built by one scan in a thread (start()), while
+    # new events are indexed as they are appended.
+
+    def __init__(self, path, rosters, checkpoint_every=1000):
+        # rosters() -> {team_name: [player_id, ...]} of the live league
+        self.path = path
+        self.rosters = rosters
+        self.checkpoint_every = checkpoint_every
+        self.seq = 0
+        self.by_player = {}
+        self.by_team = {}
+        self.checkpoint_times = array.array('d')
+        self.checkpoint_offsets = array.array('q')
+        self._since_checkpoint = 0
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+        self._ready = asyncio.Event()
+
+        if path is None or path == ':memory:':
+            self._fp = io.BytesIO()
+            self._scan_end = 0
+        else:
+            self._fp = open(path, 'ab+')
+            self._scan_end = self._repair()
+        self._end = self._scan_end
+        if not self._scan_end:
+            self._ready.set()
+
+    def _line_start(self, end):
+        # Offset just past the last newline before `end` (0 if there is
+        # none), reading backwards a block at a time: a checkpoint line
+        # holds every roster and can be far longer than one block
+        position = end
+        while position > 0:
+            start = max(position - REPAIR_BLOCK, 0)
+            self._fp.seek(start)
+            newline = self._fp.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+        return 0
+
+    def _repair(self):
+        # Drop a torn last line left by a crash mid-write and pick up the
+        # sequence number where the log left off
+        self._fp.seek(0, os.SEEK_END)
+        size = self._fp.tell()
+        if not size:
+            return 0
+        keep = self._line_start(size)
+        if keep != size:
+            log.warning('event_log_truncated', path=self.path, dropped=size - keep)
+            self._fp.truncate(keep)
+        if keep:
+            start = self._line_start(keep - 1)
+            self._fp.seek(start)
+            self.seq = json.loads(self._fp.read(keep - start))['seq']
+        return keep
+
+    # Indexing
+
+    @staticmethod
+    def _add(index, key, offset):
+        offsets = index.get(key)
+        if offsets is None:
+            offsets = index[key] = array.array('q')
+        offsets.append(offset)
+
+    def _index(self, event, offset, by_player, by_team, checkpoints):
+        kind = event['kind']
+        if kind == 'checkpoint':
+            checkpoints.append((event['ts'], offset))
+            return
+        if event.get('player') is not None:
+            self._add(by_player, event['player'], offset)
+        for key in ('team', 'from_team', 'to_team'):
+            if event.get(key) is not None:
+                self._add(by_team, event[key], offset)
+
+    def _scan(self):
+        # Index [0, _scan_end) of an existing file; runs in a thread
+        by_player = {}
+        by_team = {}
+        checkpoints = []
+        since_checkpoint = 0
+        with open(self.path, 'rb') as fp:
+            offset = 0
+            for line in fp:
+                if offset >= self._scan_end:
+                    break
+                event = json.loads(line)
+                self._index(event, offset, by_player, by_team, checkpoints)
+                since_checkpoint = 0 if event['kind'] == 'checkpoint' else since_checkpoint + 1
+                offset += len(line)
+        return by_player, by_team, checkpoints, since_checkpoint
+
+    async def start(self):
+        # Index the existing log; events appended meanwhile are already
+        # indexed and go after the scanned ones
+        if self._ready.is_set():
+            return
+        started = time.perf_counter()
+        by_player, by_team, checkpoints, since_checkpoint = await asyncio.to_thread(self._scan)
+        if not self.checkpoint_offsets:
+            # No checkpoint since startup, so the scanned tail still counts
+            self._since_checkpoint += since_checkpoint
+        for index, scanned in ((self.by_player, by_player), (self.by_team, by_team)):
+            for key, offsets in index.items():
+                scanned.setdefault(key, array.array('q')).extend(offsets)
+            index.clear()
+            index.update(scanned)
+        self.checkpoint_times = array.array('d', [ts for ts, _ in checkpoints] + list(self.checkpoint_times))
+        self.checkpoint_offsets = array.array('q', [offset for _, offset in checkpoints] + list(self.checkpoint_offsets))
+        self._ready.set()
+        log.info('event_log_indexed', seq=self.seq, players=len(self.by_player), teams=len(self.by_team),
+                 seconds=round(time.perf_counter() - started, 3))
+
+    # Writing
+
+    def _append(self, event):
+        line = json.dumps(event, separators=(',', ':')).encode() + b'\n'
+        offset = self._end
+        self._buffer.append(line)
+        self._end += len(line)
+        return offset
+
+    def append(self, kind, fields):
+        # League hook
+        self.seq += 1
+        event = {'seq': self.seq, 'ts': time.time(), 'kind': kind, **fields}
+        offset = self._append(event)
+        self._index(event, offset, self.by_player, self.by_team, [])
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.seq += 1
+        event = {'seq': self.seq, 'ts': time.time(), 'kind': 'checkpoint', 'rosters': self.rosters()}
+        offset = self._append(event)
+        self.checkpoint_times.append(event['ts'])
+        self.checkpoint_offsets.append(offset)
+        self._since_checkpoint = 0
+
+    def _write(self, data):
+        self._fp.seek(0, os.SEEK_END)
+        self._fp.write(data)
+        self._fp.flush()
+        if not isinstance(self._fp, io.BytesIO):
+            os.fsync(self._fp.fileno())
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            data = b''.join(self._buffer)
+            self._buffer = []
+            await asyncio.to_thread(self._write, data)
+
+    def close(self):
+        self._fp.close()
+
+    # Reading
+
+    def _read(self, offsets):
+        if isinstance(self._fp, io.BytesIO):
+            data = self._fp.getvalue()
+            return [json.loads(data[offset:data.index(b'\n', offset)]) for offset in offsets]
+        with open(self.path, 'rb') as fp:
+            events = []
+            for offset in offsets:
+                fp.seek(offset)
+                events.append(json.loads(fp.readline()))
+            return events
+
+    async def read(self, offsets):
+        await self._ready.wait()
+        await self.flush()
+        return await asyncio.to_thread(self._read, offsets)
+
+    async def history(self, player_id, limit=20):
+        # The player's latest events, oldest first, plus how many there are
+        await self._ready.wait()
+        offsets = self.by_player.get(player_id, ())
+        return await self.read(offsets[-limit:]), len(offsets)
+
+    async def roster_at(self, team_name, when):
+        # Player IDs on team_name at time `when`, or None if the log has no
+        # checkpoint that early
+        await self._ready.wait()
+        i = bisect.bisect_right(self.checkpoint_times, when) - 1
+        if i < 0:
+            return None
+        start = self.checkpoint_offsets[i]
+        checkpoint, = await self.read([start])
+        roster = dict.fromkeys(checkpoint['rosters'].get(team_name, ()))
+
+        offsets = self.by_team.get(team_name, array.array('q'))
+        tail = offsets[bisect.bisect_right(offsets, start):]
+        for event in await self.read(tail):
+            if event['ts'] > when:
+                break
+            if event['kind'] == 'assign':
+                if event['from_team'] == team_name:
+                    roster.pop(event['player'], None)
+                if event['to_team'] == team_name:
+                    roster[event['player']] = None
+            elif event['kind'] == 'remove_player' and event['team'] == team_name:
+                roster.pop(event['player'], None)
+        return list(roster)
@@ -0,0 +1,144 @@
+import asyncio
+import os
+
+from events import EventLog
+from league import DEFAULT_ROSTER_CAP, League
+from names import NameIndex
+from trades import TradeEngine
+
+DEFAULT_CAPTAIN_ROLE = 'Franchise Owner'
+
+
+def guild_path(path, guild_id):
+    # aaflbot.events -> aaflbot.<guild_id>.events; in-memory stays in memory
+    if path is None or path == ':memory:':
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.{guild_id}{ext}'
+
+
+class GuildLeague:
+    # One guild's league and everything kept per league: its storage
+    # partition and event log, the trade locks, the name indexes, the team
+    # role sync, any member list resync and any draft, plus the league's
+    # settings (the default roster cap, the name of the captain role and the
+    # state of a running draft).
+
+    def __init__(self, guild_id, storage, event_log_path):
+        self.guild_id = guild_id
+        self.settings = {}
+        self.league = League()
+        self.storage = storage
+        self.event_log = EventLog(event_log_path, rosters=lambda: {team_name: list(team_data['players'])
+                                                                   for team_name, team_data in self.league.teams.items()})
+        self.trade_engine = TradeEngine(self.league)
+        self.team_names = NameIndex()
+        self.player_names = NameIndex()
+        self.role_sync = None
+        self.resync = None
+        self.draft = None
+        self._index_task = None
+
+        self.league.on_change(team=storage.save_team, player=storage.save_player, event=self.event_log.append)
+        self.league.on_change(team=self._index_team_name)
+
+    @property
+    def roster_cap(self):
+        return self.settings.get('rostercap', DEFAULT_ROSTER_CAP)
+
+    @property
+    def captain_role(self):
+        return self.settings.get('captain_role', DEFAULT_CAPTAIN_ROLE)
+
+    def configure(self, **settings):
+        # rostercap= (the default cap for teams without their own),
+        # captain_role= and/or draft= (Draft.state(), None when there is none)
+        self.settings.update(settings)
+        self.storage.save_settings()
+        if 'rostercap' in settings:
+            self.league.set_default_cap(self.roster_cap)
+
+    def find_team(self, team_name):
+        # The team called team_name, ignoring case and spacing if that is
+        # unambiguous, else None
+        if self.league.has_team(team_name):
+            return team_name
+        return self.team_names.exact(team_name)
+
+    def _index_team_name(self, team_name):
+        if self.league.has_team(team_name):
+            self.team_names.add(team_name, team_name)
+
+    def load(self):
+        self.storage.load(self.league.teams, self.league.players)
+        self.storage.load_settings(self.settings)
+        self.league.default_cap = self.roster_cap
+        self.league.reindex()
+        for team_name in self.league.teams:
+            self.team_names.add(team_name, team_name)
+        # A new log starts from the league as loaded
+        if not self.event_log.seq:
+            self.event_log.checkpoint()
+
+    def start(self):
+        # Index an existing event log and start the role sync; needs the
+        # running event loop
+        if self._index_task is None:
+            self._index_task = asyncio.create_task(self.event_log.start())
+        if self.role_sync is not None:
+            self.role_sync.start()
+
+    async def flush(self):
+        try:
+            await self.storage.flush()
+        finally:
+            await self.event_log.flush()
+
+    async def close(self):
+        if self._index_task is not None:
+            self._index_task.cancel()
+        if self.role_sync is not None:
+            self.role_sync.stop()
+        if self.resync is not None:
+            self.resync.cancel()
+        await self.flush()
+        self.storage.close()
+        self.event_log.close()
+
+
+class Leagues:
+    # Guild ID -> GuildLeague. A guild's league is opened (loaded from its
+    # partition) the first time anything asks for it, so only guilds that
+    # use the bot cost memory and background work.
+
+    def __init__(self, open_league):
+        # open_league(guild_id) -> a loaded GuildLeague
+        self.open_league = open_league
+        self.by_guild = {}
+
+    def __len__(self):
+        return len(self.by_guild)
+
+    def __iter__(self):
+        return iter(list(self.by_guild.values()))
+
+    def get(self, guild_id):
+        state = self.by_guild.get(guild_id)
+        if state is None:
+            state = self.by_guild[guild_id] = self.open_league(guild_id)
+        return state
+
+    def peek(self, guild_id):
+        # Only a league that is already open
+        return self.by_guild.get(guild_id)
+
+    async def drop(self, guild_id):
+        # Close a league; the next get() loads it again
+        state = self.by_guild.pop(guild_id, None)
+        if state is not None:
+            await state.close()
+
+    async def close(self):
+        for state in self:
+            await state.close()
+        self.by_guild.clear()
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bus import BusServer
+from metrics import get_logger, setup_logging
+
+log = get_logger('aaflbot.launcher')
+
+# Runs the bot as several worker processes under one supervisor.
+#
+#   python launcher.py --workers 4 [--shards 16]
+#
+# The shards (Discord's recommended count unless given) are split into
+# contiguous ranges, one per worker running aaflbot.py with
+# AAFLBOT_SHARD_IDS and AAFLBOT_SHARD_COUNT set, so each worker connects
+# only its shards and owns the guilds on them. Workers share the SQLite
+# database (AAFLBOT_DB), in which every guild's league is its own partition
+# written only by the guild's worker, and pass notifications through a
+# BusServer on a Unix socket (AAFLBOT_BUS). A worker that exits is started
+# again after a backoff that doubles up to MAX_BACKOFF and resets once it
+# has stayed up for STABLE_SECONDS. With AAFLBOT_API_PORT set, worker i
+# serves the JSON API (api.py) for its leagues on that port + i. SIGTERM
+# or SIGINT stops the workers (they flush on SIGTERM) and then the launcher.
+
+GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+IDENTIFY_SECONDS = 5.0  # Discord allows one identify per 5 seconds per concurrency bucket
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+STABLE_SECONDS = 300.0
+STOP_TIMEOUT = 30.0
+
+
+async def gateway_info(token):
+    # Recommended shard count and how many shards may identify at once
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers={'Authorization': f'Bot {token}'}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data['shards'], data['session_start_limit']['max_concurrency']
+
+
+def split_shards(shard_count, workers):
+    # Contiguous shard ID ranges, as even as possible
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for i in range(workers):
+        stop = start + size + (i < extra)
+        ranges.append(list(range(start, stop)))
+        start = stop
+    return ranges
+
+
+class Supervisor:
+    def __init__(self, script, shard_ranges, shard_count, bus_path, max_concurrency=1):
+        self.script = script
+        self.shard_ranges = shard_ranges
+        self.shard_count = shard_count
+        self.bus_path = bus_path
+        self.max_concurrency = max_concurrency
+        self.processes = {}
+        self.restarts = 0
+        self._stopping = asyncio.Event()
+
+    def _env(self, index, shard_ids):
+        env = dict(os.environ, AAFLBOT_BUS=self.bus_path, AAFLBOT_WORKERS=str(len(self.shard_ranges)))
+        if os.environ.get('AAFLBOT_API_PORT'):
+            # Each worker serves the leagues it owns on a port of its own
+            env['AAFLBOT_API_PORT'] = str(int(os.environ['AAFLBOT_API_PORT']) + index)
+        if shard_ids is not None:
+            env['AAFLBOT_SHARD_IDS'] = ','.join(map(str, shard_ids))
+            env['AAFLBOT_SHARD_COUNT'] = str(self.shard_count)
+        return env
+
+    async def _supervise(self, index, shard_ids, delay):
+        # Workers start one after another, leaving room for the shards
+        # before them to identify
+        await self._wait(delay)
+        backoff = MIN_BACKOFF
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=self._env(index, shard_ids),
+                                                           cwd=os.path.dirname(os.path.abspath(self.script)))
+            self.processes[index] = process
+            log.info('worker_started', worker=index, pid=process.pid, shards=shard_ids)
+            code = await process.wait()
+            del self.processes[index]
+            if self._stopping.is_set():
+                break
+
+            if time.monotonic() - started >= STABLE_SECONDS:
+                backoff = MIN_BACKOFF
+            log.warning('worker_exited', worker=index, code=code, restart_in=backoff)
+            self.restarts += 1
+            await self._wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    async def _wait(self, seconds):
+        # Sleep, but wake up for a stop
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        delays = []
+        shards_before = 0
+        for shard_ids in self.shard_ranges:
+            delays.append(shards_before / self.max_concurrency * IDENTIFY_SECONDS)
+            shards_before += len(shard_ids) if shard_ids is not None else 0
+        await asyncio.gather(*(self._supervise(index, shard_ids, delay)
+                               for index, (shard_ids, delay) in enumerate(zip(self.shard_ranges, delays))))
+
+    async def stop(self):
+        self._stopping.set()
+        for process in list(self.processes.values()):
+            if process.returncode is None:
+                process.terminate()
+        waits = [process.wait() for process in self.processes.values()]
+        try:
+            await asyncio.wait_for(asyncio.gather(*waits), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for process in list(self.processes.values()):
+                if process.returncode is None:
+                    log.warning('worker_killed', pid=process.pid)
+                    process.kill()
+
+
+async def launch(args):
+    if args.workers > 1 or args.shards:
+        if args.shards:
+            shard_count, max_concurrency = args.shards, args.max_concurrency
+        else:
+            shard_count, max_concurrency = await gateway_info(os.environ['DISCORD_TOKEN'])
+        shard_ranges = split_shards(shard_count, args.workers)
+    else:
+        # One worker lets discord.py pick the shards itself
+        shard_count, max_concurrency, shard_ranges = None, 1, [None]
+
+    bus_path = os.environ.get('AAFLBOT_BUS') or os.path.join(tempfile.gettempdir(), f'aaflbot-{os.getpid()}.sock')
+    server = BusServer(bus_path)
+    await server.start()
+    supervisor = Supervisor(args.script, shard_ranges, shard_count, bus_path, max_concurrency)
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, lambda: asyncio.create_task(supervisor.stop()))
+
+    log.info('launching', workers=len(shard_ranges), shards=shard_count, bus=bus_path)
+    try:
+        await supervisor.run()
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run aaflbot as supervised shard worker processes')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('AAFLBOT_WORKERS', '1')))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('AAFLBOT_SHARD_COUNT', '0')),
+                        help="total shards; by default Discord's recommendation")
+    parser.add_argument('--max-concurrency', type=int, default=1, help='shards that may identify at once (with --shards)')
+    parser.add_argument('--script', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aaflbot.py'))
+    args = parser.parse_args(argv)
+
+    setup_logging(os.environ.get('AAFLBOT_LOG_LEVEL', 'INFO'))
+    asyncio.run(launch(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
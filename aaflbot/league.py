@@ -0,0 +1,383 @@
+from players import PlayerStore
+from rankings import Rankings
+
+DEFAULT_ROSTER_CAP = 10
+
+
+class TeamTotals:
+    # Running per-team aggregates (star total, player count, roster cap).
+    #
+    # Every roster or star change applies its delta here, so reads such as
+    # /teamlist or a cap check never have to re-sum a roster.
+
+    def __init__(self, default_cap=DEFAULT_ROSTER_CAP):
+        self.default_cap = default_cap
+        self.stars = {}
+        self.counts = {}
+        self.caps = {}
+
+    @classmethod
+    def build(cls, teams, players, default_cap=DEFAULT_ROSTER_CAP):
+        # Recompute everything from scratch; used on load and for /checktotals
+        totals = cls(default_cap)
+        for team_name, team_data in teams.items():
+            totals.add_team(team_name, team_data.get('rostercap'))
+            for player_id in team_data['players']:
+                totals.add_player(team_name, players.stars_of(player_id))
+        return totals
+
+    def add_team(self, team_name, cap=None):
+        self.stars.setdefault(team_name, 0)
+        self.counts.setdefault(team_name, 0)
+        self.caps[team_name] = self.default_cap if cap is None else cap
+
+    def remove_team(self, team_name):
+        self.stars.pop(team_name, None)
+        self.counts.pop(team_name, None)
+        self.caps.pop(team_name, None)
+
+    def set_cap(self, team_name, cap):
+        self.caps[team_name] = cap
+
+    def add_player(self, team_name, stars):
+        if team_name is None:
+            return
+        self.stars[team_name] = self.stars.get(team_name, 0) + stars
+        self.counts[team_name] = self.counts.get(team_name, 0) + 1
+
+    def remove_player(self, team_name, stars):
+        if team_name not in self.stars:
+            return
+        self.stars[team_name] -= stars
+        self.counts[team_name] -= 1
+
+    def change_stars(self, team_name, delta):
+        if team_name not in self.stars:
+            return
+        self.stars[team_name] += delta
+
+    def total(self, team_name):
+        return self.stars.get(team_name, 0)
+
+    def count(self, team_name):
+        return self.counts.get(team_name, 0)
+
+    def cap(self, team_name):
+        return self.caps.get(team_name, self.default_cap)
+
+    def headroom(self, team_name):
+        return self.cap(team_name) - self.total(team_name)
+
+    def over_cap(self):
+        # (team, total, cap) for every team over its cap, in one pass
+        return sorted((team_name, total, self.caps.get(team_name, self.default_cap)) for team_name, total in self.stars.items()
+                      if total > self.caps.get(team_name, self.default_cap))
+
+    def diff(self, other):
+        # Return (team, field, ours, theirs) for every value that disagrees
+        mismatches = []
+        for field in ('stars', 'counts', 'caps'):
+            ours = getattr(self, field)
+            theirs = getattr(other, field)
+            for team_name in ours.keys() | theirs.keys():
+                if ours.get(team_name) != theirs.get(team_name):
+                    mismatches.append((team_name, field, ours.get(team_name), theirs.get(team_name)))
+        return sorted(mismatches, key=lambda m: (str(m[0]), m[1]))
+
+
+class CapCheck:
+    # What a batch of proposed changes would do to the star caps.
+    #
+    # moves are (player_id, from_team, to_team) with None for free agency,
+    # so a signing is one move and a trade several; stars maps a player ID
+    # to new stars, which a moved player takes to their new team. The new
+    # total of every affected team is worked out in one pass over the
+    # changes, starting from the running TeamTotals, so the cost doesn't
+    # depend on roster sizes. A team already over its cap may still shed
+    # stars: only a total that is over the cap and went up is a violation.
+
+    def __init__(self, league, moves=(), stars=None):
+        stars = stars or {}
+        self.totals = league.totals
+        self.before = {}
+        self.after = {}
+
+        moved = set()
+        for player_id, from_team, to_team in moves:
+            old_stars = league.stars_of(player_id)
+            self._shift(from_team, -old_stars)
+            self._shift(to_team, stars.get(player_id, old_stars))
+            moved.add(player_id)
+        for player_id, new_stars in stars.items():
+            team_name = league.team_of(player_id)
+            if player_id not in moved and league.on_roster(team_name, player_id):
+                self._shift(team_name, new_stars - league.stars_of(player_id))
+
+        self.over = sorted((team_name, total, self.totals.cap(team_name)) for team_name, total in self.after.items()
+                           if total > self.totals.cap(team_name) and total > self.before[team_name])
+
+    def _shift(self, team_name, delta):
+        if team_name is None:
+            return
+        if team_name not in self.after:
+            self.before[team_name] = self.after[team_name] = self.totals.total(team_name)
+        self.after[team_name] += delta
+
+    @property
+    def ok(self):
+        return not self.over
+
+    def describe(self):
+        return ', '.join(f'{team_name} at {total}/{cap} stars' for team_name, total, cap in self.over)
+
+
+class League:
+    # Owns `teams` and `players` and the indexes over them.
+    #
+    # `players` is a PlayerStore: a mapping like the old dict of dicts, but
+    # free agents with no stars cost only their ID.
+    #
+    # Rosters are dicts used as ordered sets, so membership tests and removals
+    # are O(1) while /roster still lists players in the order they joined.
+    # `captains` maps a captain's ID to their team. All mutations go through
+    # the methods below so the indexes, team totals, rankings and any change
+    # hooks (storage, role sync) stay in step. `version` goes up on every
+    # change so caches can tell when they are stale.
+
+    def __init__(self, default_cap=DEFAULT_ROSTER_CAP):
+        self.default_cap = default_cap
+        self.version = 0
+        self.teams = {}
+        self.players = PlayerStore()
+        self.captains = {}
+        self.totals = TeamTotals(default_cap)
+        self.rankings = Rankings()
+        self._team_hooks = []
+        self._player_hooks = []
+        self._roster_hooks = []
+        self._event_hooks = []
+
+    def on_change(self, team=None, player=None, roster=None, event=None):
+        # Register callbacks taking a team name / player ID after it changes,
+        # or (kind, fields) describing each mutation (free agent
+        # registrations are not reported). roster hooks take a player ID
+        # like player hooks, but skip free agents with no stars and no team
+        # being registered or removed in bulk: nothing about their team
+        # changed, and a resync goes through thousands of them.
+        if team is not None:
+            self._team_hooks.append(team)
+        if player is not None:
+            self._player_hooks.append(player)
+        if roster is not None:
+            self._roster_hooks.append(roster)
+        if event is not None:
+            self._event_hooks.append(event)
+
+    def _team_changed(self, team_name):
+        self.version += 1
+        for hook in self._team_hooks:
+            hook(team_name)
+
+    def _player_changed(self, player_id, roster=True):
+        self.version += 1
+        for hook in self._player_hooks:
+            hook(player_id)
+        if roster:
+            for hook in self._roster_hooks:
+                hook(player_id)
+
+    def _emit(self, kind, **fields):
+        for hook in self._event_hooks:
+            hook(kind, fields)
+
+    def reindex(self):
+        # Rebuild every index from `teams`/`players`, e.g. after a load
+        self.captains = {}
+        for team_name, team_data in self.teams.items():
+            team_data['players'] = dict.fromkeys(team_data['players'])
+            if team_data.get('captain') is not None:
+                self.captains[team_data['captain']] = team_name
+        self.totals = TeamTotals.build(self.teams, self.players, self.default_cap)
+        self.rankings = Rankings.build(self.teams, self.players, self.totals)
+        self.version += 1
+
+    def _rank_team(self, team_name):
+        self.rankings.update_team(team_name, self.totals.total(team_name), self.totals.cap(team_name))
+
+    # Queries
+
+    def has_team(self, team_name):
+        return team_name in self.teams
+
+    def team_of(self, player_id):
+        return self.players.team_of(player_id)
+
+    def stars_of(self, player_id):
+        return self.players.stars_of(player_id)
+
+    def on_roster(self, team_name, player_id):
+        return team_name in self.teams and player_id in self.teams[team_name]['players']
+
+    def roster(self, team_name):
+        return list(self.teams[team_name]['players'])
+
+    def captain_team(self, player_id):
+        return self.captains.get(player_id)
+
+    def is_captain(self, player_id, team_name=None):
+        captain_of = self.captains.get(player_id)
+        if team_name is None:
+            return captain_of is not None
+        return captain_of == team_name
+
+    def captain_of(self, team_name):
+        return self.teams[team_name].get('captain')
+
+    def check_caps(self, moves=(), stars=None):
+        # A CapCheck of proposed moves and star edits, before making them
+        return CapCheck(self, moves, stars)
+
+    # Mutations
+
+    def create_team(self, team_name, cap=None):
+        team_data = {'players': {}, 'captain': None}
+        if cap is not None:
+            team_data['rostercap'] = cap
+        self.teams[team_name] = team_data
+        self.totals.add_team(team_name, cap)
+        self._rank_team(team_name)
+        self._team_changed(team_name)
+        self._emit('create_team', team=team_name, cap=cap)
+        return team_data
+
+    def set_cap(self, team_name, cap):
+        old_cap = self.teams[team_name].get('rostercap')
+        self.teams[team_name]['rostercap'] = cap
+        self.totals.set_cap(team_name, cap)
+        self._rank_team(team_name)
+        self._team_changed(team_name)
+        self._emit('set_cap', team=team_name, cap=cap, old=old_cap)
+
+    def set_default_cap(self, cap):
+        # The cap of every team that has none of its own
+        self.default_cap = cap
+        self.totals.default_cap = cap
+        for team_name, team_data in self.teams.items():
+            if team_data.get('rostercap') is None:
+                self.totals.set_cap(team_name, cap)
+                self._rank_team(team_name)
+        self.version += 1
+
+    def set_captain(self, team_name, player_id):
+        previous = self.teams[team_name].get('captain')
+        if self.captains.get(previous) == team_name:
+            del self.captains[previous]
+        self.teams[team_name]['captain'] = player_id
+        if player_id is not None:
+            # A player captains at most one team
+            other_team = self.captains.get(player_id)
+            if other_team is not None and other_team != team_name:
+                self.teams[other_team]['captain'] = None
+                self._team_changed(other_team)
+            self.captains[player_id] = team_name
+        self._team_changed(team_name)
+        self._emit('set_captain', team=team_name, player=player_id, old=previous)
+
+    def register_player(self, player_id):
+        # Add a free agent if the player isn't known yet
+        if player_id in self.players:
+            return False
+        self.players.put(player_id, None, 0)
+        self.rankings.add_player(player_id, None, 0)
+        self._player_changed(player_id, roster=False)
+        return True
+
+    def register_players(self, player_ids):
+        # Bulk register_player; returns how many were new
+        new = self.players.missing(player_ids)
+        self.rankings.unlisted += len(new)
+        for player_id in new:
+            self.players.put(player_id, None, 0)
+            self._player_changed(player_id, roster=False)
+        return len(new)
+
+    def assign(self, player_id, team_name, source=None):
+        # Move a player onto team_name (None means free agent), taking them
+        # off their previous roster. source names the command behind the
+        # move ('sign', 'trade', ...) for the event log.
+        previous_team = self.players.team_of(player_id)
+        stars = self.players.stars_of(player_id)
+        registered = player_id in self.players
+        # First, as in set_stars: the store rejects an ID it can't hold
+        # before the rosters, totals and rankings have changed
+        self.players.put(player_id, team_name, stars)
+        if registered:
+            self.rankings.remove_player(player_id, previous_team, stars)
+        if self.on_roster(previous_team, player_id):
+            del self.teams[previous_team]['players'][player_id]
+            self.totals.remove_player(previous_team, stars)
+            self._rank_team(previous_team)
+            self._team_changed(previous_team)
+
+        if team_name is not None:
+            self.teams[team_name]['players'][player_id] = None
+            self.totals.add_player(team_name, stars)
+            self._rank_team(team_name)
+            self._team_changed(team_name)
+
+        self.rankings.add_player(player_id, team_name, stars)
+        self._player_changed(player_id)
+        self._emit('assign', player=player_id, from_team=previous_team, to_team=team_name, source=source)
+
+    def remove_player(self, player_id):
+        # Take the player off their roster and forget them entirely
+        team_name = self.team_of(player_id)
+        stars = self.stars_of(player_id)
+        captain_team = self.captain_team(player_id)
+        if captain_team is not None:
+            self.set_captain(captain_team, None)
+        if player_id in self.players:
+            self.rankings.remove_player(player_id, team_name, stars)
+        if self.on_roster(team_name, player_id):
+            del self.teams[team_name]['players'][player_id]
+            self.totals.remove_player(team_name, stars)
+            self._rank_team(team_name)
+            self._team_changed(team_name)
+        self.players.pop(player_id, None)
+        self._player_changed(player_id)
+        self._emit('remove_player', player=player_id, team=team_name, stars=stars)
+
+    def remove_players(self, player_ids):
+        # Bulk remove_player; returns how many were on a roster. Free agents
+        # with no stars (most of them) are dropped in one pass and, like
+        # their registration, not reported as events.
+        bare = []
+        rostered = 0
+        for player_id in player_ids:
+            if player_id not in self.players:
+                continue
+            if self.team_of(player_id) is None and not self.stars_of(player_id) and not self.is_captain(player_id):
+                bare.append(player_id)
+                continue
+            rostered += self.team_of(player_id) is not None
+            self.remove_player(player_id)
+        self.players.discard_many(bare)
+        self.rankings.unlisted -= len(bare)
+        for player_id in bare:
+            self._player_changed(player_id, roster=False)
+        return rostered
+
+    def set_stars(self, player_id, stars):
+        if player_id not in self.players:
+            raise KeyError(player_id)
+        team_name = self.players.team_of(player_id)
+        old_stars = self.players.stars_of(player_id)
+        self.players.put(player_id, team_name, stars)
+        self.rankings.remove_player(player_id, team_name, old_stars)
+        self.rankings.add_player(player_id, team_name, stars)
+        if self.on_roster(team_name, player_id):
+            self.totals.change_stars(team_name, stars - old_stars)
+            self._rank_team(team_name)
+        self._player_changed(player_id)
+        self._emit('set_stars', player=player_id, stars=stars, old=old_stars)
+        return old_stars
@@ -0,0 +1,204 @@
+import asyncio
+import collections
+import time
+
+import discord
+
+from metrics import get_logger
+
+log = get_logger('aaflbot.members')
+
+# query_members takes at most this many user IDs per gateway request
+QUERY_BATCH = 100
+
+
+def bot_options(lean=False):
+    # Keyword arguments for commands.Bot.
+    #
+    # The default asks for every intent, which makes discord.py chunk the
+    # whole member list (and presences) of every guild before on_ready and
+    # keep it in memory. Lean mode asks for what the commands use: guild
+    # messages with their content for the prefix commands, reactions in
+    # guilds and DMs for menus, offers and votes, and members so members can
+    # be fetched on demand and /updateplayers can page through the list. No
+    # guild is chunked and discord.py caches no members; MemberCache holds the
+    # ones the bot actually looks at.
+    if not lean:
+        return {'intents': discord.Intents.all()}
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.members = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    intents.guild_reactions = True
+    intents.dm_reactions = True
+    return {
+        'intents': intents,
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+    }
+
+
+async def member_chunks(guild, size=1000):
+    # Every member of the guild in lists of up to `size`: sliced from the
+    # cached list when the guild was chunked, otherwise paged in over REST
+    # (1000 per request)
+    if guild.chunked:
+        members = guild.members
+        for start in range(0, len(members), size):
+            yield members[start:start + size]
+        return
+    chunk = []
+    async for member in guild.fetch_members(limit=None):
+        chunk.append(member)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class MemberCache:
+    # Members resolved on demand, per (guild ID, user ID).
+    #
+    # Lookups go to discord.py's own member cache first, so with all intents
+    # this is a thin pass-through. Otherwise members are fetched (one by one
+    # over REST, or up to 100 at a time over the gateway) and kept for `ttl`
+    # seconds. Entries for pinned users (players rostered in that guild's
+    # league) are kept apart and never evicted; everyone else shares an LRU
+    # of `maxsize` entries.
+    # Users who are not in the guild are cached as None so departed players
+    # don't cost a request on every lookup.
+
+    def __init__(self, pinned, maxsize=5000, ttl=900.0):
+        # pinned(guild_id, user_id) -> bool
+        self.pinned = pinned
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._pinned = {}
+        self._lru = collections.OrderedDict()
+        self._guild_ids = set()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def __len__(self):
+        return len(self._pinned) + len(self._lru)
+
+    def _lookup(self, key):
+        # Returns (found, member) for a fresh cache entry
+        entry = self._pinned.get(key)
+        if entry is None:
+            entry = self._lru.get(key)
+            if entry is None:
+                return False, None
+            self._lru.move_to_end(key)
+        member, fetched_at = entry
+        if time.monotonic() - fetched_at > self.ttl:
+            return False, None
+        return True, member
+
+    def peek(self, guild, user_id):
+        # Cached member or None, without fetching; for sync code like page
+        # renderers that run after a get_many warmed the cache
+        member = guild.get_member(user_id)
+        if member is None:
+            member = self._lookup((guild.id, user_id))[1]
+        return member
+
+    def put(self, guild_id, user_id, member):
+        key = (guild_id, user_id)
+        self._guild_ids.add(guild_id)
+        entry = (member, time.monotonic())
+        if self.pinned(guild_id, user_id):
+            self._lru.pop(key, None)
+            self._pinned[key] = entry
+        else:
+            self._pinned.pop(key, None)
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def discard(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        self._pinned.pop(key, None)
+        self._lru.pop(key, None)
+
+    def repin(self, user_id):
+        # League hook: move the user's entries after their roster spot changed
+        for guild_id in self._guild_ids:
+            key = (guild_id, user_id)
+            entry = self._pinned.pop(key, None) or self._lru.pop(key, None)
+            if entry is not None:
+                self.put(guild_id, user_id, entry[0])
+
+    async def get(self, guild, user_id):
+        member = guild.get_member(user_id)
+        if member is not None:
+            self.hits += 1
+            return member
+
+        key = (guild.id, user_id)
+        found, member = self._lookup(key)
+        if found:
+            self.hits += 1
+            return member
+
+        # Concurrent lookups of the same member share one request
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            self.fetches += 1
+            try:
+                member = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                member = None
+            self.put(guild.id, user_id, member)
+            future.set_result(member)
+            return member
+        except BaseException as e:
+            future.set_exception(e)
+            # Only waiters should see the exception, not the event loop
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def get_many(self, guild, user_ids):
+        # Returns {user_id: member or None}, fetching the misses in batches
+        # over the gateway rather than one REST call each
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is None:
+                cached, member = self._lookup((guild.id, user_id))
+                if not cached:
+                    missing.append(user_id)
+                    continue
+            found[user_id] = member
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        for start in range(0, len(missing), QUERY_BATCH):
+            batch = missing[start:start + QUERY_BATCH]
+            self.fetches += 1
+            try:
+                members = await guild.query_members(user_ids=batch, limit=len(batch), cache=False)
+            except asyncio.TimeoutError:
+                log.warning('member_query_timeout', guild=guild.id, count=len(batch))
+                continue
+            by_id = {member.id: member for member in members}
+            for user_id in batch:
+                member = by_id.get(user_id)
+                self.put(guild.id, user_id, member)
+                found[user_id] = member
+        return found
@@ -0,0 +1,210 @@
+import bisect
+import contextvars
+import logging
+import time
+
+# Latency buckets in seconds, Prometheus style (upper bounds, +Inf implied)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class KeyValueFormatter(logging.Formatter):
+    # Appends the event's fields as key=value pairs. Fields are only turned
+    # into text here, i.e. when a record is actually emitted.
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value!r}' for key, value in fields.items())
+        return line
+
+
+class EventLogger:
+    # Thin wrapper so call sites can write `log.info('trade_done', team=...)`.
+    # Nothing is formatted unless the level is enabled.
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, extra={'fields': fields}, exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name='aaflbot'):
+    return EventLogger(name)
+
+
+def setup_logging(level='INFO'):
+    handler = logging.StreamHandler()
+    handler.setFormatter(KeyValueFormatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    # discord.py is very chatty at DEBUG
+    logging.getLogger('discord').setLevel(max(root.level, logging.INFO))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket the q-th observation falls in
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+# Route key of the REST request currently running in this task, so the
+# discord.http rate-limit warnings can be attributed to it
+current_route = contextvars.ContextVar('current_route', default=None)
+
+
+class RateLimitHandler(logging.Handler):
+    # discord.py retries 429s internally and only tells us through its logger.
+    # It logs 'We are being rate limited' once per 429; a global limit adds a
+    # 'Global rate limit' line for the same response, which isn't counted.
+
+    def __init__(self, metrics):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith('We are being rate limited'):
+            self.metrics.rate_limit_hit(current_route.get() or 'unknown')
+
+
+class Metrics:
+    # Per-command latency histograms plus REST call and rate-limit counters
+    # per route, viewable via /stats and exportable as Prometheus text.
+    # Outbound messages add a delivery latency histogram (queued to sent)
+    # and gauges registered by name, read when the metrics are rendered.
+
+    def __init__(self):
+        self.commands = {}
+        self.command_errors = {}
+        self.rest_calls = {}
+        self.rest_latency = {}
+        self.rate_limits = {}
+        self.outbox_latency = Histogram()
+        self.gauges = {}
+        self.started = time.time()
+
+    def observe_command(self, name, seconds, failed=False):
+        self.commands.setdefault(name, Histogram()).observe(seconds)
+        if failed:
+            self.command_errors[name] = self.command_errors.get(name, 0) + 1
+
+    def observe_rest(self, route, seconds):
+        self.rest_calls[route] = self.rest_calls.get(route, 0) + 1
+        self.rest_latency.setdefault(route, Histogram()).observe(seconds)
+
+    def rate_limit_hit(self, route):
+        self.rate_limits[route] = self.rate_limits.get(route, 0) + 1
+
+    def observe_outbox(self, seconds):
+        self.outbox_latency.observe(seconds)
+
+    def gauge(self, name, read):
+        # read() -> current value
+        self.gauges[name] = read
+
+    def instrument_http(self, http):
+        # Wrap HTTPClient.request on this client to count calls per route
+        request = http.request
+
+        async def counted_request(route, **kwargs):
+            token = current_route.set(route.key)
+            start = time.perf_counter()
+            try:
+                return await request(route, **kwargs)
+            finally:
+                self.observe_rest(route.key, time.perf_counter() - start)
+                current_route.reset(token)
+
+        http.request = counted_request
+        logging.getLogger('discord.http').addHandler(RateLimitHandler(self))
+
+    def summary(self, limit=10):
+        lines = [f'Uptime: {int(time.time() - self.started)}s']
+
+        lines.append('**Commands** (count, p50, p95, errors)')
+        by_count = sorted(self.commands.items(), key=lambda item: item[1].count, reverse=True)
+        for name, histogram in by_count[:limit]:
+            lines.append(f'{name}: {histogram.count}, {histogram.quantile(0.5):g}s, {histogram.quantile(0.95):g}s, {self.command_errors.get(name, 0)}')
+
+        if self.outbox_latency.count or self.gauges:
+            lines.append('**Outbox** (delivered, p50, p95)')
+            lines.append(f'{self.outbox_latency.count}, {self.outbox_latency.quantile(0.5):g}s, {self.outbox_latency.quantile(0.95):g}s')
+            lines.extend(f'{name}: {read()}' for name, read in self.gauges.items())
+
+        lines.append('**REST calls** (count, rate limited)')
+        by_count = sorted(self.rest_calls.items(), key=lambda item: item[1], reverse=True)
+        for route, count in by_count[:limit]:
+            lines.append(f'{route}: {count}, {self.rate_limits.get(route, 0)}')
+        return '\n'.join(lines)
+
+    def prometheus(self):
+        lines = []
+
+        def histogram_lines(metric, label, values):
+            lines.append(f'# TYPE {metric} histogram')
+            for key, histogram in values.items():
+                labels = f'{label}="{escape_label(key)}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{{labels}}} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+
+        def counter_lines(metric, label, values):
+            lines.append(f'# TYPE {metric} counter')
+            for key, count in values.items():
+                lines.append(f'{metric}{{{label}="{escape_label(key)}"}} {count}')
+
+        histogram_lines('aaflbot_command_seconds', 'command', self.commands)
+        counter_lines('aaflbot_command_errors_total', 'command', self.command_errors)
+        histogram_lines('aaflbot_rest_seconds', 'route', self.rest_latency)
+        counter_lines('aaflbot_rest_calls_total', 'route', self.rest_calls)
+        counter_lines('aaflbot_rate_limits_total', 'route', self.rate_limits)
+        histogram_lines('aaflbot_outbox_delivery_seconds', 'queue', {'all': self.outbox_latency})
+        for name, read in self.gauges.items():
+            lines.append(f'# TYPE aaflbot_{name} gauge')
+            lines.append(f'aaflbot_{name} {read()}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,145 @@
+import bisect
+import collections
+import difflib
+import heapq
+
+# Fuzzy matches below this similarity (difflib ratio, 0-1) are dropped
+MIN_SIMILARITY = 0.6
+# Names sharing the most trigrams with a query that are scored for typos
+FUZZY_CANDIDATES = 10
+# Most prefix entries looked at per requested match, so a one-letter query
+# doesn't walk every name starting with that letter
+PREFIX_SCAN = 20
+
+
+def normalize(name):
+    # Case-insensitive, with runs of whitespace collapsed
+    return ' '.join(name.casefold().split())
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    # Fuzzy lookup from names to keys (team names, player IDs).
+    #
+    # Two indexes over the normalized names:
+    #   - a sorted list of (suffix, key) for every word start in a name, so a
+    #     prefix of the name or of any of its words is one bisect plus a scan
+    #     of the matching range (the same queries as a prefix trie)
+    #   - trigram -> keys, to find the few names worth scoring for a typo
+    # match() ranks exact names first, then name prefixes, then word
+    # prefixes; if that leaves room, the names sharing the most trigrams
+    # with the query follow, by edit similarity, when they are close enough.
+
+    def __init__(self):
+        self.names = {}
+        self._normalized = {}
+        self._exact = collections.defaultdict(set)
+        self._prefixes = []
+        self._grams = collections.defaultdict(set)
+        self._gram_counts = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, key):
+        return key in self.names
+
+    @staticmethod
+    def _word_starts(normalized):
+        return [0] + [i + 1 for i, char in enumerate(normalized) if char == ' ']
+
+    def add(self, key, name):
+        # Add or rename
+        if self.names.get(key) == name:
+            return
+        self.remove(key)
+        normalized = normalize(name)
+        self.names[key] = name
+        self._normalized[key] = normalized
+        self._exact[normalized].add(key)
+        for start in self._word_starts(normalized):
+            bisect.insort(self._prefixes, (normalized[start:], key))
+        grams = trigrams(normalized)
+        for gram in grams:
+            self._grams[gram].add(key)
+        self._gram_counts[key] = len(grams)
+
+    def remove(self, key):
+        normalized = self._normalized.pop(key, None)
+        if normalized is None:
+            return
+        del self.names[key]
+        self._exact[normalized].discard(key)
+        if not self._exact[normalized]:
+            del self._exact[normalized]
+        for start in self._word_starts(normalized):
+            entry = (normalized[start:], key)
+            i = bisect.bisect_left(self._prefixes, entry)
+            if i < len(self._prefixes) and self._prefixes[i] == entry:
+                del self._prefixes[i]
+        for gram in trigrams(normalized):
+            keys = self._grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self._grams[gram]
+        del self._gram_counts[key]
+
+    def exact(self, name):
+        # The key whose name matches ignoring case and spacing, if only one does
+        keys = self._exact.get(normalize(name))
+        if keys is not None and len(keys) == 1:
+            return next(iter(keys))
+        return None
+
+    def _similarity(self, matcher, key):
+        # Best difflib ratio against the whole name or any one word of it;
+        # the query is the matcher's second sequence, which difflib indexes
+        name = self._normalized[key]
+        best = 0.0
+        for candidate in [name] + (name.split(' ') if ' ' in name else []):
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() > best and matcher.quick_ratio() > best:
+                best = max(best, matcher.ratio())
+        return best
+
+    def match(self, query, limit=5, min_similarity=MIN_SIMILARITY):
+        # Up to `limit` keys, best match first
+        normalized = normalize(query)
+        if not normalized:
+            return heapq.nsmallest(limit, self.names, key=self._normalized.__getitem__)
+
+        # Exact, then name prefix, then word prefix; shorter names first
+        tiers = {key: 3 for key in self._exact.get(normalized, ())}
+        i = bisect.bisect_left(self._prefixes, (normalized,))
+        end = min(len(self._prefixes), i + PREFIX_SCAN * limit)
+        while i < end and self._prefixes[i][0].startswith(normalized):
+            suffix, key = self._prefixes[i]
+            tier = 2 if len(suffix) == len(self._normalized[key]) else 1
+            if tiers.get(key, 0) < tier:
+                tiers[key] = tier
+            i += 1
+        ranked = sorted(tiers, key=lambda key: (-tiers[key], len(self._normalized[key]), self._normalized[key]))
+        if len(ranked) >= limit:
+            return ranked[:limit]
+
+        # Then typos: the names with the most trigrams in common relative to
+        # their size, by edit similarity
+        query_grams = trigrams(normalized)
+        shared = collections.Counter()
+        for gram in query_grams:
+            shared.update(self._grams.get(gram, ()))
+        counts = self._gram_counts
+        candidates = heapq.nlargest(FUZZY_CANDIDATES, (key for key in shared if key not in tiers),
+                                    key=lambda key: shared[key] / (len(query_grams) + counts[key]))
+        matcher = difflib.SequenceMatcher(None, b=normalized, autojunk=False)
+        fuzzy = []
+        for key in candidates:
+            similarity = self._similarity(matcher, key)
+            if similarity >= min_similarity:
+                fuzzy.append((-similarity, self._normalized[key], key))
+        fuzzy.sort(key=lambda entry: entry[:2])
+        return (ranked + [key for _, _, key in fuzzy])[:limit]
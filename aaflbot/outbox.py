@@ -0,0 +1,154 @@
+import asyncio
+import collections
+import time
+
+from metrics import get_logger
+
+log = get_logger('aaflbot.outbox')
+
+MESSAGE_LIMIT = 2000
+
+
+class Outbox:
+    # Outbound messages and reactions, queued per destination.
+    #
+    # Each channel (or DM recipient) gets a FIFO drained by one task, so
+    # replies keep their order and only one request per channel is in
+    # flight; that matches Discord's per-channel buckets for creating
+    # messages and adding reactions. Different destinations are drained side
+    # by side, bounded by `concurrency` and paced to `per_second` requests
+    # overall to stay under the global limit. discord.py still handles any
+    # 429 that gets through.
+    #
+    # Short plain-text replies that pile up behind an in-flight request are
+    # sent as one message (joined by newlines, up to MESSAGE_LIMIT). Nothing
+    # is held back to wait for more, so an idle channel sees no added delay.
+    #
+    # send() and react() return a future for the sent Message (None for
+    # reactions). Callers that need the message await it; everyone else lets
+    # the outbox deliver in the background and failures are logged.
+
+    def __init__(self, metrics=None, concurrency=16, per_second=40, short=400):
+        self.metrics = metrics
+        self.short = short
+        self.per_second = per_second
+        self.sent = 0
+        self.coalesced = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._recent = collections.deque()
+        self._queues = {}
+        self._workers = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(self, key, job):
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+        queue.append((job, future, time.perf_counter()))
+        self._idle.clear()
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return future
+
+    def send(self, destination, content=None, coalesce=True, **kwargs):
+        # destination: a Context, channel, or member/user (for a DM). Pass
+        # coalesce=False for a message that must stand alone, e.g. one that
+        # gets reactions. Slash command replies get a queue of their own and
+        # are never merged.
+        interaction = getattr(destination, 'interaction', None)
+        channel = getattr(destination, 'channel', None)
+        if interaction is not None:
+            # Slash command replies go to the interaction's webhook and must
+            # start within 3 seconds, so they don't wait behind the channel
+            key = ('interaction', interaction.id)
+        else:
+            key = channel.id if channel is not None else destination.id
+        mergeable = (coalesce and not kwargs and isinstance(content, str) and len(content) <= self.short
+                     and interaction is None)
+        return self._enqueue(key, ('send', destination, content, kwargs, mergeable))
+
+    def react(self, message, *emojis):
+        # Reactions go on in the given order
+        return self._enqueue(message.channel.id, ('react', message, emojis, None, False))
+
+    async def join(self):
+        # Wait until everything queued so far has been delivered
+        await self._idle.wait()
+
+    async def _pace(self):
+        # At most per_second requests in any one-second window
+        while True:
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 1.0:
+                self._recent.popleft()
+            if len(self._recent) < self.per_second:
+                self._recent.append(now)
+                return
+            await asyncio.sleep(self._recent[0] + 1.0 - now)
+
+    async def _request(self, coro):
+        # A slot is held per request, not per job, so a destination waiting
+        # out its own bucket between reactions doesn't hold up the others
+        async with self._semaphore:
+            await self._pace()
+            return await coro
+
+    def _take(self, queue):
+        # Pop the next job plus any short replies queued right behind it
+        batch = [queue.popleft()]
+        (_, _, content, _, mergeable), _, _ = batch[0]
+        if not mergeable:
+            return batch
+        length = len(content)
+        while queue:
+            (_, _, next_content, _, next_mergeable), _, _ = queue[0]
+            if not next_mergeable or length + 1 + len(next_content) > MESSAGE_LIMIT:
+                break
+            length += 1 + len(next_content)
+            batch.append(queue.popleft())
+        return batch
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                batch = self._take(queue)
+                (kind, target, content, kwargs, _), _, _ = batch[0]
+                try:
+                    if kind == 'react':
+                        for emoji in content:
+                            await self._request(target.add_reaction(emoji))
+                        result = None
+                    else:
+                        if len(batch) > 1:
+                            content = '\n'.join(job[2] for job, _, _ in batch)
+                        result = await self._request(target.send(content, **kwargs))
+                except Exception as e:
+                    log.warning('outbox_send_failed', destination=key, kind=kind, error=repr(e))
+                    for _, future, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                            # Only callers awaiting the future should see it
+                            future.exception()
+                    continue
+
+                finished = time.perf_counter()
+                self.sent += 1
+                self.coalesced += len(batch) - 1
+                for _, future, queued_at in batch:
+                    if self.metrics is not None:
+                        self.metrics.observe_outbox(finished - queued_at)
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            del self._workers[key]
+            if not queue:
+                del self._queues[key]
+            if not self._workers:
+                self._idle.set()
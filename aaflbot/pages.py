@@ -0,0 +1,83 @@
+import collections
+
+from discord.ext import menus
+
+PAGE_SIZE = 10  # Fields per embed page, well under Discord's 25 field limit
+
+
+class PageCache:
+    # Rendered pages keyed by e.g. ('roster', guild_id, team_name, page).
+    #
+    # Each entry remembers the league version it was rendered at, so a lookup
+    # at the same version is free and any league mutation (which bumps the
+    # version) makes the next lookup render again. Least recently used pages
+    # are dropped past `maxsize`.
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._pages = collections.OrderedDict()
+
+    def get(self, key, version, render):
+        entry = self._pages.get(key)
+        if entry is not None and entry[0] == version:
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        page = render()
+        self._pages[key] = (version, page)
+        self._pages.move_to_end(key)
+        if len(self._pages) > self.maxsize:
+            self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        self._pages.clear()
+
+
+class CachedPageSource(menus.PageSource):
+    # Page source that renders only the page being shown, through PageCache.
+    #
+    # render(page_number, max_pages) builds the embed for one page; version()
+    # returns the current league version.
+
+    def __init__(self, cache, key, version, entry_count, render, per_page=PAGE_SIZE):
+        self.cache = cache
+        self.key = key
+        self.version = version
+        self.entry_count = entry_count
+        self.render = render
+        self.per_page = per_page
+
+    def is_paginating(self):
+        return self.get_max_pages() > 1
+
+    def get_max_pages(self):
+        return max(1, -(-self.entry_count // self.per_page))
+
+    async def get_page(self, page_number):
+        return page_number
+
+    async def format_page(self, menu, page_number):
+        max_pages = self.get_max_pages()
+        return self.cache.get(self.key + (page_number,), self.version(),
+                              lambda: self.render(page_number, max_pages))
+
+
+class ReplyMenuPages(menus.MenuPages):
+    # MenuPages that answers a slash command with its first page instead of
+    # posting it to the channel, which would leave the interaction unanswered
+
+    async def send_initial_message(self, ctx, channel):
+        if getattr(ctx, 'interaction', None) is None:
+            return await super().send_initial_message(ctx, channel)
+        page = await self._source.get_page(0)
+        kwargs = await self._get_kwargs_from_page(page)
+        return await ctx.send(**kwargs)
+
+
+def page_bounds(page_number, per_page=PAGE_SIZE):
+    return page_number * per_page, (page_number + 1) * per_page
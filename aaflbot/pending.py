@@ -0,0 +1,75 @@
+import time
+
+from timers import TimerHeap
+
+
+class PendingActions:
+    # Offers waiting on someone's reaction (sign offers, trade confirmations).
+    #
+    # Actions are keyed by the ID of the message the reaction goes on, so the
+    # single `on_raw_reaction_add` handler resolves one with a dict lookup no
+    # matter how many are open. Each action is a plain dict that is persisted
+    # through the storage backend, and all expiries share one TimerHeap.
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.actions = {}
+        self.handlers = {}
+        self.timers = TimerHeap(self._expire)
+
+    def handler(self, kind, on_reaction, on_expire):
+        # on_reaction(action, emoji) and on_expire(action) are coroutines
+        self.handlers[kind] = (on_reaction, on_expire)
+
+    def add(self, message_id, kind, target, choices, timeout, **data):
+        action = {
+            'kind': kind,
+            'target': target,
+            'choices': list(choices),
+            'expires_at': time.time() + timeout,
+            **data,
+        }
+        self.actions[message_id] = action
+        self.storage.save_action(message_id)
+        self.timers.schedule(message_id, action['expires_at'])
+        return action
+
+    def load(self, keep=None):
+        # Pick up offers that were open before a restart; keep(action), if
+        # given, picks the ones this process handles
+        self.storage.load_actions(self.actions)
+        if keep is not None:
+            for message_id in [message_id for message_id, action in self.actions.items() if not keep(action)]:
+                del self.actions[message_id]
+        for message_id, action in self.actions.items():
+            self.timers.schedule(message_id, action['expires_at'])
+
+    def start(self):
+        self.timers.start()
+
+    def _pop(self, message_id):
+        action = self.actions.pop(message_id, None)
+        if action is not None:
+            self.timers.cancel(message_id)
+            self.storage.save_action(message_id)
+        return action
+
+    async def handle_reaction(self, payload):
+        action = self.actions.get(payload.message_id)
+        if action is None or payload.user_id != action['target']:
+            return False
+
+        emoji = str(payload.emoji)
+        if emoji not in action['choices']:
+            return False
+
+        self._pop(payload.message_id)
+        on_reaction, _ = self.handlers[action['kind']]
+        await on_reaction(action, emoji)
+        return True
+
+    async def _expire(self, message_id):
+        action = self._pop(message_id)
+        if action is not None:
+            _, on_expire = self.handlers[action['kind']]
+            await on_expire(action)
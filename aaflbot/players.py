@@ -0,0 +1,194 @@
+import array
+import bisect
+import collections.abc
+
+# Below this many pending IDs the tail of new free agents is not merged yet
+MIN_MERGE = 1024
+
+
+class PlayerStore(collections.abc.MutableMapping):
+    # Compact replacement for the `{player_id: {'team': ..., 'stars': ...}}`
+    # dict, with the same mapping interface.
+    #
+    # Most registered players are members who never play: a free agent with
+    # 0 stars. Those are only kept as IDs in a sorted `array('q')` (8 bytes
+    # each) plus a small set of recent additions that is merged in once it
+    # grows past a quarter of the array. Everyone else gets a dense slot in
+    # three typed arrays (ID, interned team number, stars) and an entry in
+    # `_slots`; freeing a slot moves the last one into the gap.
+    #
+    # `players[player_id]` builds a fresh dict, so writing to it changes
+    # nothing; use put() or assignment. team_of(), stars_of() and rows() skip
+    # the dicts for hot paths.
+
+    def __init__(self):
+        self._team_numbers = {None: 0}
+        self._team_names = [None]
+        self._slots = {}
+        self._ids = array.array('q')
+        self._teams = array.array('I')
+        self._stars = array.array('q')
+        self._bare = array.array('q')
+        self._bare_new = set()
+
+    # Team interning
+
+    def _team_number(self, team_name):
+        number = self._team_numbers.get(team_name)
+        if number is None:
+            number = self._team_numbers[team_name] = len(self._team_names)
+            self._team_names.append(team_name)
+        return number
+
+    # Bare free agents
+
+    def _has_bare(self, player_id):
+        if player_id in self._bare_new:
+            return True
+        i = bisect.bisect_left(self._bare, player_id)
+        return i < len(self._bare) and self._bare[i] == player_id
+
+    def _add_bare(self, player_id):
+        self._bare_new.add(player_id)
+        if len(self._bare_new) > max(MIN_MERGE, len(self._bare) // 4):
+            self.compact()
+
+    def _discard_bare(self, player_id):
+        if player_id in self._bare_new:
+            self._bare_new.discard(player_id)
+            return True
+        i = bisect.bisect_left(self._bare, player_id)
+        if i < len(self._bare) and self._bare[i] == player_id:
+            del self._bare[i]
+            return True
+        return False
+
+    def compact(self):
+        # Merge the recently added free agents into the sorted array
+        if self._bare_new:
+            self._bare = array.array('q', sorted(self._bare_new.union(self._bare)))
+            self._bare_new = set()
+
+    def missing(self, player_ids):
+        # The given IDs that aren't stored yet, as a set. Checks the whole
+        # batch against the sorted IDs at once instead of one lookup each.
+        candidates = set(player_ids).difference(self._slots, self._bare_new)
+        if len(candidates) * 16 < len(self._bare):
+            return {player_id for player_id in candidates if not self._has_bare(player_id)}
+        candidates.difference_update(self._bare)
+        return candidates
+
+    def ids(self):
+        # Every stored ID, as a new set
+        ids = set(self._bare)
+        ids.update(self._bare_new)
+        ids.update(self._slots)
+        return ids
+
+    def discard_many(self, player_ids):
+        # Delete every given ID that is stored; for a large batch the free
+        # agent array is rebuilt once rather than shifted per ID
+        player_ids = set(player_ids)
+        for player_id in player_ids.intersection(self._slots):
+            self._free_slot(player_id)
+        self._bare_new.difference_update(player_ids)
+        if len(player_ids) * 16 < len(self._bare):
+            for player_id in player_ids:
+                self._discard_bare(player_id)
+        elif not player_ids.isdisjoint(self._bare):
+            self._bare = array.array('q', (player_id for player_id in self._bare if player_id not in player_ids))
+
+    # Slotted players
+
+    def _free_slot(self, player_id):
+        slot = self._slots.pop(player_id)
+        last = len(self._ids) - 1
+        if slot != last:
+            moved = self._ids[last]
+            self._ids[slot] = moved
+            self._teams[slot] = self._teams[last]
+            self._stars[slot] = self._stars[last]
+            self._slots[moved] = slot
+        self._ids.pop()
+        self._teams.pop()
+        self._stars.pop()
+
+    # Fast accessors
+
+    def team_of(self, player_id):
+        slot = self._slots.get(player_id)
+        return None if slot is None else self._team_names[self._teams[slot]]
+
+    def stars_of(self, player_id):
+        slot = self._slots.get(player_id)
+        return 0 if slot is None else self._stars[slot]
+
+    def put(self, player_id, team_name, stars):
+        # Insert or update a player, moving them between the bare IDs and a
+        # slot as needed
+        slot = self._slots.get(player_id)
+        if team_name is None and not stars:
+            if slot is not None:
+                self._free_slot(player_id)
+                self._add_bare(player_id)
+            elif not self._has_bare(player_id):
+                self._add_bare(player_id)
+            return
+
+        # The typed arrays raise on values they can't hold (OverflowError);
+        # they are written first so a failed put changes nothing
+        if slot is None:
+            self._stars.append(stars)
+            try:
+                self._ids.append(player_id)
+            except BaseException:
+                self._stars.pop()
+                raise
+            self._teams.append(self._team_number(team_name))
+            self._slots[player_id] = len(self._ids) - 1
+            self._discard_bare(player_id)
+        else:
+            self._stars[slot] = stars
+            self._teams[slot] = self._team_number(team_name)
+
+    def rows(self, bare=True):
+        # (player_id, team_name, stars) for every player; bare=False skips
+        # the free agents with 0 stars
+        names = self._team_names
+        yield from zip(self._ids, (names[number] for number in self._teams), self._stars)
+        if bare:
+            for player_id in self._bare:
+                yield player_id, None, 0
+            for player_id in list(self._bare_new):
+                yield player_id, None, 0
+
+    # Mapping interface
+
+    def __getitem__(self, player_id):
+        slot = self._slots.get(player_id)
+        if slot is not None:
+            return {'team': self._team_names[self._teams[slot]], 'stars': self._stars[slot]}
+        if self._has_bare(player_id):
+            return {'team': None, 'stars': 0}
+        raise KeyError(player_id)
+
+    def __setitem__(self, player_id, player_data):
+        self.put(player_id, player_data.get('team'), player_data.get('stars', 0))
+
+    def __delitem__(self, player_id):
+        if player_id in self._slots:
+            self._free_slot(player_id)
+        elif not self._discard_bare(player_id):
+            raise KeyError(player_id)
+
+    def __contains__(self, player_id):
+        return player_id in self._slots or self._has_bare(player_id)
+
+    def __iter__(self):
+        return (player_id for player_id, _, _ in self.rows())
+
+    def __len__(self):
+        return len(self._slots) + len(self._bare) + len(self._bare_new)
+
+    def clear(self):
+        self.__init__()
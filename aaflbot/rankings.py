@@ -0,0 +1,168 @@
+import bisect
+import math
+
+# Group for the leaderboard across all players; other groups are a team name,
+# or None for the free agents
+ALL = object()
+
+
+class StarBuckets:
+    # One group of players (everyone, a team, or the free agents) bucketed
+    # by stars.
+    #
+    # `levels` holds the distinct star values in ascending order and each
+    # bucket is a dict used as an ordered set, so adding, removing or moving
+    # a player is a dict operation plus a bisect over the levels. Star
+    # values are few, so reading a page or a rank walks levels, not players.
+
+    def __init__(self):
+        self.levels = []
+        self.buckets = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, player_id, stars):
+        bucket = self.buckets.get(stars)
+        if bucket is None:
+            bucket = self.buckets[stars] = {}
+            bisect.insort(self.levels, stars)
+        bucket[player_id] = None
+        self.size += 1
+
+    def discard(self, player_id, stars):
+        bucket = self.buckets.get(stars)
+        if bucket is None or player_id not in bucket:
+            return
+        del bucket[player_id]
+        self.size -= 1
+        if not bucket:
+            del self.buckets[stars]
+            del self.levels[bisect.bisect_left(self.levels, stars)]
+
+    def above(self, stars):
+        # How many players have more stars
+        return sum(len(self.buckets[level]) for level in self.levels[bisect.bisect_right(self.levels, stars):])
+
+    def page(self, start, stop):
+        # (rank, player_id, stars) for positions [start, stop) from the top.
+        # Ties share a rank (1, 2, 2, 4); within a tie players keep the order
+        # they reached that star count in.
+        entries = []
+        position = 0
+        for stars in reversed(self.levels):
+            bucket = self.buckets[stars]
+            if position + len(bucket) <= start:
+                position += len(bucket)
+                continue
+            rank = position + 1
+            for player_id in bucket:
+                if position >= stop:
+                    return entries
+                if position >= start:
+                    entries.append((rank, player_id, stars))
+                position += 1
+        return entries
+
+
+class Rankings:
+    # Player leaderboards and the team ranking by cap usage, kept in step
+    # by League with every roster, star and cap change (like TeamTotals).
+    #
+    # Players are bucketed by stars three ways: everyone, per team, and the
+    # free agents (group None). Free agents with 0 stars, most registered
+    # members, are only counted in `unlisted`; they tie at 0 stars and are
+    # left off the pages. Teams are a list sorted by (-usage, name), so a
+    # change moves one entry found by bisect.
+
+    def __init__(self):
+        self.everyone = StarBuckets()
+        self.groups = {}
+        self.unlisted = 0
+        self.teams = []
+        self._team_keys = {}
+
+    @classmethod
+    def build(cls, teams, players, totals):
+        # Recompute everything from scratch; used on load and for /checktotals
+        rankings = cls()
+        listed = 0
+        for player_id, team_name, stars in players.rows(bare=False):
+            rankings.add_player(player_id, team_name, stars)
+            listed += 1
+        rankings.unlisted = len(players) - listed
+        for team_name in teams:
+            rankings.update_team(team_name, totals.total(team_name), totals.cap(team_name))
+        return rankings
+
+    # Players
+
+    def _buckets(self, group):
+        if group is ALL:
+            return self.everyone
+        return self.groups.get(group) or StarBuckets()
+
+    def add_player(self, player_id, team_name, stars):
+        if team_name is None and not stars:
+            self.unlisted += 1
+            return
+        self.everyone.add(player_id, stars)
+        buckets = self.groups.get(team_name)
+        if buckets is None:
+            buckets = self.groups[team_name] = StarBuckets()
+        buckets.add(player_id, stars)
+
+    def remove_player(self, player_id, team_name, stars):
+        if team_name is None and not stars:
+            self.unlisted -= 1
+            return
+        self.everyone.discard(player_id, stars)
+        buckets = self.groups.get(team_name)
+        if buckets is not None:
+            buckets.discard(player_id, stars)
+            if not buckets:
+                del self.groups[team_name]
+
+    def count(self, group=ALL):
+        # Players in the group, counting the unlisted free agents
+        listed = len(self._buckets(group))
+        return listed + self.unlisted if group is ALL or group is None else listed
+
+    def listed(self, group=ALL):
+        # Players that appear on the group's pages
+        return len(self._buckets(group))
+
+    def rank(self, stars, group=ALL):
+        # The rank a player with `stars` has in the group
+        above = self._buckets(group).above(stars)
+        if stars < 0 and (group is ALL or group is None):
+            above += self.unlisted
+        return above + 1
+
+    def page(self, start, stop, group=ALL):
+        entries = self._buckets(group).page(start, stop)
+        if group is ALL or group is None:
+            # The unlisted free agents rank above anyone below 0 stars
+            entries = [(rank + self.unlisted if stars < 0 else rank, player_id, stars) for rank, player_id, stars in entries]
+        return entries
+
+    # Teams
+
+    def update_team(self, team_name, total, cap):
+        self.remove_team(team_name)
+        usage = total / cap if cap > 0 else (math.inf if total > 0 else 0.0)
+        key = self._team_keys[team_name] = (-usage, team_name)
+        bisect.insort(self.teams, key)
+
+    def remove_team(self, team_name):
+        key = self._team_keys.pop(team_name, None)
+        if key is not None:
+            del self.teams[bisect.bisect_left(self.teams, key)]
+
+    def team_rank(self, team_name):
+        return bisect.bisect_left(self.teams, self._team_keys[team_name]) + 1
+
+    def team_page(self, start, stop):
+        # (rank, team_name, usage) from the highest cap usage down
+        return [(rank, team_name, -usage) for rank, (usage, team_name) in enumerate(self.teams[start:stop], start + 1)]
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from members import member_chunks
+from metrics import get_logger
+
+log = get_logger('aaflbot.resync')
+
+
+class Resync:
+    # One pass over a guild's member list that brings its league in line:
+    # members who aren't players yet become free agents, and players who
+    # are no longer members are removed from the league and their rosters.
+    #
+    # Joins and leaves are applied as they happen (on_member_join /
+    # on_raw_member_remove), so this is only a catch-up for what was missed
+    # while the bot was offline. It runs as a background task, one batch at a
+    # time, handing the event loop back between batches so commands keep
+    # being served. Members that join while it runs are reported through
+    # saw() so they are not taken for departed. Departed players are only
+    # removed when the whole member list was read.
+
+    def __init__(self, league, guild, batch=1000, progress=None, progress_seconds=2.0):
+        # progress(resync) is a coroutine called at most every
+        # progress_seconds while running, and once at the end
+        self.league = league
+        self.guild = guild
+        self.batch = batch
+        self.progress = progress
+        self.progress_seconds = progress_seconds
+        self.checked = 0
+        self.added = 0
+        self.removed = 0
+        self.released = 0
+        self.finished = False
+        self.error = None
+        self.started_at = None
+        self._seen = set()
+        self._reported_at = 0.0
+        self._task = None
+
+    @property
+    def total(self):
+        # Members in the guild as far as Discord has told us
+        return getattr(self.guild, 'member_count', None) or self.checked
+
+    def saw(self, player_id):
+        self._seen.add(player_id)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def wait(self):
+        if self._task is not None:
+            await self._task
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _report(self, force=False):
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if force or now - self._reported_at >= self.progress_seconds:
+            self._reported_at = now
+            try:
+                await self.progress(self)
+            except Exception:
+                log.exception('resync_progress_failed', guild=self.guild.id)
+
+    async def run(self):
+        self.started_at = time.monotonic()
+        try:
+            # Checking each batch against one snapshot of the stored IDs is
+            # cheaper than a search of the free agent array per batch
+            known = self.league.players.ids()
+            async for members in member_chunks(self.guild, self.batch):
+                self.checked += len(members)
+                member_ids = {member.id for member in members}
+                self._seen.update(member_ids)
+                member_ids.difference_update(known)
+                if member_ids:
+                    self.added += self.league.register_players(member_ids)
+                await self._report()
+                await asyncio.sleep(0)
+
+            # Everyone left over is no longer in the guild
+            seen = self._seen
+            known.difference_update(seen)
+            departed = list(known)
+            for start in range(0, len(departed), self.batch):
+                batch = [player_id for player_id in departed[start:start + self.batch] if player_id not in seen]
+                self.released += self.league.remove_players(batch)
+                self.removed += len(batch)
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
+            log.exception('resync_failed', guild=self.guild.id, checked=self.checked)
+        finally:
+            self.finished = True
+        log.info('resync_done', guild=self.guild.id, checked=self.checked, added=self.added, removed=self.removed,
+                 released=self.released, seconds=round(time.monotonic() - self.started_at, 3))
+        await self._report(force=True)
@@ -0,0 +1,133 @@
+import asyncio
+import discord
+
+from metrics import get_logger
+
+log = get_logger('aaflbot.rolesync')
+
+
+class RoleSync:
+    # Keeps members' team roles in line with the league.
+    #
+    # Mutations mark player IDs dirty; a background runner wakes up, works out
+    # which team roles each dirty member should have versus what they have,
+    # and only for members where the two differ issues a single
+    # `member.edit(roles=...)`. A small pool of workers bounds how many edits
+    # are in flight so bursts don't run straight into the rate limits.
+
+    def __init__(self, bot, team_of, team_names, members=None, guild_id=None, workers=4, retry_delay=5.0):
+        # team_of(player_id) -> team name or None
+        # team_names() -> collection of every team name (the managed roles)
+        # members: MemberCache for members discord.py doesn't have cached
+        # guild_id: the one guild whose league this is; None for every guild
+        self.bot = bot
+        self.guild_id = guild_id
+        self.members = members
+        self.team_of = team_of
+        self.team_names = team_names
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.dirty = set()
+        self.edits = 0
+        self._wakeup = asyncio.Event()
+        self._runner = None
+
+    def mark(self, player_id):
+        self.dirty.add(player_id)
+        self._wakeup.set()
+
+    def mark_many(self, player_ids):
+        self.dirty.update(player_ids)
+        if self.dirty:
+            self._wakeup.set()
+
+    def start(self):
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self.drain()
+            except Exception:
+                log.exception('role_sync_failed')
+
+    def desired_roles(self, member, roles_by_name, managed):
+        # Keep every non-team role the member has, drop team roles that are
+        # not theirs, and add the one for their current team
+        team_name = self.team_of(member.id)
+        wanted = roles_by_name.get(team_name) if team_name else None
+
+        roles = [role for role in member.roles if not role.is_default() and (role.name not in managed or role == wanted)]
+        if wanted is not None and wanted not in roles:
+            roles.append(wanted)
+        return roles
+
+    async def drain(self):
+        if not self.dirty:
+            return
+        batch, self.dirty = self.dirty, set()
+
+        managed = set(self.team_names())
+        if self.guild_id is None:
+            guilds = self.bot.guilds
+        else:
+            guild = self.bot.get_guild(self.guild_id)
+            guilds = [guild] if guild is not None else []
+        for guild in guilds:
+            # One pass over the guild's roles per batch instead of a linear
+            # lookup per member
+            roles_by_name = {role.name: role for role in guild.roles if role.name in managed}
+
+            if self.members is not None and not guild.chunked:
+                # No member list (lean mode): resolve the batch in bulk
+                get_member = (await self.members.get_many(guild, batch)).get
+            else:
+                get_member = guild.get_member
+
+            queue = asyncio.Queue()
+            for player_id in batch:
+                member = get_member(player_id)
+                if member is None:
+                    continue
+                roles = self.desired_roles(member, roles_by_name, managed)
+                if set(roles) != set(role for role in member.roles if not role.is_default()):
+                    queue.put_nowait((member, roles))
+
+            if queue.empty():
+                continue
+
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(min(self.workers, queue.qsize()))]
+            try:
+                await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+
+    async def _worker(self, queue):
+        while True:
+            member, roles = await queue.get()
+            try:
+                updated = await member.edit(roles=roles, reason='Team role sync')
+                self.edits += 1
+                if self.members is not None:
+                    # Keep a cached copy from going stale and being edited again
+                    if updated is not None:
+                        self.members.put(member.guild.id, member.id, updated)
+                    else:
+                        self.members.discard(member.guild.id, member.id)
+            except discord.HTTPException as e:
+                log.warning('role_edit_failed', member=member.id, status=e.status, error=str(e))
+                if e.status == 429 or e.status >= 500:
+                    # Let the next pass pick the member up again after a pause
+                    await asyncio.sleep(self.retry_delay)
+                    self.mark(member.id)
+            finally:
+                queue.task_done()
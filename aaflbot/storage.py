@@ -0,0 +1,382 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import zlib
+
+from players import PlayerStore
+
+
+class Storage:
+    # Base class for league persistence backends.
+    #
+    # Commands keep working against the in-memory `teams`/`players` maps and
+    # only tell the storage which keys changed. The backend coalesces those
+    # keys and writes them out in batches from `flush()`, so a command never
+    # waits on disk.
+
+    def __init__(self):
+        self.teams = {}
+        self.players = PlayerStore()
+        self.actions = {}
+        self.settings = {}
+        self._dirty_teams = set()
+        self._dirty_players = set()
+        self._dirty_actions = set()
+        self._dirty_settings = False
+        self._flush_lock = asyncio.Lock()
+
+    def load(self, teams, players):
+        # Fill the given dicts from the backend and keep references to them
+        # so later flushes can read the current values.
+        self.teams = teams
+        self.players = players
+
+    def load_actions(self, actions):
+        # Same as load() for pending actions (open offers keyed by message ID)
+        self.actions = actions
+
+    def load_settings(self, settings):
+        # Same as load() for the league's settings (a plain dict)
+        self.settings = settings
+
+    def save_team(self, team_name):
+        self._dirty_teams.add(team_name)
+
+    def save_player(self, player_id):
+        self._dirty_players.add(player_id)
+
+    def save_action(self, message_id):
+        self._dirty_actions.add(message_id)
+
+    def save_settings(self):
+        self._dirty_settings = True
+
+    @property
+    def pending(self):
+        return len(self._dirty_teams) + len(self._dirty_players) + len(self._dirty_actions) + self._dirty_settings
+
+    def _take_batch(self):
+        # Serialize the dirty rows on the event loop so the values written
+        # are a consistent view of the dicts at this moment. A value of None
+        # means the key was deleted.
+        team_rows = {}
+        for team_name in self._dirty_teams:
+            team_data = self.teams.get(team_name)
+            team_rows[team_name] = None if team_data is None else encode_team(team_data)
+
+        player_rows = {}
+        for player_id in self._dirty_players:
+            player_rows[player_id] = ((self.players.team_of(player_id), self.players.stars_of(player_id))
+                                      if player_id in self.players else None)
+
+        action_rows = {}
+        for message_id in self._dirty_actions:
+            action = self.actions.get(message_id)
+            action_rows[message_id] = None if action is None else json.dumps(action, separators=(',', ':'))
+
+        settings = json.dumps(self.settings, separators=(',', ':')) if self._dirty_settings else None
+
+        self._dirty_teams = set()
+        self._dirty_players = set()
+        self._dirty_actions = set()
+        self._dirty_settings = False
+        return team_rows, player_rows, action_rows, settings
+
+    def _restore_batch(self, team_rows, player_rows, action_rows, settings):
+        # A batch that failed to write is dirty again, along with whatever
+        # changed since it was taken
+        self._dirty_teams.update(team_rows)
+        self._dirty_players.update(player_rows)
+        self._dirty_actions.update(action_rows)
+        self._dirty_settings = self._dirty_settings or settings is not None
+
+    async def _write_pending(self):
+        # Called with _flush_lock held
+        batch = self._take_batch()
+        try:
+            await asyncio.to_thread(self.write_batch, *batch)
+        except BaseException:
+            self._restore_batch(*batch)
+            raise
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            await self._write_pending()
+
+    def write_batch(self, team_rows, player_rows, action_rows, settings=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStorage(Storage):
+    # Keeps nothing; used when persistence is disabled.
+
+    def write_batch(self, team_rows, player_rows, action_rows, settings=None):
+        pass
+
+
+def team_record(team_data):
+    return {
+        'players': list(team_data['players']),
+        'captain': team_data.get('captain'),
+        'rostercap': team_data.get('rostercap'),
+    }
+
+
+def team_from_record(data):
+    team_data = {'players': data['players'], 'captain': data['captain']}
+    if data.get('rostercap') is not None:
+        team_data['rostercap'] = data['rostercap']
+    return team_data
+
+
+def encode_team(team_data):
+    return json.dumps(team_record(team_data), separators=(',', ':'))
+
+
+def decode_team(raw):
+    return team_from_record(json.loads(raw))
+
+
+class SQLiteStorage(Storage):
+    # SQLite backend in WAL mode.
+    #
+    # Every flushed batch is one transaction stamped with an increasing
+    # sequence number. Periodically the whole league is written as a single
+    # compressed snapshot blob, so startup reads that blob plus the handful of
+    # rows changed since, instead of decoding every row one by one.
+    #
+    # Each guild's league is a partition of the same tables, keyed by guild
+    # ID, with its own sequence numbers, snapshot and settings; a
+    # SQLiteStorage reads and writes one partition, or with no guild ID only
+    # the pending actions. A database written before leagues were
+    # partitioned has its one league moved to partition 0, which is never a
+    # guild, until a guild adopts it.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS guilds (id INTEGER PRIMARY KEY, seq INTEGER NOT NULL DEFAULT 0, settings TEXT);
+        CREATE TABLE IF NOT EXISTS teams (guild INTEGER NOT NULL, name TEXT NOT NULL, data TEXT, seq INTEGER NOT NULL, PRIMARY KEY (guild, name));
+        CREATE TABLE IF NOT EXISTS players (guild INTEGER NOT NULL, id INTEGER NOT NULL, team TEXT, stars INTEGER, deleted INTEGER NOT NULL DEFAULT 0, seq INTEGER NOT NULL, PRIMARY KEY (guild, id));
+        CREATE TABLE IF NOT EXISTS actions (message_id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS snapshot (guild INTEGER PRIMARY KEY, seq INTEGER NOT NULL, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS teams_seq ON teams (guild, seq);
+        CREATE INDEX IF NOT EXISTS players_seq ON players (guild, seq);
+    """
+
+    def __init__(self, path, guild_id=None, snapshot_every=50):
+        super().__init__()
+        self.path = path
+        self.guild_id = guild_id
+        self.snapshot_every = snapshot_every
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._seq = 0
+        self._snapshot_seq = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._migrate(self._conn)
+            self._conn.executescript(self.SCHEMA)
+        return self._conn
+
+    def _migrate(self, conn):
+        # Tables from before the guild partitions: their rows become
+        # partition 0
+        def unpartitioned():
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(teams)')]
+            return bool(columns) and 'guild' not in columns
+
+        if not unpartitioned():
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another connection may have got here first
+            if unpartitioned():
+                conn.execute('DROP INDEX IF EXISTS teams_seq')
+                conn.execute('DROP INDEX IF EXISTS players_seq')
+                for table in ('teams', 'players', 'snapshot'):
+                    conn.execute(f'ALTER TABLE {table} RENAME TO {table}_v1')
+                # executescript() would commit, so one statement at a time
+                for statement in self.SCHEMA.split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute('INSERT INTO teams (guild, name, data, seq) SELECT 0, name, data, seq FROM teams_v1')
+                conn.execute('INSERT INTO players (guild, id, team, stars, deleted, seq) '
+                             'SELECT 0, id, team, stars, deleted, seq FROM players_v1')
+                conn.execute('INSERT INTO snapshot (guild, seq, data) SELECT 0, seq, data FROM snapshot_v1')
+                conn.execute("INSERT INTO guilds (id, seq) SELECT 0, value FROM meta WHERE key = 'seq'")
+                conn.execute("DELETE FROM meta WHERE key = 'seq'")
+                for table in ('teams', 'players', 'snapshot'):
+                    conn.execute(f'DROP TABLE {table}_v1')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _has_league(conn, guild_id):
+        return any(conn.execute(f'SELECT 1 FROM {table} WHERE guild = ? LIMIT 1', (guild_id,)).fetchone()
+                   for table in ('snapshot', 'teams', 'players'))
+
+    def guild_ids(self):
+        # Guilds with a stored league, not counting partition 0
+        with self._conn_lock:
+            conn = self._connect()
+            return sorted({guild_id for table in ('snapshot', 'teams', 'players')
+                           for guild_id, in conn.execute(f'SELECT DISTINCT guild FROM {table} WHERE guild != 0')})
+
+    def has_league(self, guild_id=None):
+        with self._conn_lock:
+            return self._has_league(self._connect(), self.guild_id if guild_id is None else guild_id)
+
+    def adopt(self, from_guild_id=0):
+        # Move another partition's league (by default the one from before
+        # partitioning) into this one; only while this one is empty and
+        # before load(). Returns whether anything was moved.
+        with self._conn_lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self._has_league(conn, self.guild_id) or not self._has_league(conn, from_guild_id):
+                    conn.execute('ROLLBACK')
+                    return False
+                for table in ('teams', 'players', 'snapshot'):
+                    conn.execute(f'UPDATE {table} SET guild = ? WHERE guild = ?', (self.guild_id, from_guild_id))
+                conn.execute('INSERT OR REPLACE INTO guilds (id, seq, settings) SELECT ?, seq, settings FROM guilds WHERE id = ?',
+                             (self.guild_id, from_guild_id))
+                conn.execute('UPDATE guilds SET settings = NULL WHERE id = ?', (from_guild_id,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return True
+
+    def load(self, teams, players):
+        super().load(teams, players)
+        with self._conn_lock:
+            conn = self._connect()
+            row = conn.execute('SELECT seq FROM guilds WHERE id = ?', (self.guild_id,)).fetchone()
+            self._seq = row[0] if row else 0
+
+            row = conn.execute('SELECT seq, data FROM snapshot WHERE guild = ?', (self.guild_id,)).fetchone()
+            if row:
+                self._snapshot_seq = row[0]
+                snap = json.loads(zlib.decompress(row[1]))
+                for team_name, record in snap['teams'].items():
+                    teams[team_name] = team_from_record(record)
+                for player_id, team_name, stars in snap['players']:
+                    players.put(player_id, team_name, stars)
+
+            # Replay only what changed after the snapshot was taken
+            for team_name, raw in conn.execute('SELECT name, data FROM teams WHERE guild = ? AND seq > ?',
+                                               (self.guild_id, self._snapshot_seq)):
+                if raw is None:
+                    teams.pop(team_name, None)
+                else:
+                    teams[team_name] = decode_team(raw)
+
+            for player_id, team_name, stars, deleted in conn.execute(
+                    'SELECT id, team, stars, deleted FROM players WHERE guild = ? AND seq > ?', (self.guild_id, self._snapshot_seq)):
+                if deleted:
+                    players.pop(player_id, None)
+                else:
+                    players.put(player_id, team_name, stars)
+
+    def load_actions(self, actions):
+        super().load_actions(actions)
+        with self._conn_lock:
+            conn = self._connect()
+            for message_id, raw in conn.execute('SELECT message_id, data FROM actions'):
+                actions[message_id] = json.loads(raw)
+
+    def load_settings(self, settings):
+        super().load_settings(settings)
+        with self._conn_lock:
+            conn = self._connect()
+            row = conn.execute('SELECT settings FROM guilds WHERE id = ?', (self.guild_id,)).fetchone()
+            if row and row[0]:
+                settings.update(json.loads(row[0]))
+
+    def write_batch(self, team_rows, player_rows, action_rows, settings=None):
+        with self._conn_lock:
+            conn = self._connect()
+            seq = self._seq + 1
+            guild_id = self.guild_id
+            conn.execute('BEGIN')
+            try:
+                conn.executemany(
+                    'INSERT INTO teams (guild, name, data, seq) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(guild, name) DO UPDATE SET data = excluded.data, seq = excluded.seq',
+                    [(guild_id, team_name, raw, seq) for team_name, raw in team_rows.items()])
+                conn.executemany(
+                    'INSERT INTO players (guild, id, team, stars, deleted, seq) VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(guild, id) DO UPDATE SET team = excluded.team, stars = excluded.stars, '
+                    'deleted = excluded.deleted, seq = excluded.seq',
+                    [(guild_id, player_id, row[0], row[1], 0, seq) if row else (guild_id, player_id, None, None, 1, seq)
+                     for player_id, row in player_rows.items()])
+                conn.executemany('INSERT OR REPLACE INTO actions (message_id, data) VALUES (?, ?)',
+                                 [(message_id, raw) for message_id, raw in action_rows.items() if raw is not None])
+                conn.executemany('DELETE FROM actions WHERE message_id = ?',
+                                 [(message_id,) for message_id, raw in action_rows.items() if raw is None])
+                if guild_id is not None:
+                    conn.execute('INSERT INTO guilds (id, seq) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET seq = excluded.seq',
+                                 (guild_id, seq))
+                if settings is not None and guild_id is not None:
+                    conn.execute('UPDATE guilds SET settings = ? WHERE id = ?', (settings, guild_id))
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            self._seq = seq
+
+    def _snapshot_blob(self):
+        snap = {
+            'teams': {team_name: team_record(team_data) for team_name, team_data in self.teams.items()},
+            'players': [[player_id, team_name, stars] for player_id, team_name, stars in self.players.rows()],
+        }
+        return json.dumps(snap, separators=(',', ':')).encode()
+
+    def write_snapshot(self, seq, blob):
+        data = zlib.compress(blob, 1)
+        with self._conn_lock:
+            conn = self._connect()
+            conn.execute('BEGIN')
+            try:
+                conn.execute('INSERT OR REPLACE INTO snapshot (guild, seq, data) VALUES (?, ?, ?)', (self.guild_id, seq, data))
+                # Tombstones older than the snapshot are no longer needed
+                conn.execute('DELETE FROM teams WHERE guild = ? AND data IS NULL AND seq <= ?', (self.guild_id, seq))
+                conn.execute('DELETE FROM players WHERE guild = ? AND deleted = 1 AND seq <= ?', (self.guild_id, seq))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self._snapshot_seq = seq
+
+    async def flush(self):
+        await super().flush()
+        if self.guild_id is not None and self._seq - self._snapshot_seq >= self.snapshot_every:
+            await self.snapshot()
+
+    async def snapshot(self):
+        async with self._flush_lock:
+            # Pending writes must land first so the snapshot seq covers them
+            if self.pending:
+                await self._write_pending()
+            blob = self._snapshot_blob()
+            await asyncio.to_thread(self.write_snapshot, self._seq, blob)
+
+    def close(self):
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
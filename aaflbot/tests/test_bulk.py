@@ -0,0 +1,77 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk  # noqa: E402
+from league import League  # noqa: E402
+
+
+class ParseRowsTest(unittest.TestCase):
+    def errors(self, filename, data):
+        with self.assertRaises(bulk.ImportErrors) as raised:
+            bulk.parse_rows(filename, data)
+        return raised.exception.errors
+
+    def test_json_rows(self):
+        rows = bulk.parse_rows('league.json', b'{"rows": [{"team": "Sharks", "player": 1, "stars": 3}]}')
+        self.assertEqual(rows, [(1, {'team': 'Sharks', 'player': '1', 'stars': '3', 'rostercap': '', 'captain': ''})])
+
+    def test_invalid_json(self):
+        errors = self.errors('league.json', b'[{"team": ')
+        self.assertEqual([row for row, _ in errors], [0])
+
+    def test_json_not_a_list(self):
+        self.assertEqual(self.errors('league.json', b'5'), [(0, 'expected a list of rows')])
+        self.assertEqual(self.errors('league.json', b'{"rows": "Sharks"}'), [(0, 'expected a list of rows')])
+
+    def test_json_rows_not_objects(self):
+        errors = self.errors('league.json', b'[{"team": "Sharks"}, 3, ["Jets"]]')
+        self.assertEqual(errors, [(2, 'row is not an object'), (3, 'row is not an object')])
+
+    def test_not_utf8(self):
+        errors = self.errors('league.csv', b'team,player\n\xff,1\n')
+        self.assertEqual([row for row, _ in errors], [0])
+
+    def test_csv_missing_columns(self):
+        self.assertEqual(self.errors('league.csv', b'team,stars\nSharks,3\n'), [(1, 'missing column(s): player')])
+
+
+class PlanImportTest(unittest.TestCase):
+    def league(self):
+        league = League()
+        league.create_team('Sharks', cap=10)
+        league.register_player(1)
+        league.assign(1, 'Sharks')
+        league.set_stars(1, 3)
+        return league
+
+    def snapshot(self, league):
+        return ({team_name: (dict(team_data['players']), team_data.get('rostercap')) for team_name, team_data in league.teams.items()},
+                sorted(league.players.rows()), league.totals.total('Sharks'))
+
+    def test_out_of_range_rejects_whole_batch(self):
+        league = self.league()
+        before = self.snapshot(league)
+        rows = bulk.parse_rows('league.csv', b'team,player,stars,rostercap\n'
+                                             b'Sharks,2,1,99999999999999999999\n'
+                                             b'Sharks,3,99999999999999999999,\n'
+                                             b'Jets,123456789012345678901234,1,\n'
+                                             b',-5,,\n'
+                                             b'Sharks,4,1,\n')
+        with self.assertRaises(bulk.ImportErrors) as raised:
+            bulk.plan_import(league, rows)
+        self.assertEqual([row for row, _ in raised.exception.errors], [2, 3, 4, 5])
+        self.assertEqual(self.snapshot(league), before)
+
+    def test_largest_values(self):
+        league = self.league()
+        rows = bulk.parse_rows('league.csv', f'team,player,stars,rostercap\nJets,{bulk.MAX_VALUE},{bulk.MAX_VALUE},{bulk.MAX_VALUE}\n'.encode())
+        bulk.apply_import(league, bulk.plan_import(league, rows))
+        self.assertEqual(league.team_of(bulk.MAX_VALUE), 'Jets')
+        self.assertEqual(league.stars_of(bulk.MAX_VALUE), bulk.MAX_VALUE)
+
+
+if __name__ == '__main__':
+    unittest.main()
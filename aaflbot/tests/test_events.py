@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from events import REPAIR_BLOCK, EventLog  # noqa: E402
+
+
+def big_rosters():
+    # 500 teams of 10, the bench's largest league: a checkpoint line well
+    # over one REPAIR_BLOCK
+    return {f'Team {team}': list(range(10 ** 17 + team * 10, 10 ** 17 + team * 10 + 10)) for team in range(500)}
+
+
+class EventLogRepairTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'league.events')
+
+    def write_log(self):
+        async def write():
+            event_log = EventLog(self.path, rosters=big_rosters)
+            event_log.append('assign', {'player': 1, 'from_team': None, 'to_team': 'Team 0', 'source': 'sign'})
+            event_log.checkpoint()
+            await event_log.flush()
+            event_log.close()
+            return event_log.seq
+        return asyncio.run(write())
+
+    def reopen(self):
+        async def reopen():
+            event_log = EventLog(self.path, rosters=dict)
+            await event_log.start()
+            event_log.close()
+            return event_log
+        return asyncio.run(reopen())
+
+    def test_long_last_line(self):
+        seq = self.write_log()
+        size = os.path.getsize(self.path)
+        self.assertGreater(size, REPAIR_BLOCK)
+
+        event_log = self.reopen()
+        self.assertEqual(event_log.seq, seq)
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(len(event_log.checkpoint_offsets), 1)
+
+    def test_long_torn_last_line(self):
+        seq = self.write_log()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as fp:
+            fp.write(json.dumps({'seq': seq + 1, 'kind': 'checkpoint', 'rosters': big_rosters()}).encode()[:2 * REPAIR_BLOCK])
+
+        event_log = self.reopen()
+        self.assertEqual(event_log.seq, seq)
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(len(event_log.checkpoint_offsets), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from league import League  # noqa: E402
+
+
+class AssignTest(unittest.TestCase):
+    def test_id_out_of_range_changes_nothing(self):
+        league = League()
+        league.create_team('Sharks', cap=10)
+        changed = []
+        league.on_change(team=changed.append, player=changed.append)
+
+        with self.assertRaises(OverflowError):
+            league.assign(2 ** 64, 'Sharks')
+        self.assertEqual(league.roster('Sharks'), [])
+        self.assertEqual(league.totals.count('Sharks'), 0)
+        self.assertNotIn(2 ** 64, league.players)
+        self.assertEqual(list(league.players.rows()), [])
+        self.assertEqual(changed, [])
+
+        league.register_player(1)
+        league.assign(1, 'Sharks')
+        self.assertEqual(league.roster('Sharks'), [1])
+        self.assertEqual(league.team_of(1), 'Sharks')
+
+
+if __name__ == '__main__':
+    unittest.main()
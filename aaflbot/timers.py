@@ -0,0 +1,85 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from metrics import get_logger
+
+log = get_logger('aaflbot.timers')
+
+
+class TimerHeap:
+    # Many deadlines, one sleeping task.
+    #
+    # Deadlines are wall-clock timestamps (so they can be persisted and
+    # rescheduled after a restart) kept in a heap. A single task sleeps until
+    # the earliest one and calls `callback(key)` when it is due. Cancelling or
+    # rescheduling a key leaves its old heap entry behind; stale entries are
+    # skipped when they reach the top.
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, when):
+        self._deadlines[key] = when
+        heapq.heappush(self._heap, (when, next(self._counter), key))
+        if self._heap[0][2] == key:
+            # New earliest deadline, the runner has to shorten its sleep
+            self._wakeup.set()
+
+    def cancel(self, key):
+        return self._deadlines.pop(key, None) is not None
+
+    def deadline(self, key):
+        return self._deadlines.get(key)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _drop_stale(self):
+        while self._heap:
+            when, _, key = self._heap[0]
+            if self._deadlines.get(key) == when:
+                return
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._drop_stale()
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            _, _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            try:
+                await self.callback(key)
+            except Exception:
+                log.exception('timer_callback_failed', key=key)
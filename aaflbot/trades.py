@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+
+
+class TradeError(Exception):
+    pass
+
+
+class TradeEngine:
+    # Applies multi-team trades atomically.
+    #
+    # A trade is a list of moves `(player_id, from_team, to_team)`, captured
+    # when the trade is proposed. Executing it takes a lock per team involved,
+    # always in sorted order so two trades can never wait on each other, which
+    # lets trades between disjoint teams run side by side. Under the locks the
+    # moves are re-checked against the current rosters (votes can take a
+    # while), the resulting star totals of every affected team are checked
+    # against their caps in one pass, and the moves are applied, or undone if
+    # anything fails halfway.
+
+    def __init__(self, league):
+        self.league = league
+        self._locks = {}
+
+    def _lock(self, team_name):
+        lock = self._locks.get(team_name)
+        if lock is None:
+            lock = self._locks[team_name] = asyncio.Lock()
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def locked(self, team_names):
+        # Free agents (None) have no team to lock
+        locks = [self._lock(team_name) for team_name in sorted(set(team_names) - {None})]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def validate(self, moves, check_caps=True):
+        league = self.league
+        seen = set()
+
+        for player_id, from_team, to_team in moves:
+            if player_id in seen:
+                raise TradeError(f'<@{player_id}> is in the trade more than once.')
+            seen.add(player_id)
+
+            if to_team is not None and not league.has_team(to_team):
+                raise TradeError(f'Team {to_team} does not exist.')
+            if league.team_of(player_id) != from_team or (from_team is not None and not league.on_roster(from_team, player_id)):
+                raise TradeError(f'<@{player_id}> is no longer on {from_team}.')
+
+        check = league.check_caps(moves)
+        if check_caps and not check.ok:
+            raise TradeError(f'Trade would put {check.describe()}.')
+        return check.after
+
+    async def execute(self, moves, check_caps=True):
+        moves = [tuple(move) for move in moves]
+        teams = {team_name for _, from_team, to_team in moves for team_name in (from_team, to_team)}
+        async with self.locked(teams):
+            self.validate(moves, check_caps)
+
+            applied = []
+            try:
+                for player_id, from_team, to_team in moves:
+                    self.league.assign(player_id, to_team, source='trade')
+                    applied.append((player_id, from_team))
+            except Exception:
+                # Put everyone back where they were
+                for player_id, from_team in reversed(applied):
+                    self.league.assign(player_id, from_team, source='trade_rollback')
+                raise
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from timers import TimerHeap
+
+YES = '👍'
+NO = '👎'
+
+
+class Vote:
+    # Running tally for one vote message.
+    #
+    # Each voter is in at most one of `yes`/`no`; reacting with the other
+    # emoji moves them, removing their reaction takes the vote back.
+
+    def __init__(self, eligible, electorate, quorum):
+        self.eligible = eligible
+        self.electorate = electorate
+        self.quorum = quorum
+        self.yes = set()
+        self.no = set()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def add(self, user_id, emoji):
+        if emoji == YES:
+            self.no.discard(user_id)
+            self.yes.add(user_id)
+        elif emoji == NO:
+            self.yes.discard(user_id)
+            self.no.add(user_id)
+
+    def remove(self, user_id, emoji):
+        if emoji == YES:
+            self.yes.discard(user_id)
+        elif emoji == NO:
+            self.no.discard(user_id)
+
+    def approved(self):
+        cast = len(self.yes) + len(self.no)
+        return cast >= self.quorum and len(self.yes) > len(self.no)
+
+    def decided(self):
+        # True once the result can't change even if every eligible voter who
+        # hasn't voted yet does. Without a known electorate a vote only ends
+        # at its deadline.
+        if self.electorate is None:
+            return False
+        yes, no = len(self.yes), len(self.no)
+        remaining = max(self.electorate - yes - no, 0)
+        if yes + no >= self.quorum and yes > no + remaining:
+            return True
+        if yes + remaining <= no or yes + no + remaining < self.quorum:
+            return True
+        return False
+
+
+class VoteEngine:
+    # Tallies reaction votes straight from raw gateway events.
+    #
+    # `open()` returns a future that resolves to the finished Vote either at
+    # its deadline or as soon as the outcome is decided. Deadlines for all
+    # open votes share one TimerHeap.
+
+    def __init__(self):
+        self.votes = {}
+        self.timers = TimerHeap(self._expire)
+
+    def start(self):
+        self.timers.start()
+
+    def open(self, message_id, duration, eligible, electorate=None, quorum=1):
+        # eligible(member) -> bool decides who may vote; electorate is the
+        # number of eligible voters, used to end the vote early
+        vote = Vote(eligible, electorate, quorum)
+        self.votes[message_id] = vote
+        self.timers.schedule(message_id, time.time() + duration)
+        return vote.future
+
+    def close(self, message_id):
+        vote = self.votes.pop(message_id, None)
+        if vote is None:
+            return
+        self.timers.cancel(message_id)
+        if not vote.future.done():
+            vote.future.set_result(vote)
+
+    async def _expire(self, message_id):
+        self.close(message_id)
+
+    def reaction_add(self, payload):
+        vote = self.votes.get(payload.message_id)
+        if vote is None or payload.member is None or not vote.eligible(payload.member):
+            return False
+        vote.add(payload.user_id, str(payload.emoji))
+        if vote.decided():
+            self.close(payload.message_id)
+        return True
+
+    def reaction_remove(self, payload):
+        vote = self.votes.get(payload.message_id)
+        if vote is None:
+            return False
+        # Only votes that were counted can be taken back, so no eligibility
+        # check is needed (and the raw remove event carries no member)
+        vote.remove(payload.user_id, str(payload.emoji))
+        if vote.decided():
+            self.close(payload.message_id)
+        return True